@@ -0,0 +1,207 @@
+"""Time the analysis and integration code on synthetic populations and compare to a stored baseline.
+
+    python benchmarks/run_benchmarks.py                       # compare to benchmarks/baseline.json
+    python benchmarks/run_benchmarks.py --sizes 1e4 1e5 1e6 1e7
+    python benchmarks/run_benchmarks.py --update-baseline     # record new baseline timings
+
+The script exits with a non-zero status if any benchmark is slower than its baseline by more than the
+tolerance. Timings are the best of several repeats. Baseline timings are scaled by a short calibration
+workload (timed on every run) to correct for how busy the machine is, but are still only really meaningful
+on the machine on which they were recorded (which is saved alongside them).
+"""
+
+import numpy as np
+import astropy.units as u
+import matplotlib
+matplotlib.use("Agg")
+import matplotlib.pyplot as plt
+
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "../src"))
+import helpers
+import observables
+import orbits
+import plotting
+import synthetic
+
+
+BASELINE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+
+
+def setup_kinematics(n):
+    return [synthetic.SyntheticPopulation(n, seed=0)]
+
+
+def run_kinematics(pops):
+    helpers.get_kinematics(pops)
+
+
+def setup_underworld_binaries(n):
+    return [synthetic.SyntheticPopulation(n, seed=0)]
+
+
+def run_underworld_binaries(pops):
+    helpers.get_underworld_binaries(pops)
+
+
+def setup_side_on_density(n):
+    pos, _ = synthetic.phase_space(n, seed=0)
+    pos = pos * u.kpc
+    return [pos[:n // 2, 0], pos[n // 2:, 0]], [pos[:n // 2, 2], pos[n // 2:, 2]]
+
+
+def run_side_on_density(args):
+    xs, zs = args
+    fig, ax = plotting.plot_side_on_density(xs, zs, ["a", "b"], show=False)
+    plt.close(fig)
+
+
+def setup_scale_height(n):
+    return synthetic.phase_space(n, seed=0)[0][:, 2] * u.kpc
+
+
+def run_scale_height(z):
+    plotting.estimate_scale_height(z)
+
+
+def setup_scale_heights(n):
+    """Four populations, like a comparison of kick variations."""
+    return [synthetic.phase_space(n // 4, seed=seed)[0][:, 2] * u.kpc for seed in range(4)]
+
+
+def run_scale_heights(zs):
+    plotting.estimate_scale_heights(zs, n_bootstrap=1000, seed=0)
+
+
+def setup_observables(n):
+    pos, vel = synthetic.phase_space(n, seed=0)
+    return pos * u.kpc, vel * u.km / u.s, observables.Observer()
+
+
+def run_observables(args):
+    pos, vel, observer = args
+    obs = observer.project(pos, vel)
+    observables.SkyMap(64).add(obs["l"], obs["b"])
+
+
+def setup_sweeney_integration(n):
+    """Initial conditions like those of sweeney.py (kicked disc stars with a spread of start times)."""
+    pos, vel = synthetic.phase_space(n, seed=0)
+    rng = np.random.default_rng(1)
+    kicks = rng.normal(0, 150, (n, 3))
+    return pos * u.kpc, (vel + kicks) * u.km / u.s, rng.uniform(0, 50, n) * u.Myr
+
+
+def run_sweeney_integration(args):
+    pos, vel, t1 = args
+    orbits.integrate_orbits(pos=pos, vel=vel, t1=t1, t2=50 * u.Myr, potential=synthetic.milky_way(),
+                            dt=1 * u.Myr, processes=1, progress_bar=False)
+
+
+# name: (setup, run, fraction of each size to use), orbit integration is far more expensive per object
+BENCHMARKS = {
+    "get_kinematics": (setup_kinematics, run_kinematics, 1),
+    "get_underworld_binaries": (setup_underworld_binaries, run_underworld_binaries, 1),
+    "plot_side_on_density": (setup_side_on_density, run_side_on_density, 1),
+    "estimate_scale_height": (setup_scale_height, run_scale_height, 1),
+    "estimate_scale_heights": (setup_scale_heights, run_scale_heights, 1),
+    "project_observables": (setup_observables, run_observables, 1),
+    "sweeney_integration": (setup_sweeney_integration, run_sweeney_integration, 1e-2),
+}
+
+
+def time_benchmark(setup, run, n, repeats):
+    """Best wall time (s) of ``repeats`` calls of ``run`` on the output of ``setup(n)``."""
+    args = setup(n)
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        run(args)
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def calibrate(repeats=5):
+    """Time a fixed workload, so that timings can be corrected for how fast (or busy) the machine is."""
+    rng = np.random.default_rng(0)
+    data = rng.normal(size=1_000_000)
+    matrix = rng.normal(size=(300, 300))
+
+    def workload(_):
+        np.sort(data)
+        np.histogram(data, bins=1000)
+        matrix @ matrix
+
+    return time_benchmark(lambda n: None, workload, 0, repeats)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--sizes", nargs="+", type=float, default=[1e4, 1e5, 1e6],
+                        help="Population sizes to benchmark")
+    parser.add_argument("--only", nargs="+", choices=list(BENCHMARKS), default=list(BENCHMARKS),
+                        help="Benchmarks to run")
+    parser.add_argument("--repeats", type=int, default=3, help="Repeats of each benchmark (best is kept)")
+    parser.add_argument("--tolerance", type=float, default=0.3,
+                        help="Fractional slowdown compared to the baseline that counts as a regression")
+    parser.add_argument("--min-difference", type=float, default=0.01,
+                        help="Slowdowns of fewer seconds than this are ignored as timing noise")
+    parser.add_argument("--baseline", default=BASELINE_FILE, help="Baseline file")
+    parser.add_argument("--update-baseline", action="store_true",
+                        help="Save these timings to the baseline instead of comparing to it")
+    args = parser.parse_args()
+
+    baseline = {"timings": {}}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if not args.update_baseline and baseline.get("host") != platform.node():
+            print(f"Warning: baseline was recorded on {baseline.get('host')}, not this machine "
+                  f"({platform.node()}), so comparisons may not be meaningful")
+
+    # scale the baseline by how much slower the machine is right now than when the baseline was recorded
+    calibration = calibrate()
+    speed = calibration / baseline.get("calibration", calibration)
+    print(f"Calibration workload took {calibration:.4f}s ({speed:.2f}x the baseline run)")
+
+    timings, regressions = {}, []
+    for name in args.only:
+        setup, run, fraction = BENCHMARKS[name]
+        for size in args.sizes:
+            n = max(int(size * fraction), 100)
+            key = f"{name}[{int(size)}]"
+            timings[key] = time_benchmark(setup, run, n, args.repeats)
+
+            message = f"{key:40s} {timings[key]:9.4f}s"
+            if key in baseline["timings"] and not args.update_baseline:
+                expected = baseline["timings"][key] * speed
+                ratio = timings[key] / expected
+                message += f"  ({ratio:5.2f}x baseline)"
+                slower = timings[key] - expected
+                if ratio > 1 + args.tolerance and slower > args.min_difference:
+                    regressions.append(key)
+                    message += "  REGRESSION"
+            print(message)
+
+    if args.update_baseline:
+        baseline["host"] = platform.node()
+        baseline["calibration"] = calibration
+        baseline["updated"] = time.strftime("%Y-%m-%dT%H:%M:%S")
+        baseline["timings"].update(timings)
+        with open(args.baseline, "w") as f:
+            json.dump(baseline, f, indent=2, sort_keys=True)
+        print(f"Saved {len(timings)} timings to {args.baseline}")
+    elif regressions:
+        print(f"{len(regressions)} benchmark(s) are more than {args.tolerance:.0%} slower than the baseline: "
+              f"{regressions}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
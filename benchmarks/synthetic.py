@@ -0,0 +1,83 @@
+"""Small synthetic stand-ins for evolved cogsworth populations, so that the analysis code can be benchmarked
+without any of the production runs on disk.
+"""
+
+import numpy as np
+import pandas as pd
+import astropy.units as u
+import gala.potential as gp
+
+
+# rough mix of final stellar types in an underworld population (most systems contain a NS or BH)
+KSTAR_1_MIX = {13: 0.45, 14: 0.25, 1: 0.1, 10: 0.05, 11: 0.05, 15: 0.1}
+KSTAR_2_MIX = {13: 0.1, 14: 0.05, 0: 0.2, 1: 0.25, 10: 0.1, 11: 0.1, 12: 0.05, 15: 0.15}
+
+_POTENTIAL = {}
+
+
+def milky_way():
+    """The Milky Way potential used in the simulations (created once)."""
+    if "mw" not in _POTENTIAL:
+        _POTENTIAL["mw"] = gp.MilkyWayPotential2022()
+    return _POTENTIAL["mw"]
+
+
+def _choose(rng, mix, n):
+    return rng.choice(list(mix.keys()), size=n, p=list(mix.values())).astype(float)
+
+
+def phase_space(n, seed=0):
+    """Disc-like positions (kpc) and velocities (km/s), each with shape (n, 3)."""
+    rng = np.random.default_rng(seed)
+    R = rng.exponential(3.0, n)
+    phi = rng.uniform(0, 2 * np.pi, n)
+    pos = np.transpose([R * np.cos(phi), R * np.sin(phi), rng.laplace(0, 0.5, n)])
+
+    v_circ = 220 + rng.normal(0, 30, n)
+    vel = np.transpose([-v_circ * np.sin(phi), v_circ * np.cos(phi), rng.normal(0, 30, n)])
+    vel += rng.normal(0, 100, (n, 3))
+    return pos, vel
+
+
+class SyntheticPopulation():
+    """Just enough of an evolved :class:`~cogsworth.pop.Population` for the analysis functions.
+
+    Parameters
+    ----------
+    n : int
+        Number of systems
+    seed : int, optional
+        Random seed. Default is 0.
+    label : str, optional
+        Label of the population. Default is "synthetic".
+    disrupted_fraction : float, optional
+        Fraction of binaries that are disrupted (and so have a second orbit). Default is 0.3.
+    """
+    def __init__(self, n, seed=0, label="synthetic", disrupted_fraction=0.3):
+        rng = np.random.default_rng(seed)
+        self.label = label
+        self.galactic_potential = milky_way()
+        self.mass_binaries = 5.0 * n
+        self._file = None
+
+        self.final_bpp = pd.DataFrame({
+            "mass_1": rng.uniform(1, 30, n),
+            "mass_2": rng.uniform(0.1, 20, n),
+            "kstar_1": _choose(rng, KSTAR_1_MIX, n),
+            "kstar_2": _choose(rng, KSTAR_2_MIX, n),
+            "sep": np.where(rng.uniform(size=n) < disrupted_fraction, -1.0, 10**rng.uniform(0, 4, n)),
+            "porb": 10**rng.uniform(0, 5, n),
+            "bin_num": np.arange(n),
+        })
+        self.bin_nums = self.final_bpp["bin_num"].values
+        self.disrupted = self.final_bpp["sep"].values < 0
+
+        pos, vel = phase_space(n + self.disrupted.sum(), seed=seed + 1)
+        self.final_pos = pos * u.kpc
+        self.final_vel = vel * u.km / u.s
+
+    def __len__(self):
+        return len(self.final_bpp)
+
+    def __repr__(self):
+        return f"<SyntheticPopulation: {len(self)} systems>"
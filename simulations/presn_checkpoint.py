@@ -0,0 +1,31 @@
+import cogsworth
+import astropy.units as u
+
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "../src"))
+import checkpoint
+from profiling import RunProfiler
+
+
+"""Integrate every system in the template from birth up to its first supernova and save its phase space
+position at that moment. The kick variations only change what happens from the first supernova onwards, so
+they can start their orbits from this checkpoint instead of repeating the pre-supernova orbits.
+"""
+
+output_dir = "/mnt/ceph/users/twagg/underworld"
+profiler = RunProfiler("presn_checkpoint", output_dir=output_dir)
+
+with profiler.stage("load template") as stage:
+    template = cogsworth.pop.load(os.path.join(output_dir, "template"))
+    stage["count"] = len(template)
+
+with profiler.stage("create pre-supernova checkpoint") as stage:
+    presn = checkpoint.create_presn_checkpoint(
+        template, dt=0.1 * u.Myr, processes=32,
+        file_name=os.path.join(output_dir, "template-presn-checkpoint.h5")
+    )
+    stage["count"] = len(presn)
+
+print(f"Total time: {profiler.report()['wall_time']:1.2f} seconds, report saved to {profiler.save()}")
@@ -1,45 +1,55 @@
-import cogsworth
-import gala.potential as gp
+import os
+import sys
 
-import time
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "../src"))
+import catalogue
+import checkpoint
+import sweep
+from profiling import RunProfiler
 
-very_start = time.time()
+output_dir = "/mnt/ceph/users/twagg/underworld"
+profiler = RunProfiler(os.path.splitext(os.path.basename(__file__))[0], output_dir=output_dir)
 
-remnantflags = [2, 3]
+# phase space positions at the first supernova, shared by every variation (see presn_checkpoint.py)
+with profiler.stage("load checkpoint"):
+    presn = checkpoint.load_presn_checkpoint(os.path.join(output_dir, "template-presn-checkpoint.h5"))
 
-for remnantflag in remnantflags:
-    print(f"Starting underworld simulation with remnantflag={remnantflag}")
+with profiler.stage("load template") as stage:
+    template = sweep.load_template(os.path.join(output_dir, "template"))
+    stage["count"] = len(template)
 
-    start = time.time()
-    initial_pop = cogsworth.pop.load("/mnt/ceph/users/twagg/underworld/template")
-    print(f"   Loaded template population in {time.time() - start:1.2f} seconds")
 
-    # convert columns back to strings
-    initial_pop.bpp_columns = [col.decode('utf-8') for col in initial_pop.bpp_columns]
+def run_variation(pop, file_name, writer):
+    # each variation writes its own report next to its output
+    name = os.path.basename(file_name)
+    variation_profiler = RunProfiler(name, output_dir=os.path.dirname(file_name))
+    with variation_profiler.stage(f"{name}: stellar evolution", count=len(pop)):
+        pop.perform_stellar_evolution()
 
-    initial_pop.initC["remnantflag"] = remnantflag
+    # do galactic evolution only for the systems that end up as underworld objects
+    with variation_profiler.stage(f"{name}: masking", count=len(pop)):
+        underworld_mask = ((pop.final_bpp['kstar_1'] == 13) | (pop.final_bpp['kstar_1'] == 14) |
+                           (pop.final_bpp['kstar_2'] == 13) | (pop.final_bpp['kstar_2'] == 14))
+        underworld = pop[underworld_mask]
 
-    start = time.time()
-    initial_pop.perform_stellar_evolution()
-    print(f"   Performed stellar evolution in {time.time() - start:1.2f} seconds")
+    del pop
 
-    # do galactic evolution only for the singles that end up as underworld objects
-    start = time.time()
-    underworld_mask = ((initial_pop.final_bpp['kstar_1'] == 13) | (initial_pop.final_bpp['kstar_1'] == 14) |
-                       (initial_pop.final_bpp['kstar_2'] == 13) | (initial_pop.final_bpp['kstar_2'] == 14))
-    underworld = initial_pop[underworld_mask]
+    with variation_profiler.stage(f"{name}: galactic evolution", count=len(underworld)):
+        n_from_checkpoint = checkpoint.perform_galactic_evolution_from_checkpoint(underworld, presn,
+                                                                                  progress_bar=False)
+    variation_profiler.info["n_from_checkpoint"] = int(n_from_checkpoint)
+    variation_profiler.save()
 
-    del initial_pop
+    # save in the background so the next variation can start straight away
+    writer.save(underworld, file_name, overwrite=True)
+    writer.submit(catalogue.export_population, underworld, file_name + ".catalogue",
+                  label=f"export {name}.catalogue")
 
-    underworld.perform_galactic_evolution()
-    print(f"   Performed galactic evolution for singles in {time.time() - start:1.2f} seconds")
 
-    start = time.time()
-    underworld.save(f"/mnt/ceph/users/twagg/underworld/binaries-remnantflag-{remnantflag}",
-                    overwrite=True)
-    print(f"   Saved underworld population in {time.time() - start:1.2f} seconds")
-
-    del underworld
+variations = sweep.parameter_grid(remnantflag=[2, 3])
+with profiler.stage("sweep", count=len(variations)):
+    sweep.run_sweep(template, variations, run_variation, output_dir=output_dir,
+                    prefix="binaries", processes=32, processes_per_variation=16)
 
 print("Underworld simulations complete!")
-print(f"Total time: {time.time() - very_start:1.2f} seconds")
+print(f"Total time: {profiler.report()['wall_time']:1.2f} seconds, report saved to {profiler.save()}")
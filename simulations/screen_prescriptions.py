@@ -0,0 +1,53 @@
+"""Screen single-star remnant prescriptions with the same emulation as sweeney.py before running any of them
+through COSMIC. Each prescription is a set of rules on initial mass (see emulator.Prescription) and each is
+summarised by a PopulationCube of its remnants, which can be compared with the cubes of the full runs.
+"""
+
+import cogsworth
+import numpy as np
+import astropy.units as u
+
+import os
+import re
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "../src"))
+import emulator
+from emulator import Prescription
+from profiling import RunProfiler
+
+
+output_dir = "/mnt/ceph/users/twagg/underworld"
+profiler = RunProfiler("screen_prescriptions", output_dir=output_dir)
+
+remnants = [(8, 25, 13), (25, np.inf, 14)]
+sweeney_kicks = [(8, np.inf, [(0.2, 56), (0.8, 336)])]
+prescriptions = {
+    "Sweeney+22": emulator.SWEENEY,
+    "no BH kicks": Prescription(remnants, [(8, 25, [(0.2, 56), (0.8, 336)])]),
+    "full BH kicks": Prescription(remnants, sweeney_kicks, fallback=[(40, np.inf, 0.0)]),
+    "no direct collapse": Prescription(remnants, sweeney_kicks, fallback=[(25, np.inf, 1.35 / 7.8)]),
+    "BHs from 20 Msun": Prescription([(8, 20, 13), (20, np.inf, 14)], sweeney_kicks,
+                                     fallback=[(20, np.inf, 1.35 / 7.8), (40, np.inf, 0.0)]),
+    "Hobbs+05 kicks": Prescription(remnants, [(8, np.inf, [(1, 265)])],
+                                   fallback=[(25, np.inf, 1.35 / 7.8), (40, np.inf, 0.0)]),
+    "Hobbs+05 NS kicks, no BH kicks": Prescription(remnants, [(8, 25, [(1, 265)])]),
+}
+
+with profiler.stage("load template"):
+    template = cogsworth.pop.load(os.path.join(output_dir, "template"), parts=[])
+
+# prescriptions share initial conditions and seed, so they are integrated together in batches
+with profiler.stage("screen prescriptions", count=len(prescriptions)):
+    cubes = emulator.screen_prescriptions(template, prescriptions, seed=42, prescriptions_per_batch=4,
+                                          dt=1 * u.Myr, chunk_size=10_000, processes=32, progress_bar=False)
+
+cube_dir = os.path.join(output_dir, "prescriptions")
+os.makedirs(cube_dir, exist_ok=True)
+for name, cube in cubes.items():
+    cube.save(os.path.join(cube_dir, re.sub(r"[^a-z0-9]+", "_", name.lower()).strip("_") + ".npz"))
+    escape_fraction = cube.count(escaped=True) / cube.count()
+    print(f"{name:>32}: {cube.count(scale=True):.3e} COs, {escape_fraction:.1%} escaped")
+    profiler.info[name] = {"count": cube.count(), "escape_fraction": escape_fraction}
+
+print(f"Total script time: {profiler.report()['wall_time']:.2f} seconds, report saved to {profiler.save()}")
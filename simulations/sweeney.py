@@ -1,15 +1,17 @@
 import cogsworth
 import numpy as np
-import pandas as pd
-from scipy.stats import maxwell
-import gala.dynamics as gd
-import gala.integrate as gi
 import astropy.units as u
-from multiprocessing import Pool
-from tqdm import tqdm
+import gala.integrate as gi
+
+import os
+import sys
 
-from time import time
-from copy import copy
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "../src"))
+import catalogue
+import emulator
+import orbits
+import tuning
+from profiling import RunProfiler
 
 
 """The Sweeney+2022 paper does a simpler population synthesis that we can emulate instead of using COSMIC
@@ -23,122 +25,110 @@ the other simulations.
 """
 
 
-very_start = time()
+output_dir = "/mnt/ceph/users/twagg/underworld"
+profiler = RunProfiler("sweeney", output_dir=output_dir)
 
 # load the template population
-template = cogsworth.pop.load("/mnt/ceph/users/twagg/underworld/template", parts=[])
-
-print(f"Loaded template population in {time() - very_start:.2f} seconds")
-
-start = time()
-
-# setup a simple population dataframe
-pop = pd.DataFrame({
-    "mass": np.concatenate([template.initC["mass_1"], template.initC["mass_2"]]),
-    "x": np.concatenate([template.initial_galaxy.x, template.initial_galaxy.x]),
-    "y": np.concatenate([template.initial_galaxy.y, template.initial_galaxy.y]),
-    "z": np.concatenate([template.initial_galaxy.z, template.initial_galaxy.z]),
-    "v_R": np.concatenate([template.initial_galaxy.v_R, template.initial_galaxy.v_R]),
-    "v_T": np.concatenate([template.initial_galaxy.v_T, template.initial_galaxy.v_T]),
-    "v_z": np.concatenate([template.initial_galaxy.v_z, template.initial_galaxy.v_z]),
-    "tau": np.concatenate([template.initial_galaxy.tau, template.initial_galaxy.tau]),
-})
-
-# remove anything below 8 solar masses (Sweeney defines remnants as > 8 Msun)
-pop = pop[pop["mass"] > 8]
-
-print(f"Setup population dataframe in {time() - start:.2f} seconds")
-start = time()
-
-# convert velocities to cartesian
-pop["R"] = np.sqrt(pop["x"]**2 + pop["y"]**2)
-pop["v_x"] = -pop["v_T"] * (pop["y"] / pop["R"]) + pop["v_R"] * (pop["x"] / pop["R"])
-pop["v_y"] = pop["v_T"] * (pop["x"] / pop["R"]) + pop["v_R"] * (pop["y"] / pop["R"])
-
-# draw random kicks using their distribution
-n_low_peak = len(pop) // 5
-kicks = np.concatenate((
-    maxwell(scale=56).rvs(size=n_low_peak),
-    maxwell(scale=336).rvs(size=len(pop) - n_low_peak)
-))
-
-# not really necessary, but shuffle to avoid any ordering effects
-np.random.shuffle(kicks)
-pop["kick"] = kicks
-
-# adjust kicks for black holes
-pop.loc[pop["mass"] >= 25, "kick"] *= 1.35 / 7.8
+with profiler.stage("load template"):
+    template = cogsworth.pop.load(os.path.join(output_dir, "template"), parts=[])
 
-# no kick for direct collapse
-pop.loc[pop["mass"] > 40, "kick"] = 0.0
+# setup a simple population dataframe of every star above 8 solar masses (Sweeney defines remnants as > 8 Msun)
+with profiler.stage("setup population") as stage:
+    pop = emulator.sweeney_initial_conditions(template)
+    stage["count"] = len(pop)
 
-# randomly distribute kick
-kick_theta = np.arccos(np.random.uniform(-1, 1, size=len(pop)))
-kick_phi = np.random.uniform(0, 2 * np.pi, size=len(pop))
-pop["kick_x"] = pop["kick"] * np.sin(kick_theta) * np.cos(kick_phi)
-pop["kick_y"] = pop["kick"] * np.sin(kick_theta) * np.sin(kick_phi)
-pop["kick_z"] = pop["kick"] * np.cos(kick_theta)
-
-pop.reset_index(drop=True, inplace=True)
-
-print(f"Prepared kicks and initial conditions in {time() - start:.2f} seconds")
-start = time()
+# draw random kicks using their distribution (see emulator.draw_sweeney_kicks)
+seed = 42
+with profiler.stage("prepare kicks and initial conditions", count=len(pop)):
+    kicks = emulator.draw_sweeney_kicks(pop["mass"].values, np.random.default_rng(seed))
+    pop["kick"] = np.sqrt(np.sum(kicks**2, axis=1))
+    pop[["kick_x", "kick_y", "kick_z"]] = kicks
 
 t1 = template.max_ev_time - pop["tau"].values * u.Gyr
 t2 = template.max_ev_time
 dt = 1 * u.Myr
 
-args = [
-    (gd.PhaseSpacePosition(
-        pos=np.array([pop["x"].iloc[i], pop["y"].iloc[i], pop["z"].iloc[i]]) * u.kpc,
-        vel=np.array([
-            pop["v_x"].iloc[i] + pop["kick_x"].iloc[i],
-            pop["v_y"].iloc[i] + pop["kick_y"].iloc[i],
-            pop["v_z"].iloc[i] + pop["kick_z"].iloc[i],
-        ]) * u.km / u.s,
-    ),
-     t1[i], t2, copy(dt), template.galactic_potential) for i in range(len(pop))
-]
-
-
-def int_func(w0, t1, t2, dt, pot):
-    orbit = None
-    for _ in range(2):
+# set to a radius (e.g. 100 * u.kpc) to propagate unbound remnants analytically once they pass it
+escape_radius = None
+
+# set to an interval (e.g. 500 * u.Myr) to record every remnant that often (streamed to disk) and follow how
+# the population evolves. This writes N x epochs x 6 values and can't be combined with the escaper fast-path,
+# so it is off by default.
+snapshot_every = None
+snapshot_times = None
+if snapshot_every is not None and escape_radius is None:
+    snapshot_times = np.arange(t2.to(u.Myr).value, 0, -snapshot_every.to(u.Myr).value)[::-1] * u.Myr
+
+pos = pop[["x", "y", "z"]].values * u.kpc
+vel = (pop[["v_x", "v_y", "v_z"]].values + pop[["kick_x", "kick_y", "kick_z"]].values) * u.km / u.s
+
+# optionally, pick the cheapest integrator and timestep that is accurate enough on a sample of these orbits.
+# This integrates the sample with every candidate (and a much finer reference) first, so it is off by default
+# and keeps the default integrator and timestep if no candidate is accurate enough.
+Integrator = gi.DOPRI853Integrator
+tune_integrator = False
+if tune_integrator:
+    with profiler.stage("choose integrator") as stage:
+        results = tuning.compare_integrators(pos, vel, t1, t2, potential=template.galactic_potential,
+                                             n_sample=1000, seed=seed, processes=32)
         try:
-            success = False
-            orbit = pot.integrate_orbit(w0, t1=t1, t2=t2, dt=dt,
-                                        Integrator=gi.DOPRI853Integrator, save_all=False)
-            success = True
-        except Exception:
-            dt /= 8
-
-        if success:
-            break
-
-    if orbit is None:
-        ret = np.array([
-            [np.nan, np.nan, np.nan],
-            [np.nan, np.nan, np.nan],
-        ])
-    else:
-        ret = np.array([
-            orbit.pos.xyz[:, -1].to(u.kpc).value,
-            orbit.vel.d_xyz[:, -1].to(u.km / u.s).value,
-        ])
-    return ret
-
-
-with Pool(processes=32) as pool:
-    rets = pool.starmap(int_func, tqdm(args, total=len(args)))
-
-rets = np.array(rets)
-
-pop[["x_final", "y_final", "z_final"]] = rets[:, 0, :]
-pop[["v_x_final", "v_y_final", "v_z_final"]] = rets[:, 1, :]
-
-print(f"Integrated orbits in {time() - start:.2f} seconds")
-
-pop.to_hdf("/mnt/ceph/users/twagg/underworld/sweeney_remnants.h5", key="data", mode="w")
-print(f"Saved population to disk in {time() - start:.2f} seconds")
-
-print(f"Total script time: {time() - very_start:.2f} seconds")
+            Integrator, dt = tuning.choose_integrator(results, pos_tol=1e-2, energy_tol=1e-3, quantity="p99")
+        except ValueError as e:
+            print(f"Warning: {e}, using {Integrator.__name__} with dt={dt} instead")
+        stage["count"] = len(results)
+    profiler.info["integrators"] = (results.drop(columns=["Integrator", "pos_err", "energy_drift"])
+                                    .assign(frac_over_tol=tuning.fraction_over_tolerance(results, 1e-2, 1e-3))
+                                    .to_dict(orient="records"))
+    profiler.info["integrator"] = {"name": Integrator.__name__, "dt": dt.to(u.Myr).value}
+
+# integrate the orbits in chunks that share a start time, only arrays are sent to the workers
+with profiler.stage("galactic evolution", count=len(pop)) as stage:
+    final_pos, final_vel, *snapshots, info = orbits.integrate_orbits(
+        pos=pos, vel=vel, t1=t1, t2=t2, potential=template.galactic_potential, dt=dt, Integrator=Integrator,
+        chunk_size=10_000, processes=32, escape_radius=escape_radius, snapshot_times=snapshot_times,
+        snapshot_file=os.path.join(output_dir, "sweeney_snapshots.npy"), return_info=True
+    )
+    stage["workers"] = info["workers"]
+    stage["n_retries"] = info["n_retries"]
+    stage["n_failed"] = info["n_failed"]
+
+pop[["x_final", "y_final", "z_final"]] = final_pos.to(u.kpc).value
+pop[["v_x_final", "v_y_final", "v_z_final"]] = final_vel.to(u.km / u.s).value
+
+with profiler.stage("save", count=len(pop)):
+    pop.to_hdf(os.path.join(output_dir, "sweeney_remnants.h5"), key="data", mode="w")
+
+# how the height distribution and escape fraction of the remnants that exist at each epoch evolve
+if snapshot_times is not None:
+    with profiler.stage("summarise snapshots", count=len(pop) * len(snapshot_times)):
+        evolution = []
+        for epoch, time in enumerate(snapshot_times):
+            snapshot = snapshots[0][:, epoch]
+            snapshot = snapshot[np.isfinite(snapshot[:, 0])]
+            v_esc = np.sqrt(-2 * template.galactic_potential.energy(snapshot[:, :3].T * u.kpc))
+            escaped = np.sqrt(np.sum(snapshot[:, 3:]**2, axis=1)) >= v_esc.to(u.km / u.s).value
+            evolution.append({"time": time.to(u.Myr).value, "count": len(snapshot),
+                              "median_abs_z": np.median(np.abs(snapshot[:, 2])) if len(snapshot) else np.nan,
+                              "escape_fraction": escaped.mean() if len(snapshot) else np.nan})
+    profiler.info["snapshots"] = evolution
+
+# the same columnar catalogue as the cogsworth runs, for comparisons
+with profiler.stage("export catalogue", count=len(pop)):
+    catalogue.export_sweeney(pop, os.path.join(output_dir, "sweeney.catalogue"),
+                             potential=template.galactic_potential, mass_binaries=template.mass_binaries)
+
+# optionally, independent realisations of the kicks to measure the Monte Carlo noise of the model (e.g. 32),
+# each is summarised as it finishes rather than saved in full. Every realisation costs as much as the
+# integration above, so this is off by default.
+n_realisations = 0
+if n_realisations > 0:
+    with profiler.stage("ensemble", count=n_realisations * len(pop)):
+        ensemble = emulator.run_sweeney_ensemble(pop, potential=template.galactic_potential, t1=t1, t2=t2,
+                                                 n_realisations=n_realisations, seed=seed + 1,
+                                                 mass_binaries=template.mass_binaries, dt=dt,
+                                                 Integrator=Integrator, chunk_size=10_000, processes=32,
+                                                 progress_bar=False)
+        ensemble.save(os.path.join(output_dir, "sweeney_ensemble"))
+    profiler.info["ensemble_escape_fractions"] = ensemble.escape_fractions().tolist()
+
+print(f"Total script time: {profiler.report()['wall_time']:.2f} seconds, report saved to {profiler.save()}")
@@ -0,0 +1,160 @@
+"""Run the Sweeney+2022 emulation (see sweeney.py) as shards that any number of batch jobs can work on.
+
+    python sweeney_shards.py plan RUN_DIR      # once, writes the initial conditions and shard manifests
+    python sweeney_shards.py work RUN_DIR      # in as many jobs (on as many nodes) as you like
+    python sweeney_shards.py merge RUN_DIR     # once every shard is done, writes the final catalogue
+
+Workers claim shards with lock files in RUN_DIR (which must be on a filesystem shared by every node), so a
+job that is killed only loses the shard that it was working on. Workers refresh their claims while they
+work, so use ``work --stale-after`` to take over the claims of jobs that died.
+"""
+
+import cogsworth
+import numpy as np
+import pandas as pd
+import astropy.units as u
+import gala.integrate as gi
+import gala.potential as gp
+
+import argparse
+import os
+import shutil
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "../src"))
+import catalogue
+import emulator
+import orbits
+from profiling import RunProfiler
+from shards import ShardPlan, run_worker
+
+
+# initial conditions that every shard reads its rows from (memory-mapped)
+COLUMNS = ["mass", "bin_num", "x", "y", "z", "v_x", "v_y", "v_z", "tau"]
+
+
+def plan(args):
+    template = cogsworth.pop.load(args.template, parts=[])
+    stars = emulator.sweeney_initial_conditions(template)
+    plan_kwargs = dict(n_rows=len(stars), shard_size=args.shard_size, seed=args.seed,
+                       config={"template": os.path.abspath(args.template),
+                               "t2": template.max_ev_time.to(u.Myr).value,
+                               "mass_binaries": template.mass_binaries,
+                               "dt": args.dt, "integrator": args.integrator})
+
+    # an existing plan is only checked against these settings, its initial conditions may already be in use
+    if os.path.exists(os.path.join(args.run_dir, "plan.json")):
+        shard_plan = ShardPlan.create(args.run_dir, **plan_kwargs)
+        print(f"Plan already exists with {shard_plan.n_shards} shards of up to {args.shard_size} of "
+              f"{len(stars)} remnants")
+        return
+
+    # the initial conditions are written to a temporary directory that is renamed into place, and the plan
+    # (which workers start from) last, so a plan that exists always has all of its inputs. Anything left over
+    # from a planning run that died before writing its plan is replaced.
+    os.makedirs(args.run_dir, exist_ok=True)
+    initial_dir = os.path.join(args.run_dir, "initial")
+    tmp_dir = f"{initial_dir}.tmp-{os.getpid()}"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+    for col in COLUMNS:
+        np.save(os.path.join(tmp_dir, f"{col}.npy"), stars[col].values)
+    template.galactic_potential.save(os.path.join(tmp_dir, "potential.yml"))
+    os.replace(os.path.join(tmp_dir, "potential.yml"), os.path.join(args.run_dir, "potential.yml"))
+    shutil.rmtree(initial_dir, ignore_errors=True)
+    os.rename(tmp_dir, initial_dir)
+
+    shard_plan = ShardPlan.create(args.run_dir, **plan_kwargs)
+    print(f"Planned {shard_plan.n_shards} shards of up to {args.shard_size} of {len(stars)} remnants")
+
+
+def work(args):
+    shard_plan = ShardPlan(args.run_dir)
+    config = shard_plan.config
+    potential = gp.load(os.path.join(args.run_dir, "potential.yml"))
+    initial = {col: np.load(os.path.join(args.run_dir, "initial", f"{col}.npy"), mmap_mode="r")
+               for col in COLUMNS}
+    output_dir = os.path.join(args.run_dir, "output")
+    os.makedirs(output_dir, exist_ok=True)
+    profiler = RunProfiler(f"sweeney-worker-{os.getpid()}", output_dir=args.run_dir)
+
+    def integrate_shard(manifest):
+        rows = slice(manifest["start"], manifest["stop"])
+        stars = {col: np.array(initial[col][rows]) for col in COLUMNS}
+        prefix = f"shard {manifest['shard']}: "
+
+        # kicks come from the shard's own seed, so they don't depend on which worker runs it
+        kicks = emulator.draw_sweeney_kicks(stars["mass"], np.random.default_rng(manifest["seed"]))
+        pos = np.transpose([stars["x"], stars["y"], stars["z"]]) * u.kpc
+        vel = (np.transpose([stars["v_x"], stars["v_y"], stars["v_z"]]) + kicks) * u.km / u.s
+        t1 = config["t2"] * u.Myr - stars["tau"] * u.Gyr
+
+        with profiler.stage(prefix + "galactic evolution", count=len(pos)) as stage:
+            final_pos, final_vel, info = orbits.integrate_orbits(
+                pos=pos, vel=vel, t1=t1, t2=config["t2"] * u.Myr, potential=potential,
+                dt=config["dt"] * u.Myr, Integrator=getattr(gi, config["integrator"]),
+                chunk_size=10_000, processes=args.processes, progress_bar=False, return_info=True
+            )
+            stage["workers"] = info["workers"]
+
+        file_name = os.path.join(output_dir, f"shard-{manifest['shard']:05d}.npz")
+        np.savez(file_name + ".tmp.npz", final_pos=final_pos.to(u.kpc).value,
+                 final_vel=final_vel.to(u.km / u.s).value, kick=np.sqrt(np.sum(kicks**2, axis=1)))
+        os.replace(file_name + ".tmp.npz", file_name)
+        profiler.save()
+        return {"orbits": file_name}, {"n_failed": int(info["n_failed"]), "n_retries": int(info["n_retries"])}
+
+    n_done = run_worker(shard_plan, integrate_shard, stale_after=args.stale_after, max_shards=args.max_shards)
+    print(f"Finished {n_done} shard(s), report saved to {profiler.save()}")
+
+
+def merge(args):
+    shard_plan = ShardPlan(args.run_dir)
+    file_names = shard_plan.outputs("orbits")
+    potential = gp.load(os.path.join(args.run_dir, "potential.yml"))
+
+    remnants = pd.DataFrame({col: np.load(os.path.join(args.run_dir, "initial", f"{col}.npy"))
+                             for col in ["mass", "bin_num"]})
+    parts = [np.load(file_name) for file_name in file_names]
+    final_pos = np.concatenate([part["final_pos"] for part in parts])
+    final_vel = np.concatenate([part["final_vel"] for part in parts])
+    remnants["kick"] = np.concatenate([part["kick"] for part in parts])
+    remnants[["x_final", "y_final", "z_final"]] = final_pos
+    remnants[["v_x_final", "v_y_final", "v_z_final"]] = final_vel
+
+    path = args.output or os.path.join(args.run_dir, "sweeney.catalogue")
+    catalogue.export_sweeney(remnants, path, potential=potential,
+                             mass_binaries=shard_plan.config["mass_binaries"])
+    print(f"Merged {len(file_names)} shards ({len(remnants)} remnants) into {path}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    plan_parser = subparsers.add_parser("plan", help="Write the initial conditions and shard manifests")
+    plan_parser.add_argument("run_dir")
+    plan_parser.add_argument("--template", default="/mnt/ceph/users/twagg/underworld/template")
+    plan_parser.add_argument("--shard-size", type=int, default=100_000)
+    plan_parser.add_argument("--seed", type=int, default=42)
+    plan_parser.add_argument("--dt", type=float, default=1.0, help="Timestep in Myr")
+    plan_parser.add_argument("--integrator", default="DOPRI853Integrator", help="Name of a gala integrator")
+
+    work_parser = subparsers.add_parser("work", help="Claim and integrate shards until none are left")
+    work_parser.add_argument("run_dir")
+    work_parser.add_argument("--processes", type=int, default=32)
+    work_parser.add_argument("--stale-after", type=float, default=None,
+                             help="Take over claims that haven't been refreshed for this many seconds "
+                                  "(workers refresh theirs every quarter of this)")
+    work_parser.add_argument("--max-shards", type=int, default=None)
+
+    merge_parser = subparsers.add_parser("merge", help="Check every shard is done and merge them")
+    merge_parser.add_argument("run_dir")
+    merge_parser.add_argument("--output", default=None, help="Catalogue path (default is in run_dir)")
+
+    args = parser.parse_args()
+    {"plan": plan, "work": work, "merge": merge}[args.command](args)
+
+
+if __name__ == "__main__":
+    main()
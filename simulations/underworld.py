@@ -1,92 +1,215 @@
 import cogsworth
 import gala.potential as gp
+import numpy as np
 
+import json
+import os
+import sys
 import time
 
-very_start = time.time()
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "../src"))
+import catalogue
+import merge
+from cube import BINARY_STATUSES
+from manifest import Manifest
+from singles import SingleStarTable
+from writer import BackgroundWriter
+from profiling import RunProfiler
 
 print("Initiating cogsworth underworld simulation")
 
+output_dir = "/mnt/ceph/users/twagg/underworld"
+shard_dir = os.path.join(output_dir, "shards")
+
+# the population is built in shards that are each sampled, evolved and saved before the next starts, so only
+# one shard is ever in memory and a crash resumes from the last completed shard
+n_binaries = 10_000_000
+shard_size = 1_000_000
+n_shards = int(np.ceil(n_binaries / shard_size))
+seed = 42
+
+# shard i gets bin_nums from i * bin_num_stride, so bin_nums are unique across the run and the binaries and
+# singles of a shard can be matched to its template (the stride leaves room for the sampler returning more
+# binaries than asked for)
+bin_num_stride = 10 * shard_size
+
+# each kind of population is merged from its shards at the end, and the evolved ones get catalogues too
+merge_kinds = ["template", "binaries", "singles"]
+catalogue_kinds = ["binaries", "singles"]
+
 bpp_columns = [
     'tphys', 'mass_1', 'mass_2', 'kstar_1', 'kstar_2', 'sep', 'porb', 'ecc',
     'evol_type', 'RRLO_1', 'RRLO_2', 'massc_1', 'massc_2',
     'lum_1', 'lum_2', 'teff_1', 'teff_2', 'SN_1', 'SN_2'
 ]
 
-# create a new cogsworth population that assumes 100% binarity
+manifest = Manifest(os.path.join(shard_dir, "manifest.json"),
+                    config={"n_binaries": n_binaries, "shard_size": shard_size, "seed": seed,
+                            "bin_num_stride": bin_num_stride})
+print(f"Running {n_shards} shards of up to {shard_size} binaries ({len(manifest.completed)} already complete)")
+
 pot = gp.MilkyWayPotential2022()
-initial_pop = cogsworth.pop.Population(n_binaries=10_000_000, processes=32,
-                                       m1_cutoff=4,
-                                       ini_file="/mnt/home/twagg/projects/underworld/simulations/params.ini",
-                                       galactic_potential=pot,
-                                       sfh_model=cogsworth.sfh.SandersBinney2015,
-                                       sfh_params={
-                                           "potential": pot,
-                                           "time_bins": 5,
-                                           "verbose": True
-                                       },
-                                       bpp_columns=bpp_columns,
-                                       store_entire_orbits=False)
-initial_pop.BSE_settings["binfrac"] = 1.0
-
-# sample initial binaries
-start = time.time()
-initial_pop.sample_initial_binaries()
-print(f"Sampled initial binaries in {time.time() - start:1.2f} seconds")
-
-print("Binaries first!")
-
-# perform steller evolution for binaries
-start = time.time()
-initial_pop.perform_stellar_evolution()
-print(f"   Performed stellar evolution for binaries in {time.time() - start:1.2f} seconds")
-
-print("Save the template population")
-start = time.time()
-initial_pop.save("/mnt/ceph/users/twagg/underworld/template", overwrite=True)
-print(f"   Saved template population in {time.time() - start:1.2f} seconds")
-
-# do galactic evolution only for the binaries that end up as underworld objects
-start = time.time()
-underworld_mask = ((initial_pop.final_bpp['kstar_1'] == 13) | (initial_pop.final_bpp['kstar_1'] == 14) |
-                   (initial_pop.final_bpp['kstar_2'] == 13) | (initial_pop.final_bpp['kstar_2'] == 14))
-binary_underworld = initial_pop[underworld_mask]
-binary_underworld.perform_galactic_evolution()
-print(f"   Performed galactic evolution for binaries in {time.time() - start:1.2f} seconds")
-
-start = time.time()
-binary_underworld.save("/mnt/ceph/users/twagg/underworld/binaries", overwrite=True)
-print(f"   Saved binary underworld population in {time.time() - start:1.2f} seconds")
-
-print(f"   Number of underworld binaries: {len(binary_underworld)}")
-
-print("Now singles!")
-
-# copy for singles
-singles = initial_pop.copy()
-singles.initC["porb"] = 1e20
-singles.initC["ecc"] = 0.0
-
-cols = ["natal_kick_1", "phi_1", "theta_1", "natal_kick_2", "phi_2", "theta_2"]
-for col in cols:
-    singles.initC[col] = -100.0
-
-# perform steller evolution for singles
-start = time.time()
-singles.perform_stellar_evolution()
-print(f"   Performed stellar evolution for singles in {time.time() - start:1.2f} seconds")
-
-# do galactic evolution only for the singles that end up as underworld objects
-start = time.time()
-underworld_mask = ((singles.final_bpp['kstar_1'] == 13) | (singles.final_bpp['kstar_1'] == 14) |
-                   (singles.final_bpp['kstar_2'] == 13) | (singles.final_bpp['kstar_2'] == 14))
-single_underworld = singles[underworld_mask]
-single_underworld.perform_galactic_evolution()
-print(f"   Performed galactic evolution for singles in {time.time() - start:1.2f} seconds")
-
-start = time.time()
-single_underworld.save("/mnt/ceph/users/twagg/underworld/singles", overwrite=True)
-print(f"   Saved single underworld population in {time.time() - start:1.2f} seconds")
+
+# saves run in the background while the next stage continues
+writer = BackgroundWriter()
+
+# stage timings and memory are saved to a JSON report next to the output after every shard
+profiler = RunProfiler("underworld", output_dir=output_dir)
+profiler.info["writes"] = writer.writes
+
+
+def check_bin_nums(pop, start, stop, prefix=""):
+    """Check that the bin_nums of an evolved population are the ones assigned to its shard."""
+    for name, values in [("bin_nums", pop.bin_nums), ("bpp", pop.bpp["bin_num"].values),
+                         ("bpp index", pop.bpp.index.values)]:
+        outside = (values < start) | (values >= stop)
+        if outside.any():
+            raise RuntimeError(f"{prefix}{outside.sum()} {name} are outside of the shard's range "
+                               f"[{start}, {stop}), cogsworth must have renumbered the binaries")
+
+
+def get_underworld_mask(pop):
+    return ((pop.final_bpp['kstar_1'] == 13) | (pop.final_bpp['kstar_1'] == 14) |
+            (pop.final_bpp['kstar_2'] == 13) | (pop.final_bpp['kstar_2'] == 14))
+
+
+for shard in range(n_shards):
+    if manifest.is_done(shard):
+        continue
+
+    shard_start = time.time()
+    prefix = f"shard {shard}: "
+    n_shard = min(shard_size, n_binaries - shard * shard_size)
+    outputs = {kind: os.path.join(shard_dir, f"{kind}-{shard:04d}") for kind in ["template", "binaries", "singles"]}
+    outputs.update({f"{kind}.catalogue": os.path.join(shard_dir, f"{kind}-{shard:04d}.catalogue")
+                    for kind in catalogue_kinds})
+    print(f"Shard {shard + 1}/{n_shards} ({n_shard} binaries)")
+
+    # each shard gets its own seed so that a resumed run draws the same binaries
+    np.random.seed(seed + shard)
+
+    # create a new cogsworth population that assumes 100% binarity
+    initial_pop = cogsworth.pop.Population(n_binaries=n_shard, processes=32,
+                                           m1_cutoff=4,
+                                           ini_file="/mnt/home/twagg/projects/underworld/simulations/params.ini",
+                                           galactic_potential=pot,
+                                           sfh_model=cogsworth.sfh.SandersBinney2015,
+                                           sfh_params={
+                                               "potential": pot,
+                                               "time_bins": 5,
+                                               "verbose": True
+                                           },
+                                           bpp_columns=bpp_columns,
+                                           store_entire_orbits=False)
+    initial_pop.BSE_settings["binfrac"] = 1.0
+
+    # sample initial binaries
+    with profiler.stage(prefix + "sample initial binaries", count=n_shard):
+        initial_pop.sample_initial_binaries()
+
+        # COSMIC evolves the initial binaries with the bin_nums in their table (and cogsworth clears its
+        # cached bin_nums before evolving), so they can be renumbered here
+        initial_binaries = initial_pop.initial_binaries
+        if len(initial_binaries) > bin_num_stride:
+            raise ValueError(f"Shard {shard} sampled {len(initial_binaries)} binaries, more than the bin_num "
+                             f"stride of {bin_num_stride}")
+        bin_num_start = shard * bin_num_stride
+        bin_nums = bin_num_start + np.arange(len(initial_binaries))
+        initial_binaries.index = bin_nums
+        initial_binaries["bin_num"] = bin_nums
+
+    # perform steller evolution for binaries
+    with profiler.stage(prefix + "stellar evolution (binaries)", count=n_shard):
+        initial_pop.perform_stellar_evolution()
+
+    # fail loudly if cogsworth or COSMIC didn't keep the bin_nums (evolution can only drop binaries)
+    check_bin_nums(initial_pop, bin_num_start, bin_nums[-1] + 1, prefix)
+
+    writer.save(initial_pop, outputs["template"], overwrite=True)
+
+    # do galactic evolution only for the binaries that end up as underworld objects
+    with profiler.stage(prefix + "masking (binaries)", count=n_shard):
+        binary_underworld = initial_pop[get_underworld_mask(initial_pop)]
+    with profiler.stage(prefix + "galactic evolution (binaries)", count=len(binary_underworld)):
+        binary_underworld.perform_galactic_evolution()
+
+    writer.save(binary_underworld, outputs["binaries"], overwrite=True)
+    writer.submit(catalogue.export_population, binary_underworld, outputs["binaries.catalogue"],
+                  label=outputs["binaries.catalogue"])
+
+    n_binary_underworld = len(binary_underworld)
+    print(f"   Number of underworld binaries: {n_binary_underworld}")
+    del binary_underworld
+
+    # isolated stars that can't become a NS/BH by present day don't need to be evolved at all, so use a cached
+    # table of single star outcomes to pick out the candidates (either star of each system)
+    with profiler.stage(prefix + "masking (single candidates)", count=n_shard):
+        single_table = SingleStarTable.from_population(initial_pop)
+        initC = initial_pop.initC
+        candidates = (single_table.candidates(initC["mass_1"].values, initC["metallicity"].values,
+                                              initC["tphysf"].values)
+                      | single_table.candidates(initC["mass_2"].values, initC["metallicity"].values,
+                                                initC["tphysf"].values))
+        singles = initial_pop[candidates]
+        del initial_pop, initC
+    print(f"   Selected {len(singles)} single star candidates ({candidates.mean():.1%})")
+
+    singles.initC["porb"] = 1e20
+    singles.initC["ecc"] = 0.0
+
+    cols = ["natal_kick_1", "phi_1", "theta_1", "natal_kick_2", "phi_2", "theta_2"]
+    for col in cols:
+        singles.initC[col] = -100.0
+
+    # perform steller evolution for singles
+    with profiler.stage(prefix + "stellar evolution (singles)", count=len(singles)):
+        singles.perform_stellar_evolution()
+
+    # do galactic evolution only for the singles that end up as underworld objects
+    with profiler.stage(prefix + "masking (singles)", count=len(singles)):
+        single_underworld = singles[get_underworld_mask(singles)]
+        del singles
+    with profiler.stage(prefix + "galactic evolution (singles)", count=len(single_underworld)):
+        single_underworld.perform_galactic_evolution()
+
+    writer.save(single_underworld, outputs["singles"], overwrite=True)
+    # the singles are wide pseudo-binaries, so label their compact objects as singles rather than by the
+    # state of the pseudo-binary
+    writer.submit(catalogue.export_population, single_underworld, outputs["singles.catalogue"],
+                  status=BINARY_STATUSES.index("single"), label=outputs["singles.catalogue"])
+
+    # only mark the shard as done once all of its outputs are safely on disk
+    with profiler.stage(prefix + "waiting for saves"):
+        writer.flush()
+    manifest.mark_done(shard, outputs, n_binaries=n_shard, n_binary_underworld=n_binary_underworld,
+                       n_single_underworld=len(single_underworld), wall_time=time.time() - shard_start,
+                       bin_num_start=int(bin_num_start), bin_num_stop=int(bin_nums[-1]) + 1)
+    del single_underworld
+    profiler.save()
+    print(f"   Completed shard in {time.time() - shard_start:1.2f} seconds")
+
+# the shards are merged a table at a time, keeping their bin_nums (see merge.merge_populations), and the
+# index records which shard holds which bin_nums
+print("Merging shards")
+writer.flush()
+with open(os.path.join(output_dir, "shards.json.tmp"), "w") as f:
+    json.dump({"bin_num_stride": bin_num_stride,
+               "shards": [{"shard": shard, **{key: manifest.shards[shard][key]
+                                              for key in ["outputs", "bin_num_start", "bin_num_stop"]}}
+                          for shard in manifest.completed]}, f, indent=2)
+os.replace(os.path.join(output_dir, "shards.json.tmp"), os.path.join(output_dir, "shards.json"))
+
+for kind in merge_kinds:
+    with profiler.stage(f"merge {kind} shards") as stage:
+        stage["count"] = merge.merge_populations(manifest.outputs(kind), os.path.join(output_dir, kind),
+                                                 label=kind)
+
+# the catalogues of every shard are streamed into one catalogue of each kind a column at a time
+for kind in catalogue_kinds:
+    with profiler.stage(f"merge {kind} catalogues") as stage:
+        catalogue.concat_catalogues(manifest.outputs(f"{kind}.catalogue"),
+                                    os.path.join(output_dir, f"{kind}.catalogue"), label=kind)
+        stage["count"] = len(catalogue.Catalogue(os.path.join(output_dir, f"{kind}.catalogue")))
 
 print("Underworld simulation complete!")
-print(f"Total time: {time.time() - very_start:1.2f} seconds")
+print(f"Total time: {profiler.report()['wall_time']:1.2f} seconds, report saved to {profiler.save()}")
@@ -0,0 +1,166 @@
+import numpy as np
+from gala.potential.potential.io import to_dict
+
+import hashlib
+import json
+import os
+import time
+
+from escape import EscapeVelocityGrid
+from remnants import RemnantTable
+
+
+DEFAULT_CACHE_DIR = os.environ.get("UNDERWORLD_CACHE",
+                                   os.path.join(os.path.expanduser("~"), ".cache", "underworld"))
+
+
+def potential_fingerprint(potential):
+    """A string that uniquely identifies a gala potential (class and parameters of every component)."""
+    return json.dumps(to_dict(potential), sort_keys=True, default=str)
+
+
+def _argument_fingerprint(name, value):
+    """A value that identifies a keyword argument of :meth:`RemnantCache.get` the same way every session."""
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    if isinstance(value, EscapeVelocityGrid):
+        return ["EscapeVelocityGrid", value.R_max, value.z_max, len(value._u_R), len(value._u_z), value.scale,
+                potential_fingerprint(value.potential)]
+    raise ValueError(f"Can't build a stable cache key from `{name}={value!r}`, pass an explicit `cache_key` "
+                     "that identifies it instead")
+
+
+class RemnantCache():
+    """An on-disk, memory-mapped cache of :class:`~remnants.RemnantTable` objects.
+
+    Tables are keyed by the population file (path, modification time and size) and the potential used to
+    flag escapers, so a cached table is invalidated as soon as either changes. Tables are stored as ``.npy``
+    files and loaded with ``mmap_mode="r"`` so repeat loads only read the pages that are used. Once the
+    cache exceeds ``max_bytes`` the least recently used tables are evicted.
+
+    Parameters
+    ----------
+    cache_dir : str, optional
+        Directory in which to store the cache. Default is ``$UNDERWORLD_CACHE`` or
+        ``~/.cache/underworld``.
+    max_bytes : int, optional
+        Size budget of the cache in bytes. Default is 20 GB.
+    """
+    def __init__(self, cache_dir=None, max_bytes=20 * 1024**3):
+        self.cache_dir = DEFAULT_CACHE_DIR if cache_dir is None else cache_dir
+        self.max_bytes = max_bytes
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def __repr__(self):
+        return f"<RemnantCache: {self.cache_dir}, {self.size() / 1024**3:.2f}/{self.max_bytes / 1024**3:.2f} GB>"
+
+    def key(self, pop, kind="remnants"):
+        """Cache key for a population, or None if it wasn't loaded from a file (and so can't be cached)."""
+        file_name = getattr(pop, "_file", None)
+        if file_name is None or not os.path.exists(file_name):
+            return None
+
+        stat = os.stat(file_name)
+        identity = json.dumps([kind, os.path.abspath(file_name), stat.st_mtime_ns, stat.st_size,
+                               potential_fingerprint(pop.galactic_potential)])
+        return hashlib.sha1(identity.encode()).hexdigest()
+
+    def _paths(self, key):
+        return os.path.join(self.cache_dir, f"{key}.npy"), os.path.join(self.cache_dir, f"{key}.json")
+
+    def load(self, key):
+        """Load a table from the cache (memory-mapped), returning None on a miss."""
+        data_path, meta_path = self._paths(key)
+        if not (os.path.exists(data_path) and os.path.exists(meta_path)):
+            return None
+
+        with open(meta_path) as f:
+            meta = json.load(f)
+
+        # the metadata file's modification time tracks when each entry was last used
+        os.utime(meta_path)
+        return RemnantTable(np.load(data_path, mmap_mode="r"), meta["n_ns"], label=meta["label"])
+
+    def store(self, key, table, source=None):
+        """Write a table to the cache and evict old entries if the cache is over budget."""
+        data_path, meta_path = self._paths(key)
+
+        # write to temporary files first so that an interrupted write never leaves a corrupt entry
+        np.save(data_path + ".tmp.npy", np.ascontiguousarray(table.data))
+        os.replace(data_path + ".tmp.npy", data_path)
+        with open(meta_path + ".tmp", "w") as f:
+            json.dump({"n_ns": int(table.n_ns), "label": table.label, "source": source,
+                       "created": time.time()}, f)
+        os.replace(meta_path + ".tmp", meta_path)
+
+        self.evict(keep=key)
+
+    def get(self, pop, cache_key=None, **kwargs):
+        """Get the remnant table of a population from the cache, building (and caching) it on a miss.
+
+        Any keyword arguments are passed to :meth:`~remnants.RemnantTable.from_population` and are part of
+        the cache key. Plain values and :class:`~escape.EscapeVelocityGrid` objects identify themselves,
+        anything else (e.g. a function as ``escape_velocity``) needs an explicit ``cache_key`` string that
+        identifies it, since its ``repr`` changes between sessions.
+
+        Raises
+        ------
+        ValueError
+            If a keyword argument can't be identified and no ``cache_key`` is given
+        """
+        if cache_key is not None:
+            kind = f"remnants-{cache_key}"
+        elif kwargs:
+            kind = "remnants-" + json.dumps({name: _argument_fingerprint(name, value)
+                                             for name, value in sorted(kwargs.items())})
+        else:
+            kind = "remnants"
+        key = self.key(pop, kind=kind)
+        if key is None:
+            return RemnantTable.from_population(pop, **kwargs)
+
+        table = self.load(key)
+        if table is None:
+            table = RemnantTable.from_population(pop, **kwargs)
+            self.store(key, table, source=pop._file)
+            table = self.load(key)
+
+        # labels are often set after loading a population, so prefer the current one
+        table.label = getattr(pop, "label", table.label)
+        return table
+
+    def entries(self):
+        """List of (last used time, size in bytes, key) for every entry, least recently used first."""
+        entries = []
+        for file_name in os.listdir(self.cache_dir):
+            if not file_name.endswith(".json"):
+                continue
+            key = file_name[:-5]
+            data_path, meta_path = self._paths(key)
+            if os.path.exists(data_path):
+                entries.append((os.path.getmtime(meta_path),
+                                os.path.getsize(data_path) + os.path.getsize(meta_path), key))
+        return sorted(entries)
+
+    def size(self):
+        """Total size of the cache in bytes."""
+        return sum(size for _, size, _ in self.entries())
+
+    def evict(self, keep=None):
+        """Remove least recently used entries until the cache fits within its budget."""
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+        for _, size, key in entries:
+            if total <= self.max_bytes:
+                break
+            if key == keep:
+                continue
+            for path in self._paths(key):
+                os.remove(path)
+            total -= size
+
+    def clear(self):
+        """Remove every entry from the cache."""
+        for _, _, key in self.entries():
+            for path in self._paths(key):
+                os.remove(path)
@@ -0,0 +1,280 @@
+import numpy as np
+import pandas as pd
+import astropy.units as u
+
+import json
+import os
+import shutil
+
+from cube import BINARY_STATUSES, binary_status
+from remnants import RemnantTable, remnant_rows
+
+
+SCHEMA_VERSION = 1
+
+# column: (dtype, unit, description), shared by every run so that any catalogue can be compared to any other
+SCHEMA = {
+    "x": ("float64", "kpc", "Galactocentric x position"),
+    "y": ("float64", "kpc", "Galactocentric y position"),
+    "z": ("float64", "kpc", "Galactocentric z position"),
+    "v_x": ("float64", "km/s", "Galactocentric x velocity"),
+    "v_y": ("float64", "km/s", "Galactocentric y velocity"),
+    "v_z": ("float64", "km/s", "Galactocentric z velocity"),
+    "mass": ("float64", "Msun", "Remnant mass (NaN if not modelled)"),
+    "kstar": ("int8", "", "Remnant type (13 for NS, 14 for BH)"),
+    "progenitor_mass": ("float64", "Msun", "Initial mass of the progenitor star"),
+    "bin_num": ("int64", "", "Binary number of the system in the template population"),
+    "status": ("int8", "", f"Final state of the system, an index into {BINARY_STATUSES}"),
+    "kick": ("float64", "km/s", "Natal kick magnitude (NaN if unknown)"),
+    "escaped": ("bool", "", "Whether the remnant is faster than the local escape velocity"),
+}
+
+
+def write_catalogue(path, columns, label=None, mass_binaries=None, source=None):
+    """Write a catalogue of compact objects as a directory of memory-mappable ``.npy`` columns.
+
+    The catalogue is written to a temporary directory and moved into place once complete, so a catalogue
+    that exists is never partially written.
+
+    Parameters
+    ----------
+    path : str
+        Directory of the catalogue (usually ending in ``.catalogue``), replaced if it exists
+    columns : dict
+        Values of every column in :data:`SCHEMA`, each with one entry per compact object
+    label : str, optional
+        Label of the population
+    mass_binaries : float, optional
+        Total mass of the simulated binaries, for scaling counts up to the Milky Way
+    source : str, optional
+        Where the catalogue came from (e.g. the population file)
+
+    Raises
+    ------
+    ValueError
+        If any columns are missing or unexpected, or they have different lengths
+    """
+    if set(columns) != set(SCHEMA):
+        raise ValueError(f"Catalogue columns must match the schema, missing {set(SCHEMA) - set(columns)} "
+                         f"and unexpected {set(columns) - set(SCHEMA)}")
+    lengths = {len(values) for values in columns.values()}
+    if len(lengths) != 1:
+        raise ValueError(f"Catalogue columns have different lengths {lengths}")
+
+    tmp_path = _make_tmp_dir(path)
+    for name, (dtype, _, _) in SCHEMA.items():
+        np.save(os.path.join(tmp_path, f"{name}.npy"), np.asarray(columns[name], dtype=dtype))
+    _finish(tmp_path, path, n=lengths.pop(), label=label, mass_binaries=mass_binaries, source=source)
+
+
+def _make_tmp_dir(path):
+    tmp_path = path.rstrip("/") + ".tmp"
+    if os.path.exists(tmp_path):
+        shutil.rmtree(tmp_path)
+    os.makedirs(tmp_path)
+    return tmp_path
+
+
+def _finish(tmp_path, path, n, label, mass_binaries, source):
+    """Write the metadata of a catalogue in a temporary directory and move it into place."""
+    with open(os.path.join(tmp_path, "meta.json"), "w") as f:
+        json.dump({"schema_version": SCHEMA_VERSION, "n": n, "label": label,
+                   "mass_binaries": mass_binaries, "source": source,
+                   "units": {name: unit for name, (_, unit, _) in SCHEMA.items()}}, f, indent=2)
+
+    if os.path.exists(path):
+        shutil.rmtree(path)
+    os.replace(tmp_path, path)
+
+
+def concat_catalogues(paths, path, label=None, source=None):
+    """Concatenate catalogues (e.g. of the shards of a run) into one, streaming a column at a time.
+
+    Each column of the output is a preallocated memory-mapped file that the columns of the inputs are
+    copied into, so only one column of one input is ever in memory.
+
+    Parameters
+    ----------
+    paths : list of str
+        Catalogues to concatenate, in order
+    path : str
+        Directory of the combined catalogue, replaced if it exists
+    label : str, optional
+        Label of the combined catalogue. Default is the label of the first input.
+    source : str, optional
+        Where the catalogue came from. Default is the list of inputs.
+    """
+    parts = [Catalogue(part_path) for part_path in paths]
+    n = sum(len(part) for part in parts)
+    masses = [part.meta["mass_binaries"] for part in parts]
+
+    tmp_path = _make_tmp_dir(path)
+    for name, (dtype, _, _) in SCHEMA.items():
+        column = np.lib.format.open_memmap(os.path.join(tmp_path, f"{name}.npy"), mode="w+", dtype=dtype,
+                                           shape=(n,))
+        start = 0
+        for part in parts:
+            if len(part) > 0:
+                column[start:start + len(part)] = part[name]
+                start += len(part)
+            part._columns.pop(name, None)
+        column.flush()
+        del column
+
+    _finish(tmp_path, path, n=n, label=parts[0].label if label is None and parts else label,
+            mass_binaries=None if None in masses else sum(masses),
+            source=json.dumps([os.path.abspath(p) for p in paths]) if source is None else source)
+
+
+def _kicks(kick_info, bin_nums, star):
+    """Natal kick of each (bin_num, star), NaN where kick_info has no supernova for that star."""
+    kicks = kick_info[kick_info["star"].values != 0]
+    keys = kicks["bin_num"].values.astype(np.int64) * 3 + kicks["star"].values.astype(np.int64)
+    rows = pd.Index(keys).get_indexer(np.asarray(bin_nums, dtype=np.int64) * 3 + star)
+    return np.where(rows >= 0, kicks["natal_kick"].values[rows], np.nan)
+
+
+def export_population(pop, path, table=None, escape_velocity=None, status=None):
+    """Export every NS and BH of an evolved cogsworth population as a catalogue.
+
+    Parameters
+    ----------
+    pop : :class:`~cogsworth.pop.Population`
+        Population that has been through galactic evolution
+    path : str
+        Directory of the catalogue
+    table : :class:`~remnants.RemnantTable`, optional
+        Remnant table of the population (to avoid building it again). Default is to build one.
+    escape_velocity : callable, optional
+        Passed to :meth:`~remnants.RemnantTable.from_population` when building the table
+    status : int, optional
+        Index into :data:`~cube.BINARY_STATUSES` to give every compact object, e.g.
+        ``BINARY_STATUSES.index("single")`` for a population of single stars evolved as wide pseudo-binaries
+        (whose status would otherwise be "bound" or "disrupted"). Default is the status of each system.
+    """
+    if table is None:
+        table = RemnantTable.from_population(pop, escape_velocity=escape_velocity)
+
+    # the table doesn't record which star each remnant was, but it is in the same order as remnant_rows
+    inds, _ = remnant_rows(pop.final_bpp)
+    is_secondary = inds >= len(pop)
+    star = np.where(is_secondary, 2, 1)
+    initC = pop.initC.set_index("bin_num") if "bin_num" in pop.initC.columns else pop.initC
+    progenitor_mass = np.where(is_secondary, initC["mass_2"].reindex(table.bin_num).values,
+                               initC["mass_1"].reindex(table.bin_num).values)
+
+    write_catalogue(path, {
+        "x": table.column("x"), "y": table.column("y"), "z": table.column("z"),
+        "v_x": table.column("v_x"), "v_y": table.column("v_y"), "v_z": table.column("v_z"),
+        "mass": table.column("mass"),
+        "kstar": table.kstar,
+        "progenitor_mass": progenitor_mass,
+        "bin_num": table.bin_num,
+        "status": (binary_status(pop, table.bin_num) if status is None
+                   else np.full(len(table.bin_num), status)),
+        "kick": _kicks(pop.kick_info, table.bin_num, star),
+        "escaped": table.escaped,
+    }, label=getattr(pop, "label", None), mass_binaries=pop.mass_binaries, source=getattr(pop, "_file", None))
+
+
+def export_sweeney(remnants, path, potential, mass_binaries=None, label="Sweeney+22"):
+    """Export the remnants of the Sweeney+22 emulation (see ``simulations/sweeney.py``) as a catalogue.
+
+    Every remnant is treated as a single star and remnant masses are not modelled. Remnant types are taken
+    from a ``kstar`` column if there is one (e.g. from :meth:`~emulator.Prescription.remnant_type`),
+    otherwise remnants from progenitors above 25 Msun are black holes.
+
+    Parameters
+    ----------
+    remnants : :class:`~pandas.DataFrame`
+        Remnants, with columns ``mass``, ``kick``, ``bin_num`` and final positions (``x_final``, ...) and
+        velocities (``v_x_final``, ...)
+    path : str
+        Directory of the catalogue
+    potential : :class:`~gala.potential.potential.PotentialBase`
+        Galactic potential, for flagging escaped remnants
+    mass_binaries : float, optional
+        Total mass of the template population
+    label : str, optional
+        Label of the catalogue. Default is "Sweeney+22".
+    """
+    pos = remnants[["x_final", "y_final", "z_final"]].values
+    vel = remnants[["v_x_final", "v_y_final", "v_z_final"]].values
+    v_esc = np.sqrt(-2 * potential.energy(pos.T * u.kpc)).to(u.km / u.s).value
+
+    write_catalogue(path, {
+        "x": pos[:, 0], "y": pos[:, 1], "z": pos[:, 2],
+        "v_x": vel[:, 0], "v_y": vel[:, 1], "v_z": vel[:, 2],
+        "mass": np.full(len(remnants), np.nan),
+        "kstar": (remnants["kstar"].values if "kstar" in remnants
+                  else np.where(remnants["mass"].values >= 25, 14, 13)),
+        "progenitor_mass": remnants["mass"].values,
+        "bin_num": remnants["bin_num"].values,
+        "status": np.full(len(remnants), BINARY_STATUSES.index("single")),
+        "kick": remnants["kick"].values,
+        "escaped": np.sqrt(np.sum(vel**2, axis=1)) >= v_esc,
+    }, label=label, mass_binaries=mass_binaries, source="sweeney")
+
+
+class Catalogue():
+    """A catalogue of compact objects (see :data:`SCHEMA`) that only reads the columns that are used.
+
+    Columns are memory-mapped the first time they are accessed (with ``catalogue["mass"]``), so opening a
+    catalogue is instant and every variation can be opened at once.
+
+    Parameters
+    ----------
+    path : str
+        Directory of the catalogue
+
+    Raises
+    ------
+    ValueError
+        If the catalogue was written with a different schema version
+    """
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, "meta.json")) as f:
+            self.meta = json.load(f)
+        if self.meta["schema_version"] != SCHEMA_VERSION:
+            raise ValueError(f"Catalogue {path} has schema version {self.meta['schema_version']}, "
+                             f"expected {SCHEMA_VERSION}")
+        self.label = self.meta["label"]
+        self._columns = {}
+
+    def __len__(self):
+        return self.meta["n"]
+
+    def __repr__(self):
+        return f"<Catalogue{'' if self.label is None else f' ({self.label})'}: {len(self)} COs>"
+
+    def __getitem__(self, name):
+        if name not in SCHEMA:
+            raise KeyError(f"Unknown column '{name}', choose from {list(SCHEMA)}")
+        if name not in self._columns:
+            self._columns[name] = np.load(os.path.join(self.path, f"{name}.npy"), mmap_mode="r")
+        return self._columns[name]
+
+    @property
+    def columns(self):
+        return list(SCHEMA)
+
+    @property
+    def scale_up(self):
+        """Factor to scale counts up to the mass of the Milky Way (6e10 Msun)."""
+        return 6e10 / self.meta["mass_binaries"]
+
+    @property
+    def pos(self):
+        """Galactocentric positions, shape (N, 3)."""
+        return np.transpose([self["x"], self["y"], self["z"]]) * u.kpc
+
+    @property
+    def vel(self):
+        """Galactocentric velocities, shape (N, 3)."""
+        return np.transpose([self["v_x"], self["v_y"], self["v_z"]]) * u.km / u.s
+
+    def to_pandas(self, columns=None, mask=None):
+        """Load some (default all) columns into a :class:`~pandas.DataFrame`, optionally only some rows."""
+        columns = self.columns if columns is None else columns
+        return pd.DataFrame({name: self[name] if mask is None else self[name][mask] for name in columns})
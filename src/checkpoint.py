@@ -0,0 +1,223 @@
+import numpy as np
+import pandas as pd
+import astropy.units as u
+import gala.dynamics as gd
+from cogsworth.events import identify_events
+from cogsworth.kicks import integrate_orbit_with_events
+from multiprocessing import Pool
+from tqdm import tqdm
+
+import os
+
+import orbits
+
+
+# state shared with pool workers (set once per worker by `_init_worker` rather than pickled per task)
+_GLOBAL = {}
+
+
+def first_sn_times(pop):
+    """Time of the first supernova (in Myr after birth) for every system that has one, indexed by bin_num."""
+    sn_kicks = pop.kick_info[pop.kick_info["star"] > 0.0]
+    return sn_kicks.groupby("bin_num")["tphys"].min()
+
+
+def create_presn_checkpoint(pop, dt=0.1 * u.Myr, processes=1, file_name=None):
+    """Integrate each system from its birth up to its first supernova and record its phase space position.
+
+    Everything before the first supernova is independent of the kick prescription, so kick variations can
+    start their orbits from this checkpoint instead of from birth (see
+    :func:`perform_galactic_evolution_from_checkpoint`).
+
+    Parameters
+    ----------
+    pop : :class:`~cogsworth.pop.Population`
+        Population that has been through stellar evolution (e.g. the template)
+    dt : :class:`~astropy.units.Quantity` [time], optional
+        Timestep for the pre-supernova orbits, which sets how closely the checkpoint times match the
+        supernova times (to within ``dt / 2``). Default is 0.1 Myr.
+    processes : int, optional
+        Number of worker processes. Default is 1.
+    file_name : str, optional
+        If given, save the checkpoint to this HDF5 file. Default is None.
+
+    Returns
+    -------
+    checkpoint : :class:`~pandas.DataFrame`
+        One row per system with a supernova before present day, indexed by bin_num, with columns for the
+        time of the first supernova after birth (``t_first_sn``), the absolute time of the checkpoint
+        (``t_checkpoint``, Myr) and its position (kpc) and velocity (km/s).
+    """
+    t_sn = first_sn_times(pop)
+
+    t_birth = (pop.max_ev_time - pop.initial_galaxy.tau).to(u.Myr).value
+    inds = np.flatnonzero(np.isin(pop.bin_nums, t_sn.index))
+    inds = inds[t_sn.loc[pop.bin_nums[inds]].values < pop.max_ev_time.to(u.Myr).value - t_birth[inds]]
+    bin_nums = pop.bin_nums[inds]
+    elapsed = t_sn.loc[bin_nums].values
+
+    gal = pop.initial_galaxy
+    pos = np.transpose([gal.x[inds].to(u.kpc).value, gal.y[inds].to(u.kpc).value,
+                        gal.z[inds].to(u.kpc).value]) * u.kpc
+    vel = np.transpose([gal.v_x[inds].to(u.km / u.s).value, gal.v_y[inds].to(u.km / u.s).value,
+                        gal.v_z[inds].to(u.km / u.s).value]) * u.km / u.s
+
+    # the potential is static so only the elapsed time matters, integrate everything to a common end time
+    # so that orbits with the same (quantised) pre-supernova lifetime share a chunk
+    n_steps = np.maximum(np.round(elapsed / dt.to(u.Myr).value), 1)
+    elapsed = n_steps * dt.to(u.Myr).value
+    final_pos, final_vel = orbits.integrate_orbits(pos=pos, vel=vel, t1=-elapsed * u.Myr, t2=0 * u.Myr,
+                                                   potential=pop.galactic_potential, dt=dt,
+                                                   processes=processes)
+
+    checkpoint = pd.DataFrame({
+        "t_first_sn": t_sn.loc[bin_nums].values,
+        "t_checkpoint": t_birth[inds] + elapsed,
+        "x": final_pos[:, 0].to(u.kpc).value,
+        "y": final_pos[:, 1].to(u.kpc).value,
+        "z": final_pos[:, 2].to(u.kpc).value,
+        "v_x": final_vel[:, 0].to(u.km / u.s).value,
+        "v_y": final_vel[:, 1].to(u.km / u.s).value,
+        "v_z": final_vel[:, 2].to(u.km / u.s).value,
+    }, index=pd.Index(bin_nums, name="bin_num"))
+
+    if file_name is not None:
+        checkpoint.to_hdf(file_name, key="checkpoint", mode="w")
+
+    return checkpoint
+
+
+def load_presn_checkpoint(file_name):
+    """Load a checkpoint saved by :func:`create_presn_checkpoint`."""
+    return pd.read_hdf(file_name, key="checkpoint")
+
+
+def _init_worker(potential, t2, store_all, integrator, integrator_kwargs, retry_settings):
+    _GLOBAL["potential"] = potential
+    _GLOBAL["t2"] = t2
+    _GLOBAL["store_all"] = store_all
+    _GLOBAL["integrator"] = integrator
+    _GLOBAL["integrator_kwargs"] = integrator_kwargs
+    _GLOBAL["retry_settings"] = retry_settings
+
+
+def _orbit_worker(w0, t1, dt, events):
+    return integrate_orbit_with_events(w0, t1, _GLOBAL["t2"], dt, _GLOBAL["potential"], events,
+                                       _GLOBAL["store_all"], integrator=_GLOBAL["integrator"],
+                                       integrator_kwargs=_GLOBAL["integrator_kwargs"],
+                                       max_retries=_GLOBAL["retry_settings"]["max_retries"],
+                                       timestep_multiplier=_GLOBAL["retry_settings"]["timestep_multiplier"])
+
+
+def perform_galactic_evolution_from_checkpoint(pop, checkpoint, processes=None, tolerance=1e-6,
+                                               progress_bar=True):
+    """Drop-in replacement for :meth:`~cogsworth.pop.Population.perform_galactic_evolution` that starts
+    each orbit from its pre-supernova checkpoint rather than from birth.
+
+    Systems whose first supernova time differs from the checkpoint (or that are missing from it) are
+    integrated from birth as usual. The population's integrator and retry settings are used, and systems
+    with an orbit that fails to integrate are removed from the population as in cogsworth.
+
+    Parameters
+    ----------
+    pop : :class:`~cogsworth.pop.Population`
+        Population that has been through stellar evolution
+    checkpoint : :class:`~pandas.DataFrame`
+        Output of :func:`create_presn_checkpoint` for the template this population was drawn from
+    processes : int, optional
+        Number of worker processes. Default is ``pop.processes``.
+    tolerance : float, optional
+        Maximum difference (in Myr) between the first supernova time of a system and the checkpoint for
+        the checkpoint to be used. Default is 1e-6.
+    progress_bar : bool, optional
+        Whether to show a progress bar. Default is True.
+
+    Returns
+    -------
+    n_from_checkpoint : int
+        Number of orbits that were started from the checkpoint
+    """
+    pop._orbits = None
+    pop._final_pos = None
+    pop._final_vel = None
+    pop._observables = None
+    processes = pop.processes if processes is None else processes
+
+    primary_events, secondary_events = identify_events(p=pop)
+
+    t_birth = (pop.max_ev_time - pop.initial_galaxy.tau).to(u.Myr).value
+    gal = pop.initial_galaxy
+    w0 = np.transpose([a.to(u.kpc).value for a in [gal.x, gal.y, gal.z]]
+                      + [a.to(u.km / u.s).value for a in [gal.v_x, gal.v_y, gal.v_z]])
+
+    # decide which systems can start from the checkpoint
+    t_sn = first_sn_times(pop).reindex(pop.bin_nums).values
+    cp = checkpoint.reindex(pop.bin_nums)
+    use_checkpoint = np.abs(t_sn - cp["t_first_sn"].values) <= tolerance
+    w0[use_checkpoint] = cp.loc[use_checkpoint, ["x", "y", "z", "v_x", "v_y", "v_z"]].values
+    t_start = np.where(use_checkpoint, cp["t_checkpoint"].values, t_birth)
+
+    def args():
+        for i, events in _iter_events(pop, primary_events, secondary_events):
+            if events is not None and use_checkpoint[i]:
+                # events are timed relative to the start of the integration, which is the first supernova
+                events = events.copy()
+                events["tphys"] = np.maximum(events["tphys"] - t_sn[i], 0.0)
+            yield (gd.PhaseSpacePosition(pos=w0[i, :3] * u.kpc, vel=w0[i, 3:] * u.km / u.s),
+                   t_start[i] * u.Myr, pop.timestep_size.copy(), events)
+
+    n_orbits = len(pop) + pop.disrupted.sum()
+    initargs = (pop.galactic_potential, pop.max_ev_time, pop.store_entire_orbits, pop.integrator,
+                pop.integrator_kwargs, pop.orbit_integration_retry_settings)
+    iterable = tqdm(args(), total=n_orbits, desc="Integrating orbits", disable=not progress_bar)
+    if processes > 1:
+        with Pool(processes=processes, initializer=_init_worker, initargs=initargs) as pool:
+            orbit_list = pool.starmap(_orbit_worker, iterable)
+    else:
+        _init_worker(*initargs)
+        orbit_list = [_orbit_worker(*arg) for arg in iterable]
+
+    n_from_checkpoint = use_checkpoint.sum() + use_checkpoint[pop.disrupted].sum()
+    pop._orbits = _remove_failed_orbits(pop, np.array(orbit_list, dtype="object"))
+
+    return n_from_checkpoint
+
+
+def _remove_failed_orbits(pop, orbit_list):
+    """Remove systems with an orbit that failed to integrate (and the orbits of their companions) from the
+    population, saving them to ``pop.error_file_path`` if it is set, as in cogsworth."""
+    failed = np.array([orbit is None for orbit in orbit_list], dtype=bool)
+    if not failed.any():
+        return orbit_list
+
+    orbit_bin_nums = np.concatenate((pop.bin_nums, pop.bin_nums[pop.disrupted]))
+    bad_bin_nums = np.unique(orbit_bin_nums[failed])
+    message = f"Warning: {failed.sum()} orbit(s) failed to integrate, removing their systems"
+
+    if pop.error_file_path is not None:
+        # don't overwrite the systems saved by an earlier failure
+        file_name = os.path.join(pop.error_file_path, "failed_integration_binaries.h5")
+        file_num = 1
+        while os.path.exists(file_name):
+            file_name = os.path.join(pop.error_file_path, f"failed_integration_binaries_{file_num}.h5")
+            file_num += 1
+
+        pop.initial_binaries.loc[bad_bin_nums].to_hdf(file_name, key="initial_binaries")
+        pop.bpp.loc[bad_bin_nums].to_hdf(file_name, key="bpp")
+        pop.kick_info.loc[bad_bin_nums].to_hdf(file_name, key="kick_info")
+        pop.initial_galaxy[np.isin(pop.bin_nums, bad_bin_nums)].save(file_name, key="sfh")
+        message += f" (saved to {file_name})"
+    print(message)
+
+    orbit_list = orbit_list[~np.isin(orbit_bin_nums, bad_bin_nums)]
+    pop.__dict__.update(pop[~np.isin(pop.bin_nums, bad_bin_nums)].__dict__)
+    return orbit_list
+
+
+def _iter_events(pop, primary_events, secondary_events):
+    """Yield the index and events of each orbit in the same order as cogsworth (primaries, then the
+    secondaries of disrupted binaries)."""
+    for i, bin_num in enumerate(pop.bin_nums):
+        yield i, primary_events.loc[[bin_num]] if bin_num in primary_events.index else None
+    for i in np.flatnonzero(pop.disrupted):
+        yield i, secondary_events.loc[[pop.bin_nums[i]]]
@@ -0,0 +1,259 @@
+import numpy as np
+import pandas as pd
+import astropy.units as u
+
+import json
+import os
+
+from remnants import RemnantTable
+
+
+# "single" is for stars that were never in a binary (e.g. the Sweeney+22 emulation)
+BINARY_STATUSES = ["bound", "disrupted", "merged", "single"]
+
+
+def binary_status(pop, bin_nums):
+    """Index into :data:`BINARY_STATUSES` of the final state of the systems with some bin_nums."""
+    rows = pd.Index(pop.final_bpp["bin_num"].values).get_indexer(bin_nums)
+    sep = pop.final_bpp["sep"].values[rows]
+    return np.where(sep > 0, 0, np.where(pop.disrupted[rows], 1, 2))
+
+
+def _edges(lower, upper, n):
+    """Log-spaced edges with an extra bin below ``lower`` (down to zero) and above ``upper`` (to infinity)."""
+    return np.concatenate(([0.0], np.geomspace(lower, upper, n + 1), [np.inf]))
+
+
+DEFAULT_EDGES = {
+    "mass": _edges(1.0, 150.0, 60),
+    "abs_z": _edges(1e-3, 3e4, 105),
+    "R": _edges(1e-2, 3e4, 90),
+    "speed": _edges(1.0, 1e4, 80),
+}
+
+
+class PopulationCube():
+    """A sparse histogram of every compact object in a population over all of the quantities we compare.
+
+    Compact objects are binned once over compact object type (NS or BH), whether they escaped, mass,
+    :math:`|z|`, cylindrical radius :math:`R`, speed and binary status (see :data:`BINARY_STATUSES`). Only
+    occupied bins are stored (as flat bin indices and counts), so even fine binning takes little memory and
+    every later histogram or table is a marginalisation of the cube (see :meth:`histogram` and
+    :meth:`count`) rather than another pass over ``final_bpp`` and the kinematics.
+
+    The outer bins of the continuous axes run down to zero and up to infinity so that no objects with finite
+    values are dropped. Objects with a non-finite mass, position or speed (e.g. from an orbit that failed to
+    integrate) are left out and counted in :attr:`n_dropped`, except for populations whose remnant masses
+    aren't modelled at all (e.g. the Sweeney+22 emulation), which get a single mass bin from zero to infinity.
+
+    Parameters
+    ----------
+    indices : :class:`~numpy.ndarray`, shape (M,)
+        Sorted flat indices (see :func:`numpy.ravel_multi_index`) of the occupied bins
+    counts : :class:`~numpy.ndarray`, shape (M,)
+        Number of compact objects in each occupied bin
+    edges : dict
+        Bin edges of each continuous axis (see :data:`DEFAULT_EDGES`)
+    label : str, optional
+        Label of the population
+    mass_binaries : float, optional
+        Total mass of the simulated binaries, used for scaling counts up to the Milky Way
+    n_dropped : int, optional
+        Number of compact objects left out of the cube for having non-finite values. Default is 0.
+    """
+    AXES = ["co_type", "escaped", "mass", "abs_z", "R", "speed", "status"]
+    CATEGORIES = {"co_type": ["NS", "BH"], "escaped": [False, True], "status": BINARY_STATUSES}
+    UNITS = {"mass": u.Msun, "abs_z": u.kpc, "R": u.kpc, "speed": u.km / u.s}
+
+    def __init__(self, indices, counts, edges=DEFAULT_EDGES, label=None, mass_binaries=None, n_dropped=0):
+        self.indices = indices
+        self.counts = counts
+        self.edges = {axis: np.asarray(edges[axis], dtype=float) for axis in self.UNITS}
+        self.label = label
+        self.mass_binaries = mass_binaries
+        self.n_dropped = int(n_dropped)
+
+    def __len__(self):
+        return int(self.counts.sum())
+
+    def __repr__(self):
+        return (f"<PopulationCube{'' if self.label is None else f' ({self.label})'}: {len(self)} COs in "
+                f"{len(self.counts)} occupied bins, {self.n_dropped} dropped>")
+
+    @property
+    def shape(self):
+        return tuple(len(self.CATEGORIES[axis]) if axis in self.CATEGORIES else len(self.edges[axis]) - 1
+                     for axis in self.AXES)
+
+    @property
+    def scale_up(self):
+        """Factor to scale counts up to the mass of the Milky Way (6e10 Msun)."""
+        return 6e10 / self.mass_binaries
+
+    @classmethod
+    def from_table(cls, table, status, edges=DEFAULT_EDGES, mass_binaries=None):
+        """Bin a remnant table, leaving out (and counting in :attr:`n_dropped`) compact objects with a
+        non-finite mass, position or speed. If no object has a mass (e.g. emulated remnants) then they
+        are kept in a single mass bin instead.
+
+        Parameters
+        ----------
+        table : :class:`~remnants.RemnantTable`
+            Table of compact objects
+        status : :class:`~numpy.ndarray`, shape (len(table),)
+            Index into :data:`BINARY_STATUSES` of the binary status of each compact object
+        edges : dict, optional
+            Bin edges of each continuous axis. Default is :data:`DEFAULT_EDGES`.
+        mass_binaries : float, optional
+            Total mass of the simulated binaries
+
+        Returns
+        -------
+        cube : :class:`PopulationCube`
+        """
+        pos = table.data[0:3]
+        values = {
+            "mass": table.column("mass"),
+            "abs_z": np.abs(pos[2]),
+            "R": np.sqrt(pos[0]**2 + pos[1]**2),
+            "speed": np.sqrt(np.sum(table.data[3:6]**2, axis=0)),
+        }
+
+        # masses that aren't modelled can't be binned, but they shouldn't end up in the lowest mass bin
+        if len(table.kstar) > 0 and not np.isfinite(values["mass"]).any():
+            edges = dict(edges, mass=np.array([0.0, np.inf]))
+            values["mass"] = np.zeros(len(table.kstar))
+
+        # NaN would otherwise be clipped into the outer bins
+        finite = np.logical_and.reduce([np.isfinite(values[axis]) for axis in values])
+
+        multi_index = []
+        for axis in cls.AXES:
+            if axis == "co_type":
+                multi_index.append((table.kstar[finite] == 14).astype(np.intp))
+            elif axis == "escaped":
+                multi_index.append(table.escaped[finite].astype(np.intp))
+            elif axis == "status":
+                multi_index.append(np.asarray(status, dtype=np.intp)[finite])
+            else:
+                bins = np.searchsorted(edges[axis], values[axis][finite], side="right") - 1
+                multi_index.append(np.clip(bins, 0, len(edges[axis]) - 2))
+
+        cube = cls(np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64), edges=edges, label=table.label,
+                   mass_binaries=mass_binaries, n_dropped=(~finite).sum())
+        flat = np.ravel_multi_index(multi_index, cube.shape)
+        cube.indices, cube.counts = np.unique(flat, return_counts=True)
+        return cube
+
+    @classmethod
+    def from_population(cls, pop, table=None, edges=DEFAULT_EDGES, status=None, **kwargs):
+        """Bin every compact object in a population.
+
+        Parameters
+        ----------
+        pop : :class:`~cogsworth.pop.Population`
+            Population that has been through galactic evolution
+        table : :class:`~remnants.RemnantTable`, optional
+            Remnant table of the population (e.g. from :func:`~helpers.get_kinematics`). Default is to build
+            one, passing any other keyword arguments to :meth:`~remnants.RemnantTable.from_population`.
+        edges : dict, optional
+            Bin edges of each continuous axis. Default is :data:`DEFAULT_EDGES`.
+        status : int, optional
+            Index into :data:`BINARY_STATUSES` to give every compact object (e.g. "single" for a population
+            of single stars evolved as wide pseudo-binaries). Default is the status of each system.
+
+        Returns
+        -------
+        cube : :class:`PopulationCube`
+        """
+        if table is None:
+            table = RemnantTable.from_population(pop, **kwargs)
+
+        # binary status is a property of the whole system, look it up by bin_num
+        if status is None:
+            status = binary_status(pop, table.bin_num)
+        else:
+            status = np.full(len(table.bin_num), status)
+        return cls.from_table(table, status, edges=edges, mass_binaries=pop.mass_binaries)
+
+    def _select(self, keep, selections):
+        """Multi-index of the occupied bins that pass the selections, and the counts in those bins."""
+        multi_index = np.unravel_index(self.indices, self.shape)
+        mask = np.ones(len(self.indices), dtype=bool)
+        for axis, value in selections.items():
+            if value is None:
+                continue
+            i = self.AXES.index(axis)
+            if axis in self.CATEGORIES:
+                values = value if isinstance(value, (list, tuple)) else [value]
+                allowed = [self.CATEGORIES[axis].index(v) for v in values]
+                mask &= np.isin(multi_index[i], allowed)
+            else:
+                # a (lower, upper) range of values, which only selects whole bins within the range
+                lower, upper = (v.to_value(self.UNITS[axis]) if hasattr(v, "unit") else v for v in value)
+                edges = self.edges[axis]
+                mask &= (edges[multi_index[i]] >= lower) & (edges[multi_index[i] + 1] <= upper)
+        return [multi_index[self.AXES.index(axis)][mask] for axis in keep], self.counts[mask]
+
+    def histogram(self, *axes, scale=False, **selections):
+        """Marginalise the cube onto some of its axes.
+
+        Parameters
+        ----------
+        *axes : str
+            Axes to keep (any of :attr:`AXES`), in the order of the output dimensions
+        scale : bool, optional
+            Whether to scale counts up to the Milky Way (see :attr:`scale_up`). Default is False.
+        **selections
+            Restrict any axis before marginalising. Categorical axes take a value or list of values (e.g.
+            ``co_type="NS"``, ``escaped=False``, ``status=["bound", "merged"]``) and continuous axes take a
+            ``(lower, upper)`` range, which must lie on bin edges to be exact (e.g. ``abs_z=(0, 10)``).
+
+        Returns
+        -------
+        hist : :class:`~numpy.ndarray`
+            Histogram with one dimension for each of ``axes``
+        """
+        for axis in list(axes) + list(selections):
+            if axis not in self.AXES:
+                raise ValueError(f"Unknown axis '{axis}', choose from {self.AXES}")
+
+        multi_index, counts = self._select(axes, selections)
+        shape = tuple(self.shape[self.AXES.index(axis)] for axis in axes)
+        flat = np.ravel_multi_index(multi_index, shape) if axes else np.zeros(len(counts), dtype=np.intp)
+        hist = np.bincount(flat, weights=counts, minlength=int(np.prod(shape))).reshape(shape)
+        return hist * self.scale_up if scale else hist.astype(np.int64)
+
+    def count(self, scale=False, **selections):
+        """Number of compact objects that pass the selections (see :meth:`histogram`)."""
+        return self.histogram(scale=scale, **selections)[()]
+
+    def table(self, *axes, scale=False, **selections):
+        """Counts split by categorical axes as a :class:`~pandas.Series` (see :meth:`histogram`)."""
+        for axis in axes:
+            if axis not in self.CATEGORIES:
+                raise ValueError(f"Tables can only be split by categorical axes {list(self.CATEGORIES)}")
+        hist = self.histogram(*axes, scale=scale, **selections)
+        index = pd.MultiIndex.from_product([self.CATEGORIES[axis] for axis in axes], names=axes)
+        return pd.Series(hist.ravel(), index=index, name=self.label)
+
+    def save(self, file_name):
+        """Save the cube to a ``.npz`` file."""
+        meta = json.dumps({"label": self.label, "mass_binaries": self.mass_binaries,
+                           "n_dropped": self.n_dropped})
+        tmp_name = file_name + ".tmp.npz"
+        np.savez(tmp_name, indices=self.indices, counts=self.counts, meta=meta,
+                 **{f"edges_{axis}": self.edges[axis] for axis in self.edges})
+        os.replace(tmp_name, file_name)
+
+    @classmethod
+    def load(cls, file_name):
+        with np.load(file_name) as f:
+            meta = json.loads(str(f["meta"]))
+            return cls(f["indices"], f["counts"], edges={axis: f[f"edges_{axis}"] for axis in cls.UNITS},
+                       **meta)
+
+
+def compare_cubes(cubes, *axes, scale=False, **selections):
+    """Table of counts in each population, split by categorical axes (see :meth:`PopulationCube.table`)."""
+    return pd.concat([cube.table(*axes, scale=scale, **selections) for cube in cubes], axis=1)
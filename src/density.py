@@ -0,0 +1,140 @@
+import numpy as np
+import astropy.units as u
+from scipy.ndimage import gaussian_filter
+
+import os
+
+
+def _chunk_values(arr, start, stop, unit=u.kpc):
+    """A chunk of an array (or Quantity, or memmap) as plain floats, only reading the chunk from disk."""
+    chunk = arr[start:stop]
+    if hasattr(chunk, "unit"):
+        return chunk.to_value(unit)
+    return np.asarray(chunk, dtype=float)
+
+
+class DensityMap():
+    """A 2D histogram that is accumulated in chunks and stored along with its binning.
+
+    Points are binned by computing their integer bin indices directly and counting them with
+    :func:`numpy.bincount`, a chunk at a time, so the inputs can be much larger than memory (e.g.
+    memory-mapped arrays) and are never copied, masked or converted in full. Once built, the map can be saved
+    and reused for plotting with different smoothing, contours or colour limits without binning again.
+
+    Parameters
+    ----------
+    x_range : tuple of float
+        Range of the first coordinate (kpc). Points outside ``[x_range[0], x_range[1])`` are ignored.
+    z_range : tuple of float
+        Range of the second coordinate (kpc). Points outside ``[z_range[0], z_range[1])`` are ignored.
+    n_bins : int
+        Number of bins in each coordinate
+    counts : :class:`~numpy.ndarray`, shape (n_bins, n_bins), optional
+        Existing counts. Default is an empty map.
+    """
+    def __init__(self, x_range, z_range, n_bins, counts=None):
+        self.x_range = tuple(float(v) for v in x_range)
+        self.z_range = tuple(float(v) for v in z_range)
+        self.n_bins = int(n_bins)
+        self.counts = np.zeros((self.n_bins, self.n_bins), dtype=np.int64) if counts is None else counts
+        self._smoothed = {}
+
+    def __repr__(self):
+        return (f"<DensityMap: x={self.x_range}, z={self.z_range}, {self.n_bins}x{self.n_bins} bins, "
+                f"{self.counts.sum()} points>")
+
+    @property
+    def binning(self):
+        return self.x_range, self.z_range, self.n_bins
+
+    @property
+    def x_edges(self):
+        return np.linspace(*self.x_range, self.n_bins + 1)
+
+    @property
+    def z_edges(self):
+        return np.linspace(*self.z_range, self.n_bins + 1)
+
+    def add(self, x, z, fold_x=False, chunk_size=10_000_000):
+        """Add points to the map.
+
+        Parameters
+        ----------
+        x, z : array-like or :class:`~astropy.units.Quantity`, shape (N,)
+            Coordinates (in kpc if not a Quantity), which may be memory-mapped
+        fold_x : bool, optional
+            Whether to bin :math:`|x|` rather than :math:`x`. Default is False.
+        chunk_size : int, optional
+            Number of points to bin at once, which sets the peak memory usage. Default is 10,000,000.
+
+        Returns
+        -------
+        self : :class:`DensityMap`
+        """
+        n = self.n_bins
+        x_lo, x_hi = self.x_range
+        z_lo, z_hi = self.z_range
+        x_scale, z_scale = n / (x_hi - x_lo), n / (z_hi - z_lo)
+
+        for start in range(0, len(x), chunk_size):
+            x_chunk = _chunk_values(x, start, start + chunk_size)
+            z_chunk = _chunk_values(z, start, start + chunk_size)
+            if fold_x:
+                x_chunk = np.abs(x_chunk)
+
+            inside = (x_chunk >= x_lo) & (x_chunk < x_hi) & (z_chunk >= z_lo) & (z_chunk < z_hi)
+            i = ((x_chunk[inside] - x_lo) * x_scale).astype(np.intp)
+            j = ((z_chunk[inside] - z_lo) * z_scale).astype(np.intp)
+
+            # rounding can put points right at the upper edge into bin n, they belong in the last bin
+            np.minimum(i, n - 1, out=i)
+            np.minimum(j, n - 1, out=j)
+            i *= n
+            i += j
+            self.counts += np.bincount(i, minlength=n * n).reshape(n, n)
+
+        self._smoothed = {}
+        return self
+
+    def smoothed(self, sigma=1.0):
+        """Counts smoothed with a Gaussian kernel of width ``sigma`` bins (cached for each ``sigma``)."""
+        if sigma not in self._smoothed:
+            self._smoothed[sigma] = gaussian_filter(self.counts.astype(float), sigma=sigma)
+        return self._smoothed[sigma]
+
+    def save(self, file_name):
+        """Save the map and its binning to a ``.npz`` file."""
+        tmp_name = file_name + ".tmp.npz"
+        np.savez(tmp_name, counts=self.counts, x_range=self.x_range, z_range=self.z_range, n_bins=self.n_bins)
+        os.replace(tmp_name, file_name)
+
+    @classmethod
+    def load(cls, file_name):
+        with np.load(file_name) as f:
+            return cls(f["x_range"], f["z_range"], int(f["n_bins"]), counts=f["counts"])
+
+
+def side_on_density_map(x, z, xlim=20, zlim=12, n_bins=200, chunk_size=10_000_000):
+    """Histogram of :math:`(|x|, z)` for :func:`~plotting.plot_side_on_density`.
+
+    Build these once and pass them to :func:`~plotting.plot_side_on_density` in place of the coordinates to
+    change the smoothing, contours or colours without binning again.
+
+    Parameters
+    ----------
+    x, z : array-like or :class:`~astropy.units.Quantity`, shape (N,)
+        Coordinates (in kpc if not a Quantity), which may be memory-mapped
+    xlim : float, optional
+        Limit for x in kpc. Default is 20.
+    zlim : float, optional
+        Limit for z in kpc. Default is 12.
+    n_bins : int, optional
+        Number of bins in each coordinate. Default is 200.
+    chunk_size : int, optional
+        Number of points to bin at once. Default is 10,000,000.
+
+    Returns
+    -------
+    density_map : :class:`DensityMap`
+    """
+    return DensityMap((0, xlim), (-zlim, zlim), n_bins).add(x, z, fold_x=True, chunk_size=chunk_size)
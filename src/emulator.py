@@ -0,0 +1,437 @@
+import numpy as np
+import pandas as pd
+import astropy.units as u
+from scipy.stats import maxwell
+
+import json
+import os
+
+import orbits
+from cube import BINARY_STATUSES, DEFAULT_EDGES, PopulationCube
+from remnants import RemnantTable
+
+
+def sweeney_initial_conditions(template, min_mass=8):
+    """Every star of the template that can leave a remnant, as in Section 2 of Sweeney+2022.
+
+    Both stars of every binary are treated as single stars (with the galactic position and velocity of the
+    binary) and only those above ``min_mass`` are kept.
+
+    Parameters
+    ----------
+    template : :class:`~cogsworth.pop.Population`
+        Template population (only its ``initC`` and ``initial_galaxy`` are used)
+    min_mass : float, optional
+        Minimum initial mass (Msun) of a star that forms a remnant. Default is 8.
+
+    Returns
+    -------
+    stars : :class:`~pandas.DataFrame`
+        Initial mass, ``bin_num``, positions (kpc), cartesian velocities (km/s) and ages (Gyr) of each star
+    """
+    galaxy = template.initial_galaxy
+    pop = pd.DataFrame({
+        "mass": np.concatenate([template.initC["mass_1"], template.initC["mass_2"]]),
+        "bin_num": np.concatenate([template.initC["bin_num"], template.initC["bin_num"]]),
+        "x": np.concatenate([galaxy.x, galaxy.x]),
+        "y": np.concatenate([galaxy.y, galaxy.y]),
+        "z": np.concatenate([galaxy.z, galaxy.z]),
+        "v_R": np.concatenate([galaxy.v_R, galaxy.v_R]),
+        "v_T": np.concatenate([galaxy.v_T, galaxy.v_T]),
+        "v_z": np.concatenate([galaxy.v_z, galaxy.v_z]),
+        "tau": np.concatenate([galaxy.tau, galaxy.tau]),
+    })
+    pop = pop[pop["mass"] > min_mass].reset_index(drop=True)
+
+    # convert velocities to cartesian
+    pop["R"] = np.sqrt(pop["x"]**2 + pop["y"]**2)
+    pop["v_x"] = -pop["v_T"] * (pop["y"] / pop["R"]) + pop["v_R"] * (pop["x"] / pop["R"])
+    pop["v_y"] = pop["v_T"] * (pop["x"] / pop["R"]) + pop["v_R"] * (pop["y"] / pop["R"])
+    return pop
+
+
+class Prescription():
+    """A single-star remnant prescription, declared as rules on the initial mass of each star.
+
+    Every rule applies to initial masses (Msun) in ``[lo, hi)``, use ``np.inf`` for no upper limit. Rules are
+    applied to whole arrays of masses at once, so a prescription can be tried on every star of a template
+    (see :func:`screen_prescriptions`) in the time it takes to integrate their orbits, long before running
+    COSMIC with it.
+
+    Parameters
+    ----------
+    remnant_types : list of tuple
+        ``(lo, hi, kstar)`` rules giving the remnant type (13 for NS, 14 for BH), the first rule that covers
+        a mass is used and stars that no rule covers leave no remnant
+    kick_distributions : list of tuple
+        ``(lo, hi, components)`` rules, where ``components`` is a list of ``(weight, scale)`` of Maxwellians
+        (scale in km/s) that make up the kick distribution. Each component gets its share of the stars that
+        the rule covers (rounded down) in random order. The first rule that covers a mass is used and stars
+        that no rule covers get no kick.
+    fallback : list of tuple, optional
+        ``(lo, hi, factor)`` rules that multiply the kick magnitudes (e.g. to reduce kicks for fallback or
+        momentum conservation, 0 for direct collapse), every rule that covers a mass is applied in order
+    label : str, optional
+        Name of the prescription
+    """
+    def __init__(self, remnant_types, kick_distributions, fallback=(), label=None):
+        self.remnant_types = list(remnant_types)
+        self.kick_distributions = list(kick_distributions)
+        self.fallback = list(fallback)
+        self.label = label
+
+    def __repr__(self):
+        return (f"<Prescription{'' if self.label is None else f' ({self.label})'}: "
+                f"{len(self.remnant_types)} remnant, {len(self.kick_distributions)} kick and "
+                f"{len(self.fallback)} fallback rules>")
+
+    @property
+    def min_mass(self):
+        """Lowest initial mass that leaves a remnant."""
+        return min(lo for lo, _, _ in self.remnant_types)
+
+    @staticmethod
+    def _first_rule(mass, rules):
+        """Index of the first rule that covers each mass, -1 where none do."""
+        rule = np.full(len(mass), -1)
+        for i, (lo, hi, _) in reversed(list(enumerate(rules))):
+            rule[(mass >= lo) & (mass < hi)] = i
+        return rule
+
+    def remnant_type(self, mass):
+        """Remnant type (kstar) of stars with some initial masses, -1 for stars that leave no remnant."""
+        mass = np.asarray(mass, dtype=float)
+        rule = self._first_rule(mass, self.remnant_types)
+        kstar = np.array([kstar for _, _, kstar in self.remnant_types] + [-1])
+        return kstar[rule]
+
+    def draw_kicks(self, mass, rng):
+        """Draw natal kick vectors (km/s) for stars with some initial masses.
+
+        Parameters
+        ----------
+        mass : :class:`~numpy.ndarray`, shape (N,)
+            Initial masses (Msun)
+        rng : :class:`~numpy.random.Generator`
+            Random number generator
+
+        Returns
+        -------
+        kicks : :class:`~numpy.ndarray`, shape (N, 3)
+        """
+        mass = np.asarray(mass, dtype=float)
+        n = len(mass)
+        kicks = np.zeros(n)
+
+        rule = self._first_rule(mass, self.kick_distributions)
+        for i, (_, _, components) in enumerate(self.kick_distributions):
+            covered = rule == i
+            weights = np.array([weight for weight, _ in components], dtype=float)
+            bounds = np.floor(np.cumsum(weights) / weights.sum() * covered.sum() + 1e-6).astype(np.int64)
+            magnitudes = np.concatenate([maxwell(scale=scale).rvs(size=size, random_state=rng)
+                                         for (_, scale), size in zip(components, np.diff(bounds, prepend=0))])
+
+            # not really necessary, but shuffle to avoid any ordering effects
+            rng.shuffle(magnitudes)
+            kicks[covered] = magnitudes
+
+        return self._kick_vectors(mass, kicks, rng.uniform(-1, 1, size=n), rng.uniform(0, 2 * np.pi, size=n))
+
+    def kicks_from_uniforms(self, mass, uniforms):
+        """Natal kick vectors (km/s) of stars from their own uniform random numbers, by inverse-CDF sampling.
+
+        The first number of each star picks its Maxwellian component (with probability equal to the
+        component's weight, rather than the exact shares of :meth:`draw_kicks`), the second its kick
+        magnitude within that component and the last two its direction. A star given the same numbers by
+        two prescriptions therefore gets the same kick wherever they agree and a kick that changes
+        smoothly with their settings where they don't, however their rules are laid out.
+
+        Parameters
+        ----------
+        mass : :class:`~numpy.ndarray`, shape (N,)
+            Initial masses (Msun)
+        uniforms : :class:`~numpy.ndarray`, shape (N, 4)
+            Uniform random numbers in [0, 1) of each star
+
+        Returns
+        -------
+        kicks : :class:`~numpy.ndarray`, shape (N, 3)
+        """
+        mass = np.asarray(mass, dtype=float)
+        u_component, u_magnitude, u_theta, u_phi = np.asarray(uniforms, dtype=float).T
+        kicks = np.zeros(len(mass))
+
+        rule = self._first_rule(mass, self.kick_distributions)
+        for i, (_, _, components) in enumerate(self.kick_distributions):
+            covered = rule == i
+            weights = np.array([weight for weight, _ in components], dtype=float)
+            scales = np.array([scale for _, scale in components], dtype=float)
+            cdf = np.cumsum(weights) / weights.sum()
+            component = np.minimum(np.searchsorted(cdf, u_component[covered], side="right"),
+                                   len(components) - 1)
+            kicks[covered] = maxwell(scale=scales[component]).ppf(u_magnitude[covered])
+
+        return self._kick_vectors(mass, kicks, 2 * u_theta - 1, 2 * np.pi * u_phi)
+
+    def _kick_vectors(self, mass, kicks, cos_theta, phi):
+        """Apply the fallback rules to kick magnitudes and give them isotropic directions, shape (N, 3)."""
+        for lo, hi, factor in self.fallback:
+            kicks[(mass >= lo) & (mass < hi)] *= factor
+
+        theta = np.arccos(cos_theta)
+        return kicks[:, None] * np.transpose([np.sin(theta) * np.cos(phi), np.sin(theta) * np.sin(phi),
+                                              np.cos(theta)])
+
+
+# Section 2 and Eq 1-2 of Sweeney+2022: stars above 8 Msun leave a NS (or a BH from 25 Msun), a fifth of kicks
+# come from a Maxwellian with a scale of 56 km/s and the rest from one with 336 km/s, BH kicks are reduced by
+# a factor of 1.35 / 7.8 and direct collapse (above 40 Msun) gives no kick
+SWEENEY = Prescription(remnant_types=[(8, 25, 13), (25, np.inf, 14)],
+                       kick_distributions=[(8, np.inf, [(0.2, 56), (0.8, 336)])],
+                       fallback=[(25, np.inf, 1.35 / 7.8), (40, np.inf, 0.0)],
+                       label="Sweeney+22")
+
+
+def draw_sweeney_kicks(mass, rng):
+    """Draw natal kick vectors (km/s) from Eq 1-2 of Sweeney+2022 (see :data:`SWEENEY`), shape (N, 3)."""
+    return SWEENEY.draw_kicks(mass, rng)
+
+
+def _remnant_table(final_pos, final_vel, kstar, bin_num, v_esc, label=None):
+    """A :class:`~remnants.RemnantTable` of emulated remnants (remnant masses are not modelled)."""
+    order = np.argsort(kstar, kind="stable")
+    data = np.empty((len(RemnantTable.COLUMNS), len(kstar)))
+    data[0:3] = final_pos[order].T
+    data[3:6] = final_vel[order].T
+    data[6] = np.nan
+    data[7] = kstar[order]
+    data[8] = bin_num[order]
+    data[9] = np.sqrt(np.sum(final_vel[order]**2, axis=1)) >= v_esc[order]
+    return RemnantTable(data, np.count_nonzero(kstar == 13), label=label)
+
+
+class SweeneyEnsemble():
+    """Summaries of many independent realisations of the Sweeney+2022 kick model (or another
+    :class:`Prescription`) for one population.
+
+    Each realisation is summarised by a :class:`~cube.PopulationCube` as soon as its orbits are integrated,
+    so the full catalogues of the realisations are never stored. Differences between realisations measure
+    the Monte Carlo noise of the model.
+
+    Parameters
+    ----------
+    cubes : list of :class:`~cube.PopulationCube`
+        Summary of each realisation
+    seed : int, optional
+        Seed from which the random streams of the realisations were spawned
+    """
+    def __init__(self, cubes, seed=None):
+        self.cubes = cubes
+        self.seed = seed
+
+    def __len__(self):
+        return len(self.cubes)
+
+    def __repr__(self):
+        return f"<SweeneyEnsemble: {len(self)} realisations, seed={self.seed}>"
+
+    def histograms(self, axis, scale=False, **selections):
+        """Histogram of one axis in each realisation, shape (n_realisations, n_bins)."""
+        return np.array([cube.histogram(axis, scale=scale, **selections) for cube in self.cubes])
+
+    def counts(self, scale=False, **selections):
+        """Number of remnants that pass the selections in each realisation."""
+        return np.array([cube.count(scale=scale, **selections) for cube in self.cubes])
+
+    def escape_fractions(self, **selections):
+        """Fraction of remnants that escaped in each realisation."""
+        return self.counts(escaped=True, **selections) / self.counts(**selections)
+
+    def summary(self, axis, quantiles=(0.16, 0.5, 0.84), **selections):
+        """Mean, standard deviation and quantiles over the realisations of the histogram of one axis."""
+        hists = self.histograms(axis, **selections)
+        return {"edges": self.cubes[0].edges[axis], "mean": hists.mean(axis=0), "std": hists.std(axis=0),
+                "quantiles": np.quantile(hists, quantiles, axis=0)}
+
+    def save(self, directory):
+        """Save every realisation's cube to a directory."""
+        os.makedirs(directory, exist_ok=True)
+        for i, cube in enumerate(self.cubes):
+            cube.save(os.path.join(directory, f"realisation-{i:04d}.npz"))
+        with open(os.path.join(directory, "ensemble.json"), "w") as f:
+            json.dump({"n_realisations": len(self), "seed": self.seed}, f)
+
+    @classmethod
+    def load(cls, directory):
+        with open(os.path.join(directory, "ensemble.json")) as f:
+            meta = json.load(f)
+        cubes = [PopulationCube.load(os.path.join(directory, f"realisation-{i:04d}.npz"))
+                 for i in range(meta["n_realisations"])]
+        return cls(cubes, seed=meta["seed"])
+
+
+def run_sweeney_ensemble(stars, potential, t1, t2, n_realisations, seed=None, realisations_per_batch=4,
+                         mass_binaries=None, escape_velocity=None, edges=DEFAULT_EDGES, prescription=SWEENEY,
+                         **integrate_kwargs):
+    """Run many independent realisations of the kicks of a prescription (default Sweeney+2022) for some stars.
+
+    Every realisation draws its kicks from its own random stream (spawned from ``seed`` with
+    :class:`~numpy.random.SeedSequence`) so the realisations are independent and each is reproducible on its
+    own. The initial conditions are shared and the orbits of ``realisations_per_batch`` realisations are
+    integrated together with :func:`~orbits.integrate_orbits` (which groups orbits with the same start time
+    across realisations). Each batch is then summarised and discarded.
+
+    Parameters
+    ----------
+    stars : :class:`~pandas.DataFrame`
+        Stars from :func:`sweeney_initial_conditions`, every one of which must leave a remnant
+    potential : :class:`~gala.potential.potential.PotentialBase`
+        Galactic potential
+    t1 : :class:`~astropy.units.Quantity` [time], shape (N,)
+        Formation time of each star
+    t2 : :class:`~astropy.units.Quantity` [time]
+        Present day
+    n_realisations : int
+        Number of realisations
+    seed : int, optional
+        Seed of the ensemble. Default is None (different every time).
+    realisations_per_batch : int, optional
+        Number of realisations integrated at once, which sets the peak memory usage. Default is 4.
+    mass_binaries : float, optional
+        Total mass of the template, for scaling counts up to the Milky Way
+    escape_velocity : callable, optional
+        Function that takes positions in kpc with shape (3, N) and returns the escape velocity in km/s
+        (e.g. an :class:`~escape.EscapeVelocityGrid`). Default is to evaluate ``potential`` directly.
+    edges : dict, optional
+        Bin edges of the summary cubes. Default is :data:`~cube.DEFAULT_EDGES`.
+    prescription : :class:`Prescription`, optional
+        Remnant types and kicks of the stars. Default is :data:`SWEENEY`.
+    **integrate_kwargs
+        Passed to :func:`~orbits.integrate_orbits` (e.g. ``dt``, ``processes``, ``chunk_size``)
+
+    Returns
+    -------
+    ensemble : :class:`SweeneyEnsemble`
+
+    Raises
+    ------
+    ValueError
+        If any of the stars leave no remnant under ``prescription``
+    """
+    streams = np.random.SeedSequence(seed).spawn(n_realisations)
+    mass = stars["mass"].values
+    kstar = prescription.remnant_type(mass)
+    if np.any(kstar < 0):
+        raise ValueError(f"{np.count_nonzero(kstar < 0)} stars leave no remnant under {prescription}, "
+                         "select the stars that do first")
+    bin_num = stars["bin_num"].values
+    pos = stars[["x", "y", "z"]].values
+    vel = stars[["v_x", "v_y", "v_z"]].values
+    n = len(stars)
+    status = np.full(n, BINARY_STATUSES.index("single"))
+
+    cubes = []
+    for start in range(0, n_realisations, realisations_per_batch):
+        batch = streams[start:start + realisations_per_batch]
+        kicked_vel = np.concatenate([vel + prescription.draw_kicks(mass, np.random.default_rng(stream))
+                                     for stream in batch])
+
+        final_pos, final_vel = orbits.integrate_orbits(pos=np.tile(pos, (len(batch), 1)) * u.kpc,
+                                                       vel=kicked_vel * u.km / u.s,
+                                                       t1=np.tile(t1.to(u.Myr).value, len(batch)) * u.Myr,
+                                                       t2=t2, potential=potential, **integrate_kwargs)
+        final_pos, final_vel = final_pos.to(u.kpc).value, final_vel.to(u.km / u.s).value
+
+        if escape_velocity is None:
+            v_esc = np.sqrt(-2 * potential.energy(final_pos.T * u.kpc)).to(u.km / u.s).value
+        else:
+            v_esc = escape_velocity(final_pos.T)
+
+        for i in range(len(batch)):
+            rows = slice(i * n, (i + 1) * n)
+            table = _remnant_table(final_pos[rows], final_vel[rows], kstar, bin_num, v_esc[rows],
+                                   label=f"{prescription.label} ({start + i})")
+            cubes.append(PopulationCube.from_table(table, status, edges=edges, mass_binaries=mass_binaries))
+
+    return SweeneyEnsemble(cubes, seed=seed)
+
+
+def screen_prescriptions(template, prescriptions, seed=None, prescriptions_per_batch=4, escape_velocity=None,
+                         edges=DEFAULT_EDGES, **integrate_kwargs):
+    """Apply many remnant prescriptions to the stars of a template and summarise where their remnants end up.
+
+    Every star of the template is treated as a single star (see :func:`sweeney_initial_conditions`) and each
+    prescription picks out its remnants and draws their kicks. The orbits of ``prescriptions_per_batch``
+    prescriptions are integrated together with :func:`~orbits.integrate_orbits` (they share start times) and
+    each is summarised by a :class:`~cube.PopulationCube`. Every star of the template gets its own uniform
+    random numbers (from ``seed``) that every prescription turns into its kick with
+    :meth:`Prescription.kicks_from_uniforms`, so a star's kick only differs between prescriptions where their
+    rules do and differences between similar prescriptions aren't swamped by Monte Carlo noise.
+
+    Parameters
+    ----------
+    template : :class:`~cogsworth.pop.Population`
+        Template population (its ``initC``, ``initial_galaxy``, ``galactic_potential``, ``max_ev_time`` and
+        ``mass_binaries`` are used)
+    prescriptions : dict
+        :class:`Prescription` to try for each name
+    seed : int, optional
+        Seed of the kicks. Default is None (different every time).
+    prescriptions_per_batch : int, optional
+        Number of prescriptions integrated at once, which sets the peak memory usage. Default is 4.
+    escape_velocity : callable, optional
+        Function that takes positions in kpc with shape (3, N) and returns the escape velocity in km/s
+        (e.g. an :class:`~escape.EscapeVelocityGrid`). Default is to evaluate the potential directly.
+    edges : dict, optional
+        Bin edges of the summary cubes. Default is :data:`~cube.DEFAULT_EDGES`.
+    **integrate_kwargs
+        Passed to :func:`~orbits.integrate_orbits` (e.g. ``dt``, ``processes``, ``chunk_size``)
+
+    Returns
+    -------
+    cubes : dict
+        :class:`~cube.PopulationCube` of the remnants of each prescription
+    """
+    potential = template.galactic_potential
+    stars = sweeney_initial_conditions(template, min_mass=min(p.min_mass for p in prescriptions.values()))
+    mass = stars["mass"].values
+    bin_num = stars["bin_num"].values
+    pos = stars[["x", "y", "z"]].values
+    vel = stars[["v_x", "v_y", "v_z"]].values
+    t1 = (template.max_ev_time - stars["tau"].values * u.Gyr).to(u.Myr).value
+
+    # drawn for every star of the template, so a star has the same numbers in every prescription
+    uniforms = np.random.default_rng(seed).uniform(size=(len(stars), 4))
+
+    names = list(prescriptions)
+    cubes = {}
+    for start in range(0, len(names), prescriptions_per_batch):
+        batch = names[start:start + prescriptions_per_batch]
+        rows = {name: np.flatnonzero(prescriptions[name].remnant_type(mass) >= 0) for name in batch}
+        kicked_vel = np.concatenate([
+            vel[rows[name]] + prescriptions[name].kicks_from_uniforms(mass[rows[name]], uniforms[rows[name]])
+            for name in batch
+        ])
+        all_rows = np.concatenate([rows[name] for name in batch])
+
+        final_pos, final_vel = orbits.integrate_orbits(pos=pos[all_rows] * u.kpc, vel=kicked_vel * u.km / u.s,
+                                                       t1=t1[all_rows] * u.Myr, t2=template.max_ev_time,
+                                                       potential=potential, **integrate_kwargs)
+        final_pos, final_vel = final_pos.to(u.kpc).value, final_vel.to(u.km / u.s).value
+
+        if escape_velocity is None:
+            v_esc = np.sqrt(-2 * potential.energy(final_pos.T * u.kpc)).to(u.km / u.s).value
+        else:
+            v_esc = escape_velocity(final_pos.T)
+
+        offset = 0
+        for name in batch:
+            n = len(rows[name])
+            these = slice(offset, offset + n)
+            offset += n
+            table = _remnant_table(final_pos[these], final_vel[these],
+                                   prescriptions[name].remnant_type(mass[rows[name]]), bin_num[rows[name]],
+                                   v_esc[these], label=name)
+            cubes[name] = PopulationCube.from_table(table, np.full(n, BINARY_STATUSES.index("single")),
+                                                    edges=edges, mass_binaries=template.mass_binaries)
+    return cubes
@@ -0,0 +1,165 @@
+import numpy as np
+import astropy.units as u
+
+
+class EscapeVelocityGrid():
+    """Fast escape velocities from an interpolation grid of an axisymmetric potential in (R, |z|).
+
+    The potential is evaluated once on a grid that is uniform in :math:`\\sinh^{-1}(R / s)` and
+    :math:`\\sinh^{-1}(|z| / s)` (so it is finest near the Galactic centre and disc) and then bilinearly
+    interpolated. Positions outside the grid fall back to an exact evaluation of the potential.
+
+    The accuracy of the interpolation is measured when the grid is built by comparing to exact
+    evaluations at the centre of every grid cell (where bilinear interpolation error is largest). The
+    largest relative error in the escape velocity found this way is stored as :attr:`max_rel_error`.
+
+    Parameters
+    ----------
+    potential : :class:`~gala.potential.potential.PotentialBase`
+        An axisymmetric potential (e.g. :class:`~gala.potential.MilkyWayPotential2022`)
+    R_max : :class:`~astropy.units.Quantity` [length], optional
+        Extent of the grid in cylindrical radius. Default is 100 kpc.
+    z_max : :class:`~astropy.units.Quantity` [length], optional
+        Extent of the grid in height above/below the plane. Default is 100 kpc.
+    n_R : int, optional
+        Number of grid points in R. Default is 1000.
+    n_z : int, optional
+        Number of grid points in z. Default is 1000.
+    scale : :class:`~astropy.units.Quantity` [length], optional
+        Scale :math:`s` of the grid spacing transform. Default is 0.5 kpc.
+    chunk_size : int, optional
+        Number of positions to evaluate at once to limit memory usage. Default is 1,000,000.
+
+    Raises
+    ------
+    ValueError
+        If the potential is not axisymmetric.
+    """
+    def __init__(self, potential, R_max=100 * u.kpc, z_max=100 * u.kpc, n_R=1000, n_z=1000,
+                 scale=0.5 * u.kpc, chunk_size=1_000_000):
+        self.potential = potential
+        self.R_max = R_max.to(u.kpc).value
+        self.z_max = z_max.to(u.kpc).value
+        self.scale = scale.to(u.kpc).value
+        self.chunk_size = chunk_size
+
+        self._u_R = np.linspace(0, np.arcsinh(self.R_max / self.scale), n_R)
+        self._u_z = np.linspace(0, np.arcsinh(self.z_max / self.scale), n_z)
+
+        R, z = np.meshgrid(self.scale * np.sinh(self._u_R), self.scale * np.sinh(self._u_z), indexing="ij")
+        self._phi = self._exact_phi(np.array([R.ravel(), np.zeros(R.size), z.ravel()])).reshape(R.shape)
+
+        self._check_axisymmetric()
+        self.max_rel_error = self._measure_error()
+
+    def __repr__(self):
+        return (f"<EscapeVelocityGrid: R < {self.R_max:g} kpc, |z| < {self.z_max:g} kpc, "
+                f"{len(self._u_R)}x{len(self._u_z)}, scale={self.scale:g} kpc, "
+                f"max_rel_error={self.max_rel_error:.1e}>")
+
+    def _exact_phi(self, pos):
+        """Potential in (km/s)^2 at positions in kpc with shape (3, N)."""
+        return self.potential.energy(pos * u.kpc).to(u.km**2 / u.s**2).value
+
+    def _interp_phi(self, R, z):
+        """Bilinearly interpolate the potential at (R, |z|) positions that are inside the grid."""
+        n_z = len(self._u_z)
+        f_R = np.arcsinh(R / self.scale)
+        f_R *= 1 / self._u_R[1]
+        f_z = np.arcsinh(z / self.scale)
+        f_z *= 1 / self._u_z[1]
+        i = np.minimum(f_R.astype(np.int64), len(self._u_R) - 2)
+        j = np.minimum(f_z.astype(np.int64), n_z - 2)
+        w_R, w_z = f_R - i, f_z - j
+
+        # index the flattened grid directly, which is much faster than 2D fancy indexing
+        flat = i * n_z + j
+        phi = self._phi.ravel()
+        phi_lo = np.take(phi, flat)
+        phi_lo += w_z * (np.take(phi, flat + 1) - phi_lo)
+        flat += n_z
+        phi_hi = np.take(phi, flat)
+        phi_hi += w_z * (np.take(phi, flat + 1) - phi_hi)
+        phi_lo += w_R * (phi_hi - phi_lo)
+        return phi_lo
+
+    def _check_axisymmetric(self, rtol=1e-10):
+        """Make sure that rotating the grid points in azimuth doesn't change the potential."""
+        R = self.scale * np.sinh(self._u_R[::50])
+        z = self.scale * np.sinh(self._u_z[::50])
+        R, z = np.meshgrid(R, z, indexing="ij")
+        for phi in [np.pi / 4, 2.0]:
+            rotated = self._exact_phi(np.array([R.ravel() * np.cos(phi), R.ravel() * np.sin(phi), z.ravel()]))
+            if not np.allclose(rotated, self._phi[::50, ::50].ravel(), rtol=rtol):
+                raise ValueError("EscapeVelocityGrid requires an axisymmetric potential")
+
+    def _measure_error(self):
+        """Largest relative error in the escape velocity at the centres of the grid cells."""
+        R_mid = self.scale * np.sinh(0.5 * (self._u_R[1:] + self._u_R[:-1]))
+        z_mid = self.scale * np.sinh(0.5 * (self._u_z[1:] + self._u_z[:-1]))
+        R, z = np.meshgrid(R_mid, z_mid, indexing="ij")
+        R, z = R.ravel(), z.ravel()
+
+        exact = np.sqrt(-2 * self._exact_phi(np.array([R, np.zeros_like(R), z])))
+        interp = np.sqrt(-2 * self._interp_phi(R, z))
+        return np.max(np.abs(interp - exact) / exact)
+
+    def __call__(self, pos):
+        """Escape velocity (in km/s) at some galactocentric positions.
+
+        Parameters
+        ----------
+        pos : :class:`~numpy.ndarray` or :class:`~astropy.units.Quantity`, shape (3, N)
+            Positions (in kpc if not a Quantity)
+
+        Returns
+        -------
+        v_esc : :class:`~numpy.ndarray`, shape (N,)
+            Escape velocity in km/s, NaN at positions that aren't finite (e.g. from failed orbits)
+        """
+        if hasattr(pos, "unit"):
+            pos = pos.to(u.kpc).value
+        pos = np.asarray(pos, dtype=float)
+
+        v_esc = np.empty(pos.shape[1])
+        for start in range(0, pos.shape[1], self.chunk_size):
+            chunk = pos[:, start:start + self.chunk_size]
+            R = np.sqrt(chunk[0]**2 + chunk[1]**2)
+            z = np.abs(chunk[2])
+
+            # positions of failed orbits (NaN) have no escape velocity, as with the exact potential, but are
+            # moved onto the grid first so that they can't index outside of it
+            bad = ~(np.isfinite(R) & np.isfinite(z))
+            if bad.any():
+                R[bad] = 0.0
+                z[bad] = 0.0
+
+            # interpolate everything (clamped to the grid) and then overwrite the few outside it
+            outside = (R > self.R_max) | (z > self.z_max)
+            phi = self._interp_phi(np.minimum(R, self.R_max, out=R), np.minimum(z, self.z_max, out=z))
+            if outside.any():
+                phi[outside] = self._exact_phi(chunk[:, outside])
+            if bad.any():
+                phi[bad] = np.nan
+
+            phi *= -2
+            v_esc[start:start + self.chunk_size] = np.sqrt(phi, out=phi)
+        return v_esc
+
+    def escaped(self, pos, vel):
+        """Mask of objects moving faster than the escape velocity.
+
+        Parameters
+        ----------
+        pos : :class:`~numpy.ndarray` or :class:`~astropy.units.Quantity`, shape (N, 3)
+            Positions (in kpc if not a Quantity)
+        vel : :class:`~numpy.ndarray` or :class:`~astropy.units.Quantity`, shape (N, 3)
+            Velocities (in km/s if not a Quantity)
+
+        Returns
+        -------
+        escaped : :class:`~numpy.ndarray`, shape (N,)
+        """
+        if hasattr(vel, "unit"):
+            vel = vel.to(u.km / u.s).value
+        return np.linalg.norm(vel, axis=1) >= self(pos.T)
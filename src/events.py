@@ -0,0 +1,200 @@
+import numpy as np
+import pandas as pd
+
+import os
+
+
+# COSMIC evol_type codes of the events we select on, each is given one bit of the event flags
+EVENT_TYPES = {
+    "mass_transfer": [3],
+    "common_envelope": [7],
+    "merger": [6],
+    "disruption": [11],
+    "sn_1": [15],
+    "sn_2": [16],
+}
+EVENT_BITS = {event: 1 << i for i, event in enumerate(EVENT_TYPES)}
+
+
+class EventIndex():
+    """An index of the evolutionary events in a population's ``bpp`` table, built in one pass.
+
+    Every binary gets a bitmask of the events that it went through (see :data:`EVENT_TYPES`) and every event
+    keeps its row offsets in ``bpp``, so selecting a channel (e.g. "had mass transfer but no common
+    envelope") or finding the rows of each supernova is a vectorised lookup rather than another scan of
+    ``bpp``.
+
+    Parameters
+    ----------
+    bin_nums : :class:`~numpy.ndarray`, shape (n_binaries,)
+        Sorted unique binary numbers
+    flags : :class:`~numpy.ndarray`, shape (n_binaries,)
+        Bitmask of the events of each binary (see :data:`EVENT_BITS`)
+    event_rows : dict
+        Positional rows in ``bpp`` of each event type, in the order they appear in ``bpp``
+    row_bin_nums : :class:`~numpy.ndarray`, shape (len(bpp),)
+        Binary number of every row of ``bpp``
+    """
+    def __init__(self, bin_nums, flags, event_rows, row_bin_nums):
+        self.bin_nums = bin_nums
+        self.flags = flags
+        self.event_rows = event_rows
+        self.row_bin_nums = row_bin_nums
+
+    def __len__(self):
+        return len(self.bin_nums)
+
+    def __repr__(self):
+        counts = ", ".join(f"{event}={len(rows)}" for event, rows in self.event_rows.items())
+        return f"<EventIndex: {len(self)} binaries, {counts}>"
+
+    @classmethod
+    def from_bpp(cls, bpp):
+        """Index a ``bpp`` table (or a population, in which case its ``bpp`` is used).
+
+        Parameters
+        ----------
+        bpp : :class:`~pandas.DataFrame` or :class:`~cogsworth.pop.Population`
+            Table with (at least) ``bin_num`` and ``evol_type`` columns
+
+        Returns
+        -------
+        index : :class:`EventIndex`
+        """
+        bpp = getattr(bpp, "bpp", bpp)
+        row_bin_nums = bpp["bin_num"].values.astype(np.int64)
+        evol_type = bpp["evol_type"].values.astype(np.intp)
+
+        # look up the bit of every row from its evol_type
+        bit_lookup = np.zeros(max(evol_type.max(initial=0), max(max(v) for v in EVENT_TYPES.values())) + 1,
+                              dtype=np.int64)
+        event_rows = {}
+        for event, codes in EVENT_TYPES.items():
+            bit_lookup[codes] |= EVENT_BITS[event]
+            event_rows[event] = np.flatnonzero(np.isin(evol_type, codes))
+        row_flags = bit_lookup[evol_type]
+
+        # combine the flags of every row of each binary (bpp isn't necessarily sorted by bin_num)
+        bin_nums, inverse = np.unique(row_bin_nums, return_inverse=True)
+        flags = np.zeros(len(bin_nums), dtype=np.int64)
+        np.bitwise_or.at(flags, inverse, row_flags)
+
+        return cls(bin_nums, flags, event_rows, row_bin_nums)
+
+    def _positions(self, bin_nums):
+        bin_nums = np.asarray(bin_nums)
+        pos = np.searchsorted(self.bin_nums, bin_nums)
+        pos = np.minimum(pos, len(self.bin_nums) - 1)
+        if not np.all(self.bin_nums[pos] == bin_nums):
+            raise ValueError("Some bin_nums are not in the index")
+        return pos
+
+    def _bits(self, events):
+        events = [events] if isinstance(events, str) else events
+        bits = 0
+        for event in events:
+            if event not in EVENT_BITS:
+                raise ValueError(f"Unknown event '{event}', choose from {list(EVENT_BITS)}")
+            bits |= EVENT_BITS[event]
+        return bits
+
+    def mask(self, bin_nums=None, had=(), without=(), any_of=()):
+        """Mask of binaries that went through a channel.
+
+        Parameters
+        ----------
+        bin_nums : array-like, optional
+            Binary numbers to test (e.g. ``pop.final_bpp["bin_num"]``). Default is every binary in the index.
+        had : str or list of str, optional
+            Events that every selected binary went through
+        without : str or list of str, optional
+            Events that no selected binary went through
+        any_of : str or list of str, optional
+            Events of which every selected binary went through at least one
+
+        Returns
+        -------
+        mask : :class:`~numpy.ndarray`, shape (len(bin_nums),)
+        """
+        flags = self.flags if bin_nums is None else self.flags[self._positions(bin_nums)]
+        had, without, any_of = self._bits(had), self._bits(without), self._bits(any_of)
+        mask = ((flags & had) == had) & ((flags & without) == 0)
+        if any_of:
+            mask &= (flags & any_of) != 0
+        return mask
+
+    def select(self, **kwargs):
+        """Binary numbers of the binaries that went through a channel (see :meth:`mask`)."""
+        return self.bin_nums[self.mask(**kwargs)]
+
+    def rows(self, event, bin_nums=None):
+        """Positional rows in ``bpp`` of an event, optionally only for some binaries."""
+        rows = self.event_rows[event]
+        if bin_nums is not None:
+            rows = rows[np.isin(self.row_bin_nums[rows], bin_nums)]
+        return rows
+
+    def supernovae(self):
+        """Every supernova as a table of its binary, row in ``bpp`` and which star exploded.
+
+        Supernovae are sorted by binary and then by the order in which they appear in ``bpp`` (i.e. time).
+        """
+        rows = np.concatenate((self.event_rows["sn_1"], self.event_rows["sn_2"]))
+        star = np.repeat([1, 2], [len(self.event_rows["sn_1"]), len(self.event_rows["sn_2"])])
+        order = np.lexsort((rows, self.row_bin_nums[rows]))
+        return pd.DataFrame({"bin_num": self.row_bin_nums[rows][order], "row": rows[order],
+                             "star": star[order]})
+
+    def join_kicks(self, kick_info, bpp):
+        """Match each natal kick to its supernova in ``bpp`` and the type of the remnant it made.
+
+        Kicks in ``kick_info`` with ``star != 0`` are matched to the supernovae of the same binary in order,
+        and the remnant type is taken from the row after the supernova (as the kick only applies once the
+        supernova is over).
+
+        Parameters
+        ----------
+        kick_info : :class:`~pandas.DataFrame`
+            Kick information of the population (``pop.kick_info``)
+        bpp : :class:`~pandas.DataFrame`
+            The ``bpp`` table that was indexed
+
+        Returns
+        -------
+        kicks : :class:`~pandas.DataFrame`
+            The rows of ``kick_info`` with a supernova, with extra columns ``sn_row`` (row of the supernova in
+            ``bpp``) and ``kstar`` (type of the remnant)
+
+        Raises
+        ------
+        ValueError
+            If the number of kicks of any binary doesn't match its number of supernovae
+        """
+        kicks = kick_info[kick_info["star"].values != 0]
+        kick_bin_nums = kicks["bin_num"].values.astype(np.int64)
+        sne = self.supernovae()
+
+        # kicks are grouped by binary in kick_info, sort them like the supernovae (stable keeps their order)
+        order = np.argsort(kick_bin_nums, kind="stable")
+        if len(kicks) != len(sne) or not np.array_equal(kick_bin_nums[order], sne["bin_num"].values):
+            raise ValueError("kick_info and bpp disagree on the number of supernovae of some binaries")
+
+        sn_rows = np.empty(len(kicks), dtype=np.int64)
+        sn_rows[order] = sne["row"].values
+        after = np.minimum(sn_rows + 1, len(bpp) - 1)
+        kstar = np.where(kicks["star"].values == 1, bpp["kstar_1"].values[after], bpp["kstar_2"].values[after])
+
+        return kicks.assign(sn_row=sn_rows, kstar=kstar)
+
+    def save(self, file_name):
+        """Save the index to a ``.npz`` file."""
+        tmp_name = file_name + ".tmp.npz"
+        np.savez(tmp_name, bin_nums=self.bin_nums, flags=self.flags, row_bin_nums=self.row_bin_nums,
+                 **{f"rows_{event}": rows for event, rows in self.event_rows.items()})
+        os.replace(tmp_name, file_name)
+
+    @classmethod
+    def load(cls, file_name):
+        with np.load(file_name) as f:
+            return cls(f["bin_nums"], f["flags"], {event: f[f"rows_{event}"] for event in EVENT_TYPES},
+                       f["row_bin_nums"])
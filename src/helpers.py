@@ -1,93 +1,134 @@
 import numpy as np
-import astropy.units as u
+import pandas as pd
 
+from cube import PopulationCube
+from remnants import RemnantTable, CO_TYPES
+from spatial import SpatialIndex
 
-def get_kinematics(pops):
+
+def get_kinematics(pops, cache=None, escape_velocity=None, cache_key=None):
     kinematics = {}
 
+    # e.g. an `escape.EscapeVelocityGrid` to avoid evaluating the full potential for every CO (any other
+    # function needs a `cache_key` to be cached, see `cache.RemnantCache.get`)
+    kwargs = {} if escape_velocity is None else {"escape_velocity": escape_velocity}
+
     for pop in pops:
-        kinematics[pop.label] = {}
-        primary_pos = pop.final_pos[:len(pop)]
-        secondary_pos = pop.final_pos[:len(pop)].copy()
-        secondary_pos[pop.disrupted] = pop.final_pos[len(pop):]
-
-        ns_pos = np.concatenate((primary_pos[pop.final_bpp["kstar_1"] == 13],
-                                secondary_pos[pop.final_bpp["kstar_2"] == 13]))
-        bh_pos = np.concatenate((primary_pos[pop.final_bpp["kstar_1"] == 14],
-                                secondary_pos[pop.final_bpp["kstar_2"] == 14]))
-        co_pos = np.concatenate((ns_pos, bh_pos))
-
-        kinematics[pop.label]["pos"] = {
-            "NS": ns_pos,
-            "BH": bh_pos,
-            "CO": co_pos,
+        # every NS/BH in one table, the NS/BH/CO subsets below are views of it rather than copies
+        table = (RemnantTable.from_population(pop, **kwargs) if cache is None
+                 else cache.get(pop, cache_key=cache_key, **kwargs))
+
+        kinematics[pop.label] = {
+            "pos": {co_type: table[co_type].pos for co_type in CO_TYPES},
+            "vel": {co_type: table[co_type].vel for co_type in CO_TYPES},
+            "escaped": {co_type: table[co_type].escaped for co_type in CO_TYPES},
+            "table": table,
         }
 
-        primary_vel = pop.final_vel[:len(pop)]
-        secondary_vel = pop.final_vel[:len(pop)].copy()
-        secondary_vel[pop.disrupted] = pop.final_vel[len(pop):]
+    return kinematics
 
-        ns_vel = np.concatenate((primary_vel[pop.final_bpp["kstar_1"] == 13],
-                                secondary_vel[pop.final_bpp["kstar_2"] == 13]))
-        bh_vel = np.concatenate((primary_vel[pop.final_bpp["kstar_1"] == 14],
-                                secondary_vel[pop.final_bpp["kstar_2"] == 14]))
-        co_vel = np.concatenate((ns_vel, bh_vel))
 
-        kinematics[pop.label]["vel"] = {
-            "NS": ns_vel,
-            "BH": bh_vel,
-            "CO": co_vel,
-        }
+def get_cubes(pops, kinematics=None, **kwargs):
+    """Bin every population into a :class:`~cube.PopulationCube`, reusing the tables in ``kinematics``."""
+    cubes = {}
+    for pop in pops:
+        table = None if kinematics is None else kinematics[pop.label]["table"]
+        cubes[pop.label] = PopulationCube.from_population(pop, table=table, **kwargs)
+    return cubes
 
-        kinematics[pop.label]["escaped"] = {}
-        for co_type, pos, vel in zip(
-            ["NS", "BH", "CO"],
-            [ns_pos, bh_pos, co_pos],
-            [ns_vel, bh_vel, co_vel],
-        ):
-            V = np.linalg.norm(vel.to(u.km/u.s).value, axis=1)
-            escaped = V >= np.sqrt(-2 * pop.galactic_potential(pos.T)).to(u.km / u.s).value
 
-            kinematics[pop.label]["escaped"][co_type] = escaped
+def get_spatial_indices(pops, kinematics=None, co_type="CO", **kwargs):
+    """Build a :class:`~spatial.SpatialIndex` of each population, reusing the tables in ``kinematics``."""
+    indices = {}
+    for pop in pops:
+        table = None if kinematics is None else kinematics[pop.label]["table"]
+        indices[pop.label] = SpatialIndex.from_population(pop, co_type=co_type, table=table, **kwargs)
+    return indices
+
+
+CO_BINARY_LABELS = ["BH-BH", "BH-NS", "BH-WD", "BH-Star", "NS-NS", "NS-WD", "NS-Star"]
+CO_BINARY_KSTAR_GROUPS = [
+    ([14], [14]),
+    ([14], [13]),
+    ([14], [10, 11, 12]),
+    ([14], list(range(0, 10))),
+    ([13], [13]),
+    ([13], [10, 11, 12]),
+    ([13], list(range(0, 10))),
+]
+
+# category code of every (kstar_1, kstar_2) pair, anything that isn't a bound CO binary gets the last code
+NOT_CO_BINARY = len(CO_BINARY_LABELS)
+_PAIR_CODES = np.full((16, 16), NOT_CO_BINARY, dtype=np.intp)
+for code, (group_a, group_b) in enumerate(CO_BINARY_KSTAR_GROUPS):
+    _PAIR_CODES[np.ix_(group_a, group_b)] = code
+    _PAIR_CODES[np.ix_(group_b, group_a)] = code
+
+
+def classify_binaries(final_bpp):
+    """Category code of every system (an index into :data:`CO_BINARY_LABELS`, or :data:`NOT_CO_BINARY`)."""
+    kstar_1 = final_bpp["kstar_1"].values.astype(np.intp)
+    kstar_2 = final_bpp["kstar_2"].values.astype(np.intp)
+    codes = _PAIR_CODES[kstar_1, kstar_2]
+    codes[~(final_bpp["sep"].values > 0)] = NOT_CO_BINARY
+    return codes
+
+
+def classify_underworld_binaries(pops, return_rows=False):
+    """Count the bound compact object binaries of each type in many populations with one pass over each.
+
+    Parameters
+    ----------
+    pops : list of :class:`~cogsworth.pop.Population`
+        Populations to classify (the whole population, not just its underworld)
+    return_rows : bool, optional
+        Whether to also return the positional rows in ``final_bpp`` of each type. Default is False.
+
+    Returns
+    -------
+    counts : :class:`~pandas.DataFrame`
+        Number of binaries of each type (rows) in each population (columns)
+    scaled_counts : :class:`~pandas.DataFrame`
+        As ``counts`` but scaled up to the Milky Way (by ``6e10 / pop.mass_binaries``)
+    rows : dict
+        Positional rows in ``final_bpp`` of each type, keyed by population label and then type. Only
+        returned if ``return_rows=True``.
+    """
+    counts, scale_ups, rows = {}, {}, {}
+    for pop in pops:
+        codes = classify_binaries(pop.final_bpp)
+        n_per_code = np.bincount(codes, minlength=NOT_CO_BINARY + 1)
+        counts[pop.label] = n_per_code[:NOT_CO_BINARY]
+        scale_ups[pop.label] = 6e10 / pop.mass_binaries
 
-    return kinematics
+        if return_rows:
+            # a stable sort groups the rows by code while keeping them in their original order
+            order = np.argsort(codes, kind="stable")
+            groups = np.split(order, np.cumsum(n_per_code)[:-1])
+            rows[pop.label] = dict(zip(CO_BINARY_LABELS, groups))
+
+    counts = pd.DataFrame(counts, index=CO_BINARY_LABELS)
+    scaled_counts = counts * pd.Series(scale_ups)
+    if return_rows:
+        return counts, scaled_counts, rows
+    return counts, scaled_counts
 
 
 def get_underworld_binaries(pops, verbose=False):
-    co_binary_labels = ["BH-BH", "BH-NS", "BH-WD", "BH-Star", "NS-NS", "NS-WD", "NS-Star"]
-    co_binary_kstar_groups = [
-        ([14], [14]),
-        ([14], [13]),
-        ([14], [10, 11, 12]),
-        ([14], list(range(0, 10))),
-        ([13], [13]),
-        ([13], [10, 11, 12]),
-        ([13], list(range(0, 10))),
-    ]
+    counts, scaled_counts, rows = classify_underworld_binaries(pops, return_rows=True)
 
     underworld_binaries = {}
     for pop in pops:
-        underworld_binaries[pop.label] = {}
-        co_binaries = pop.final_bpp[
-            ((pop.final_bpp["kstar_1"].isin([13, 14])) | (pop.final_bpp["kstar_2"].isin([13, 14]))) &
-            (pop.final_bpp["sep"] > 0)
-        ]
-
         underworld_binaries[pop.label] = {
-            label: co_binaries[
-                ((co_binaries["kstar_1"].isin(kstar_group[0]))
-                 & (co_binaries["kstar_2"].isin(kstar_group[1]))) |
-                ((co_binaries["kstar_1"].isin(kstar_group[1]))
-                 & (co_binaries["kstar_2"].isin(kstar_group[0])))
-            ] for (label, kstar_group) in zip(co_binary_labels, co_binary_kstar_groups)
+            label: pop.final_bpp.iloc[rows[pop.label][label]] for label in CO_BINARY_LABELS
         }
 
-        scale_up = 6e10 / pop.mass_binaries
-
         if verbose:
+            scale_up = 6e10 / pop.mass_binaries
             print(f"{pop.label} Underworld Binaries (scale up by {scale_up:.0f}x):")
-            for label, table in underworld_binaries[pop.label].items():
-                print(f"  {label}:{' ' * (9 - len(label))} {len(table):.0f}  \t{len(table) * scale_up:.1e} (scaled)")
+            for label in CO_BINARY_LABELS:
+                n, n_scaled = counts.loc[label, pop.label], scaled_counts.loc[label, pop.label]
+                print(f"  {label}:{' ' * (9 - len(label))} {n:.0f}  \t{n_scaled:.1e} (scaled)")
                 if label == "BH-Star":
                     print()
             print()
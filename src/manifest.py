@@ -0,0 +1,67 @@
+import json
+import os
+import time
+
+
+class Manifest():
+    """A JSON record of which shards of a run have been completed, so that a run can be resumed.
+
+    The manifest is rewritten atomically (write to a temporary file then rename) after every update, so a
+    crash part way through never leaves a corrupt manifest behind.
+
+    Parameters
+    ----------
+    path : str
+        Path to the manifest file. It is loaded if it already exists.
+    config : dict, optional
+        Settings of the run. If the manifest already exists these must match the saved settings, since
+        resuming with different settings would silently mix incompatible shards.
+
+    Raises
+    ------
+    ValueError
+        If ``config`` doesn't match the config of an existing manifest.
+    """
+    def __init__(self, path, config=None):
+        self.path = path
+        self.config = config
+        self.shards = {}
+
+        if os.path.exists(path):
+            with open(path) as f:
+                saved = json.load(f)
+            if config is not None and saved["config"] != json.loads(json.dumps(config)):
+                raise ValueError(f"Manifest at {path} was created with different settings, either use the "
+                                 f"same settings to resume or start a new run.\n  Saved: {saved['config']}"
+                                 f"\n  Now:   {config}")
+            self.config = saved["config"]
+            self.shards = {int(shard): info for shard, info in saved["shards"].items()}
+        else:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            self.save()
+
+    def __repr__(self):
+        return f"<Manifest: {self.path}, {len(self.completed)} completed shard(s)>"
+
+    @property
+    def completed(self):
+        """Sorted list of the completed shards."""
+        return sorted(shard for shard, info in self.shards.items() if info.get("done", False))
+
+    def is_done(self, shard):
+        return self.shards.get(shard, {}).get("done", False)
+
+    def mark_done(self, shard, outputs, **info):
+        """Record that a shard has finished, along with its output files and any other information."""
+        self.shards[shard] = {"done": True, "outputs": outputs, "finished": time.time(), **info}
+        self.save()
+
+    def outputs(self, kind):
+        """Output files of a given kind for every completed shard, in shard order."""
+        return [self.shards[shard]["outputs"][kind] for shard in self.completed]
+
+    def save(self):
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"config": self.config, "shards": self.shards}, f, indent=2)
+        os.replace(tmp_path, self.path)
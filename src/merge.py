@@ -0,0 +1,209 @@
+import h5py as h5
+import numpy as np
+import pandas as pd
+import yaml
+
+import os
+
+# tables that cogsworth saves with pandas (the initial binaries are handled separately, see below)
+TABLES = ["bpp", "bcm", "kick_info"]
+
+# entries of cogsworth's "numeric_params" that are totals over the population, the rest are settings
+SUMMED_PARAMS = {"n_binaries": 0, "n_binaries_match": 1, "mass_singles": 6, "mass_binaries": 7,
+                 "n_singles_req": 8, "n_bin_req": 9}
+
+
+def _h5_name(file_name):
+    return file_name if file_name.endswith(".h5") else file_name + ".h5"
+
+
+def merge_populations(file_names, file_name, label=None):
+    """Merge saved populations (e.g. the shards of a run) into one saved population, a shard at a time.
+
+    Unlike :func:`cogsworth.pop.concat`, the populations are never all in memory at once and their
+    ``bin_num`` are kept as they are, so they must already be unique across the populations (e.g. assigned
+    per shard when sampling). Each table is appended to the merged file from one population at a time and
+    orbits are copied into preallocated datasets, so the peak memory is that of the largest table of a
+    single population. The settings of the first population are kept and its totals (number of binaries,
+    sampled mass, etc.) are summed over every population.
+
+    The merged population is written to a temporary file that replaces ``file_name`` once it is complete,
+    and can be loaded with :func:`cogsworth.pop.load` as usual.
+
+    Parameters
+    ----------
+    file_names : list of str
+        Paths of the saved populations, in order (with or without the ".h5" extension)
+    file_name : str
+        Path of the merged population (with or without the ".h5" extension)
+    label : str, optional
+        Name to print with the progress. Default is the file name.
+
+    Returns
+    -------
+    n_systems : int
+        Number of systems in the merged population
+
+    Raises
+    ------
+    ValueError
+        If there are no populations, they don't all have the same parts or their ``bin_num`` overlap
+    """
+    file_names = [_h5_name(f) for f in file_names]
+    file_name = _h5_name(file_name)
+    label = os.path.basename(file_name) if label is None else label
+    if len(file_names) == 0:
+        raise ValueError("No populations to merge")
+
+    # (whether there is a table of initial binary settings depends on the binaries, see below)
+    with h5.File(file_names[0], "r") as f:
+        keys = set(f.keys()) - {"initial_binaries_settings"}
+    for other in file_names[1:]:
+        with h5.File(other, "r") as f:
+            other_keys = set(f.keys()) - {"initial_binaries_settings"}
+        if other_keys != keys:
+            raise ValueError(f"{other} has different parts ({sorted(other_keys)}) to {file_names[0]} "
+                             f"({sorted(keys)})")
+    if any(key.startswith("initial_galaxy_") for key in keys):
+        raise ValueError("Populations with a composite star formation history can't be merged")
+
+    tmp_name = file_name + ".tmp"
+    if os.path.exists(tmp_name):
+        os.remove(tmp_name)
+
+    with pd.HDFStore(tmp_name, mode="w") as store:
+        n_systems = _append_initial_binaries(store, file_names) if "initial_binaries" in keys else None
+        for key in [key for key in TABLES + ["initial_galaxy"] if key in keys]:
+            for part in file_names:
+                store.append(key, pd.read_hdf(part, key=key), index=False)
+
+    _copy_settings(tmp_name, file_names, keys)
+    if "orbits" in keys:
+        _merge_orbits(tmp_name, file_names)
+
+    os.replace(tmp_name, file_name)
+    print(f"Merged {len(file_names)} populations into {label}"
+          + ("" if n_systems is None else f" ({n_systems} systems)"))
+    return n_systems
+
+
+def _append_initial_binaries(store, file_names):
+    """Append the initial binaries of every population, keeping the columns that COSMIC compresses (those
+    with a single value) as a one-row settings table if they have the same value in every population."""
+    # COSMIC's save_initC moves columns with one value to a separate settings table
+    settings = None
+    for part in file_names:
+        with h5.File(part, "r") as f:
+            has_settings = "initial_binaries_settings" in f
+        part_settings = pd.read_hdf(part, key="initial_binaries_settings") if has_settings else pd.DataFrame()
+        if settings is None:
+            settings = part_settings
+        else:
+            shared = [col for col in settings.columns if col in part_settings.columns
+                      and settings[col].values[0] == part_settings[col].values[0]]
+            settings = settings[shared]
+
+    n_systems = 0
+    bin_num_max = -1
+    columns = None
+    for part in file_names:
+        initial_binaries = pd.read_hdf(part, key="initial_binaries")
+        with h5.File(part, "r") as f:
+            has_settings = "initial_binaries_settings" in f
+        if has_settings:
+            # settings that differ between populations become ordinary columns
+            part_settings = pd.read_hdf(part, key="initial_binaries_settings")
+            for col in part_settings.columns.difference(settings.columns):
+                initial_binaries[col] = part_settings[col].values[0]
+
+        # every population must append the same columns with the same types
+        if columns is None:
+            columns = initial_binaries.dtypes
+        initial_binaries = initial_binaries[columns.index].astype(columns)
+
+        if len(initial_binaries) > 0:
+            if initial_binaries.index.min() <= bin_num_max:
+                raise ValueError(f"The bin_nums of {part} overlap with those of an earlier population, they "
+                                 "must be unique (and increasing) across the populations")
+            bin_num_max = initial_binaries.index.max()
+        store.append("initial_binaries", initial_binaries, index=False)
+        n_systems += len(initial_binaries)
+
+    if len(settings.columns) > 0:
+        store.put("initial_binaries_settings", settings)
+    return n_systems
+
+
+def _copy_settings(tmp_name, file_names, keys):
+    """Copy the settings of the first population and the sum of the totals of every population."""
+    numeric_params = None
+    galaxy_size = 0
+    for part in file_names:
+        with h5.File(part, "r") as f:
+            params = f["numeric_params"][...]
+            if numeric_params is None:
+                numeric_params = params.copy()
+            else:
+                for i in SUMMED_PARAMS.values():
+                    numeric_params[i] += params[i]
+            if "initial_galaxy" in keys:
+                galaxy_params = yaml.load(f["initial_galaxy"].attrs["params"], Loader=yaml.Loader)
+                galaxy_size += galaxy_params.get("size", 0)
+
+    with h5.File(file_names[0], "r") as first, h5.File(tmp_name, "a") as f:
+        # cogsworth's attributes (pytables has already set its own)
+        for key, value in first.attrs.items():
+            if key not in f.attrs:
+                f.attrs[key] = value
+        for key in ["BSE_settings", "sampling_params", "integrator_settings"]:
+            if key in first:
+                first.copy(key, f)
+
+        first.copy("numeric_params", f)
+        f["numeric_params"][...] = numeric_params
+
+        if "initial_galaxy" in keys:
+            galaxy = first["initial_galaxy"]
+            if "potential" in galaxy.attrs:
+                f["initial_galaxy"].attrs["potential"] = galaxy.attrs["potential"]
+            params = yaml.load(galaxy.attrs["params"], Loader=yaml.Loader)
+            if "size" in params:
+                params["size"] = galaxy_size
+            f["initial_galaxy"].attrs["params"] = yaml.dump(params, default_flow_style=None)
+
+
+def _merge_orbits(tmp_name, file_names):
+    """Copy the orbits of every population into one set of datasets, in cogsworth's order (the orbits of
+    the systems of every population first, then those of the secondaries of disrupted binaries)."""
+    # the first len(pop) orbits of each population are its systems and the rest are disrupted secondaries
+    parts = []
+    for part in file_names:
+        n_systems = pd.read_hdf(part, key="bpp")["bin_num"].nunique()
+        with h5.File(part, "r") as f:
+            offsets = f["orbits"]["offsets"][...]
+        parts.append((part, offsets, n_systems))
+
+    # (population, offsets, first orbit, last orbit + 1) of each section in the merged order
+    sections = ([(part, offsets, 0, n) for part, offsets, n in parts]
+                + [(part, offsets, n, len(offsets) - 1) for part, offsets, n in parts])
+    total = sum(offsets[stop] - offsets[start] for _, offsets, start, stop in sections)
+
+    with h5.File(tmp_name, "a") as f:
+        orbits = f.create_group("orbits")
+        pos = orbits.create_dataset("pos", shape=(3, total), dtype=np.float64)
+        vel = orbits.create_dataset("vel", shape=(3, total), dtype=np.float64)
+        t = orbits.create_dataset("t", shape=(total,), dtype=np.float64)
+        new_offsets = [np.zeros(1, dtype=np.int64)]
+
+        written = 0
+        for part, offsets, start, stop in sections:
+            lo, hi = offsets[start], offsets[stop]
+            with h5.File(part, "r") as source:
+                pos[:, written:written + hi - lo] = source["orbits"]["pos"][:, lo:hi]
+                vel[:, written:written + hi - lo] = source["orbits"]["vel"][:, lo:hi]
+                t[written:written + hi - lo] = source["orbits"]["t"][lo:hi]
+
+            # where each orbit of the section ends, shifted to where it is now
+            new_offsets.append(offsets[start + 1:stop + 1] - lo + written)
+            written += hi - lo
+        orbits["offsets"] = np.concatenate(new_offsets)
@@ -0,0 +1,263 @@
+import numpy as np
+import astropy.coordinates as coords
+import astropy.units as u
+
+import os
+
+from density import _chunk_values
+
+try:
+    import healpy
+except ImportError:
+    healpy = None
+
+
+# km/s per (kpc mas/yr)
+K = (1 * u.kpc * u.mas / u.yr).to(u.km / u.s, equivalencies=u.dimensionless_angles()).value
+
+OBSERVABLES = ["distance", "l", "b", "pm_l_cosb", "pm_b", "radial_velocity"]
+
+
+class Observer():
+    """Project galactocentric positions and velocities onto the sky, without building astropy frames.
+
+    The transformation from a :class:`~astropy.coordinates.Galactocentric` frame to heliocentric
+    :class:`~astropy.coordinates.Galactic` cartesian coordinates is affine, so it is measured once (by
+    transforming the origin and the unit vectors with astropy) and then applied to any number of objects
+    as a matrix product, a chunk at a time. The results agree with astropy to rounding error.
+
+    Parameters
+    ----------
+    galcen_frame : :class:`~astropy.coordinates.Galactocentric`, optional
+        Frame that the positions and velocities are in, which sets the position and velocity of the Sun.
+        Default is astropy's default :class:`~astropy.coordinates.Galactocentric` frame.
+    """
+    def __init__(self, galcen_frame=None):
+        self.galcen_frame = coords.Galactocentric() if galcen_frame is None else galcen_frame
+
+        # the origin and unit vectors in position and velocity
+        basis = np.concatenate((np.zeros((1, 3)), np.eye(3)))
+        pos = np.concatenate((basis, np.zeros((3, 3))))
+        vel = np.concatenate((np.zeros((4, 3)), np.eye(3)))
+        c = coords.SkyCoord(coords.CartesianRepresentation(pos.T * u.kpc,
+                                                           differentials=coords.CartesianDifferential(
+                                                               vel.T * u.km / u.s)),
+                            frame=self.galcen_frame).transform_to(coords.Galactic())
+        helio_pos = c.cartesian.xyz.to(u.kpc).value.T
+        helio_vel = c.velocity.d_xyz.to(u.km / u.s).value.T
+
+        # x_helio = rotation @ x_galcen + pos_offset (and the same for velocities)
+        self.pos_offset = helio_pos[0]
+        self.vel_offset = helio_vel[0]
+        self.rotation = (helio_pos[1:4] - self.pos_offset).T
+        self.vel_rotation = (helio_vel[4:7] - self.vel_offset).T
+
+    def __repr__(self):
+        return (f"<Observer: Sun at {np.round(-self.rotation.T @ self.pos_offset, 4)} kpc, "
+                f"moving at {np.round(-self.vel_rotation.T @ self.vel_offset, 2)} km/s>")
+
+    def heliocentric(self, pos, vel):
+        """Heliocentric cartesian positions (kpc) and velocities (km/s) in Galactic orientation, (N, 3)."""
+        return pos @ self.rotation.T + self.pos_offset, vel @ self.vel_rotation.T + self.vel_offset
+
+    def project(self, pos, vel, chunk_size=1_000_000):
+        """Heliocentric distance, Galactic coordinates, proper motions and radial velocity of objects.
+
+        Parameters
+        ----------
+        pos : array-like or :class:`~astropy.units.Quantity`, shape (N, 3)
+            Galactocentric positions (in kpc if not a Quantity), which may be memory-mapped
+        vel : array-like or :class:`~astropy.units.Quantity`, shape (N, 3)
+            Galactocentric velocities (in km/s if not a Quantity), which may be memory-mapped
+        chunk_size : int, optional
+            Number of objects to project at once, which sets the peak memory usage. Default is 1,000,000.
+
+        Returns
+        -------
+        observables : dict
+            Arrays of shape (N,) for each of :data:`OBSERVABLES`: ``distance`` (kpc), ``l`` and ``b``
+            (deg), ``pm_l_cosb`` and ``pm_b`` (mas/yr) and ``radial_velocity`` (km/s)
+        """
+        n = len(pos)
+        observables = {name: np.empty(n) for name in OBSERVABLES}
+        for start in range(0, n, chunk_size):
+            chunk = slice(start, start + chunk_size)
+            for name, values in self._project_chunk(_chunk_values(pos, start, start + chunk_size),
+                                                    _chunk_values(vel, start, start + chunk_size,
+                                                                  unit=u.km / u.s)).items():
+                observables[name][chunk] = values
+        return observables
+
+    def _project_chunk(self, pos, vel):
+        (x, y, z), (v_x, v_y, v_z) = (arr.T for arr in self.heliocentric(pos, vel))
+        R = np.hypot(x, y)
+        d = np.hypot(R, z)
+        cos_l, sin_l = x / R, y / R
+        cos_b, sin_b = R / d, z / d
+
+        # velocities along the unit vectors of l and b, and towards the observer
+        v_l = -sin_l * v_x + cos_l * v_y
+        v_b = -sin_b * (cos_l * v_x + sin_l * v_y) + cos_b * v_z
+        return {
+            "distance": d,
+            "l": np.rad2deg(np.arctan2(y, x)) % 360,
+            "b": np.rad2deg(np.arcsin(sin_b)),
+            "pm_l_cosb": v_l / (K * d),
+            "pm_b": v_b / (K * d),
+            "radial_velocity": (x * v_x + y * v_y + z * v_z) / d,
+        }
+
+
+def ang2pix(nside, l, b):
+    """HEALPix pixel (RING ordering) of each Galactic longitude and latitude in degrees.
+
+    Uses :func:`healpy.ang2pix` if healpy is installed and otherwise the same algorithm in NumPy (from
+    Górski et al. 2005), so sky maps don't need healpy to be built. Non-finite angles have no pixel and
+    raise a ValueError (mask them first, as :meth:`SkyMap.add` does).
+    """
+    l, b = np.asarray(l, dtype=float), np.asarray(b, dtype=float)
+    if healpy is not None:
+        return healpy.ang2pix(nside, l, b, lonlat=True)
+
+    # NaNs would otherwise be cast to a valid pixel
+    if not (np.isfinite(l).all() and np.isfinite(b).all()):
+        raise ValueError("`l` and `b` must be finite")
+
+    # computed as healpy does, so that points on pixel boundaries land in the same pixel either way
+    z = np.cos(np.deg2rad(90 - b))
+    za = np.abs(z)
+    tt = (np.deg2rad(l) / (np.pi / 2)) % 4
+    pix = np.empty(z.shape, dtype=np.int64)
+
+    # equatorial region
+    eq = za <= 2 / 3
+    temp1 = nside * (0.5 + tt[eq])
+    temp2 = nside * z[eq] * 0.75
+    jp = (temp1 - temp2).astype(np.int64)
+    jm = (temp1 + temp2).astype(np.int64)
+    ir = nside + 1 + jp - jm
+    kshift = 1 - (ir & 1)
+    ip = ((jp + jm - nside + kshift + 1) // 2) % (4 * nside)
+    pix[eq] = 2 * nside * (nside - 1) + (ir - 1) * 4 * nside + ip
+
+    # polar caps
+    cap = ~eq
+    tp = tt[cap] % 1
+    tmp = nside * np.sqrt(3 * (1 - za[cap]))
+    jp = (tp * tmp).astype(np.int64)
+    jm = ((1 - tp) * tmp).astype(np.int64)
+    ir = jp + jm + 1
+    ip = (tt[cap] * ir).astype(np.int64) % (4 * ir)
+    pix[cap] = np.where(z[cap] > 0, 2 * ir * (ir - 1) + ip, 12 * nside**2 - 2 * ir * (ir + 1) + ip)
+    return pix
+
+
+class SkyMap():
+    """A HEALPix map (RING ordering) of the number of objects on the sky, accumulated in chunks.
+
+    Parameters
+    ----------
+    nside : int
+        HEALPix resolution, a power of 2 (the map has ``12 * nside**2`` equal-area pixels)
+    counts : :class:`~numpy.ndarray`, shape (12 * nside**2,), optional
+        Existing counts. Default is an empty map.
+    n_dropped : int, optional
+        Number of objects already left out of the map for having no position on the sky. Default is 0.
+    """
+    def __init__(self, nside, counts=None, n_dropped=0):
+        if nside < 1 or nside & (nside - 1) != 0:
+            raise ValueError(f"`nside` must be a power of 2, not {nside}")
+        self.nside = int(nside)
+        self.counts = np.zeros(self.n_pix) if counts is None else counts
+        self.n_dropped = int(n_dropped)
+
+    def __repr__(self):
+        return (f"<SkyMap: nside={self.nside}, {self.n_pix} pixels, {self.counts.sum():.0f} objects, "
+                f"{self.n_dropped} dropped>")
+
+    @property
+    def n_pix(self):
+        return 12 * self.nside**2
+
+    @property
+    def pixel_area(self):
+        """Area of each pixel in square degrees."""
+        return 4 * np.pi * np.rad2deg(1)**2 / self.n_pix
+
+    def add(self, l, b, weights=None, chunk_size=10_000_000):
+        """Add objects to the map.
+
+        Objects with a non-finite longitude or latitude (e.g. an orbit that failed to integrate) are left out
+        and counted in :attr:`n_dropped`.
+
+        Parameters
+        ----------
+        l, b : array-like, shape (N,)
+            Galactic longitude and latitude in degrees (e.g. from :meth:`Observer.project`)
+        weights : array-like, shape (N,), optional
+            Weight of each object (e.g. a selection function or a scale-up factor). Default is 1.
+        chunk_size : int, optional
+            Number of objects to bin at once. Default is 10,000,000.
+
+        Returns
+        -------
+        self : :class:`SkyMap`
+        """
+        for start in range(0, len(l), chunk_size):
+            chunk_l = np.asarray(l[start:start + chunk_size], dtype=float)
+            chunk_b = np.asarray(b[start:start + chunk_size], dtype=float)
+            finite = np.isfinite(chunk_l) & np.isfinite(chunk_b)
+            self.n_dropped += int((~finite).sum())
+
+            pix = ang2pix(self.nside, chunk_l[finite], chunk_b[finite])
+            chunk_weights = None if weights is None else np.asarray(weights[start:start + chunk_size])[finite]
+            self.counts += np.bincount(pix, weights=chunk_weights, minlength=self.n_pix)
+        return self
+
+    def density(self, scale_up=1.0):
+        """Number of objects per square degree in each pixel, optionally scaled up (e.g. to the Milky Way)."""
+        return self.counts * scale_up / self.pixel_area
+
+    def save(self, file_name):
+        """Save the map to a ``.npz`` file."""
+        tmp_name = file_name + ".tmp.npz"
+        np.savez(tmp_name, counts=self.counts, nside=self.nside, n_dropped=self.n_dropped)
+        os.replace(tmp_name, file_name)
+
+    @classmethod
+    def load(cls, file_name):
+        with np.load(file_name) as f:
+            return cls(int(f["nside"]), counts=f["counts"],
+                       n_dropped=int(f["n_dropped"]) if "n_dropped" in f else 0)
+
+
+def project_kinematics(kinematics, observer=None, co_type="CO", nside=None, chunk_size=1_000_000):
+    """Project the compact objects of every population from :func:`~helpers.get_kinematics` onto the sky.
+
+    Parameters
+    ----------
+    kinematics : dict
+        Output of :func:`~helpers.get_kinematics`
+    observer : :class:`Observer`, optional
+        Observer to project with. Default is an :class:`Observer` in astropy's default frame.
+    co_type : str, optional
+        Which compact objects to project ("NS", "BH" or "CO"). Default is "CO".
+    nside : int, optional
+        If given, also build a :class:`SkyMap` of each population at this resolution. Default is None.
+    chunk_size : int, optional
+        Number of objects to project at once. Default is 1,000,000.
+
+    Returns
+    -------
+    observables : dict
+        Output of :meth:`Observer.project` for each population label, along with its ``"sky_map"`` if
+        ``nside`` is given
+    """
+    observer = Observer() if observer is None else observer
+    observables = {}
+    for label, kin in kinematics.items():
+        obs = observer.project(kin["pos"][co_type], kin["vel"][co_type], chunk_size=chunk_size)
+        if nside is not None:
+            obs["sky_map"] = SkyMap(nside).add(obs["l"], obs["b"])
+        observables[label] = obs
+    return observables
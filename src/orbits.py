@@ -0,0 +1,544 @@
+import numpy as np
+import astropy.units as u
+import gala.dynamics as gd
+import gala.integrate as gi
+from multiprocessing import Pool
+from tqdm import tqdm
+
+import os
+import time
+
+
+# state shared with pool workers (set once per worker by `_init_worker` rather than pickled per task)
+_GLOBAL = {}
+
+
+# 1 km/s in kpc/Myr
+KMS_TO_KPCMYR = (1 * u.km / u.s).to(u.kpc / u.Myr).value
+
+
+def _init_worker(potential, Integrator, max_retries, timestep_divisor, escape_settings=None,
+                 snapshot_times=None):
+    _GLOBAL["potential"] = potential
+    _GLOBAL["Integrator"] = Integrator
+    _GLOBAL["max_retries"] = max_retries
+    _GLOBAL["timestep_divisor"] = timestep_divisor
+    _GLOBAL["escape"] = escape_settings
+    _GLOBAL["snapshot_times"] = snapshot_times
+
+
+def plan_chunks(t1, t2, dt, chunk_size=10_000):
+    """Group orbits into chunks that share the same (quantised) start and end times.
+
+    Start times are snapped onto the grid ``t2 - k * dt`` so that every orbit in a chunk takes the same
+    integer number of steps and ends exactly at ``t2``. This shifts each start time by at most ``dt / 2``.
+
+    Parameters
+    ----------
+    t1 : array-like
+        Start time of each orbit in Myr
+    t2 : float or array-like
+        End time of each orbit in Myr
+    dt : float
+        Timestep in Myr
+    chunk_size : int, optional
+        Maximum number of orbits per chunk. Default is 10,000.
+
+    Returns
+    -------
+    chunks : list of tuple
+        Each chunk is ``(indices, n_steps, t2)`` where ``indices`` index into the input arrays. Chunks are
+        sorted from most to least expensive so that pools balance their load.
+    """
+    t1 = np.atleast_1d(np.asarray(t1, dtype=float))
+    t2 = np.broadcast_to(np.asarray(t2, dtype=float), t1.shape)
+
+    n_steps = np.maximum(np.round((t2 - t1) / dt).astype(np.int64), 1)
+
+    # sort by (t2, n_steps) and split wherever either changes
+    order = np.lexsort((n_steps, t2))
+    keys_changed = (np.diff(n_steps[order]) != 0) | (np.diff(t2[order]) != 0)
+    group_starts = np.concatenate(([0], np.flatnonzero(keys_changed) + 1, [len(order)]))
+
+    chunks = []
+    for start, end in zip(group_starts[:-1], group_starts[1:]):
+        for chunk_start in range(start, end, chunk_size):
+            inds = order[chunk_start:min(chunk_start + chunk_size, end)]
+            chunks.append((inds, int(n_steps[inds[0]]), float(t2[inds[0]])))
+
+    chunks.sort(key=lambda chunk: len(chunk[0]) * chunk[1], reverse=True)
+    return chunks
+
+
+def _integrate_w0(w0, n_steps, t2, dt):
+    """Integrate an array of initial conditions, retrying with smaller timesteps on failure.
+
+    ``w0`` has shape (6, N) in kpc and km/s, times are in Myr. Returns the final (N, 6) phase space
+    coordinates in the same units or None if every attempt failed.
+    """
+    pot = _GLOBAL["potential"]
+    psp = gd.PhaseSpacePosition(pos=w0[:3] * u.kpc, vel=w0[3:] * u.km / u.s)
+
+    for _ in range(_GLOBAL["max_retries"]):
+        try:
+            t = np.linspace(t2 - n_steps * dt, t2, n_steps + 1) * u.Myr
+            orbit = pot.integrate_orbit(psp, t=t, Integrator=_GLOBAL["Integrator"], save_all=False)
+        except Exception:
+            # count recovered (and unrecovered) failures so they can be reported
+            _GLOBAL["n_retries"] = _GLOBAL.get("n_retries", 0) + 1
+            n_steps *= _GLOBAL["timestep_divisor"]
+            dt /= _GLOBAL["timestep_divisor"]
+            continue
+
+        pos = orbit.pos.xyz.to(u.kpc).value.reshape(3, -1)
+        vel = orbit.vel.d_xyz.to(u.km / u.s).value.reshape(3, -1)
+        return np.concatenate((pos, vel)).T
+    return None
+
+
+def _integrate_robust(w0, n_steps, t2, dt):
+    """Integrate orbits together, falling back to one orbit at a time if they fail as a group.
+
+    Returns the final (N, 6) coordinates with NaNs for any orbit that could not be integrated.
+    """
+    final = _integrate_w0(w0, n_steps, t2, dt)
+    if final is not None:
+        return final
+
+    # isolate the bad orbit(s) so they don't take the whole chunk down with them
+    final = np.full((w0.shape[1], 6), np.nan)
+    for i in range(w0.shape[1]):
+        single = _integrate_w0(w0[:, i:i + 1], n_steps, t2, dt)
+        if single is not None:
+            final[i] = single[0]
+    return final
+
+
+def _integrate_chunk(chunk_id, w0, n_steps, t2, dt):
+    """Integrate a chunk of orbits, using the escaper fast-path or recording snapshots if configured."""
+    if _GLOBAL.get("snapshot_times") is not None:
+        final, snapshots = _integrate_chunk_with_snapshots(w0, n_steps, t2, dt)
+        return chunk_id, final, np.isnan(final[:, 0]).sum(), None, snapshots
+
+    if _GLOBAL.get("escape") is None:
+        final = _integrate_robust(w0, n_steps, t2, dt)
+        return chunk_id, final, np.isnan(final[:, 0]).sum(), None, None
+
+    final, escape_info = _integrate_chunk_with_escapers(chunk_id, w0, n_steps, t2, dt)
+    return chunk_id, final, np.isnan(final[:, 0]).sum(), escape_info, None
+
+
+def _integrate_chunk_with_snapshots(w0, n_steps, t2, dt):
+    """Integrate a chunk in segments that end at each snapshot time, recording the orbits at each.
+
+    Snapshot times are snapped onto the timestep grid of the chunk (like the start times in
+    :func:`plan_chunks`). Orbits have NaN snapshots before they start and after they fail.
+    """
+    snapshot_times = _GLOBAL["snapshot_times"]
+    snapshots = np.full((w0.shape[1], len(snapshot_times), 6), np.nan)
+
+    state = w0.T.copy()
+    active = np.arange(len(state))
+    t_start = t2 - n_steps * dt
+    snapshot_steps = np.round((snapshot_times - t_start) / dt).astype(np.int64)
+
+    steps_done = 0
+    for epoch in np.flatnonzero((snapshot_steps >= 0) & (snapshot_steps <= n_steps)):
+        seg_steps = snapshot_steps[epoch] - steps_done
+        if seg_steps > 0 and len(active) > 0:
+            steps_done += seg_steps
+            state[active] = _integrate_robust(np.ascontiguousarray(state[active].T), seg_steps,
+                                              t_start + steps_done * dt, dt)
+            active = active[np.isfinite(state[active, 0])]
+        snapshots[active, epoch] = state[active]
+
+    if steps_done < n_steps and len(active) > 0:
+        state[active] = _integrate_robust(np.ascontiguousarray(state[active].T), n_steps - steps_done,
+                                          t2, dt)
+
+    # orbits that failed in any segment were left as NaN
+    return state, snapshots
+
+
+def _integrate_chunk_with_escapers(chunk_id, w0, n_steps, t2, dt):
+    """Integrate a chunk in segments, handing orbits that escape over to :func:`propagate_kepler`.
+
+    After every segment any orbit beyond the escape radius with positive energy is removed from the
+    numerical integration and propagated analytically to ``t2``. A random subset of these is kept in the
+    numerical integration as well so that the error of the analytic propagation can be measured.
+    """
+    settings = _GLOBAL["escape"]
+    pot = _GLOBAL["potential"]
+    rng = np.random.default_rng(chunk_id)
+
+    state = w0.T.copy()
+    final = np.full_like(state, np.nan)
+    active = np.arange(len(state))
+
+    # analytic predictions for the escapers we continue to integrate for validation
+    validating = np.zeros(len(state), dtype=bool)
+    validate_inds, validate_pred = [], []
+    n_fast, steps_skipped = 0, 0
+
+    steps_done = 0
+    while steps_done < n_steps and len(active) > 0:
+        seg_steps = min(settings["check_steps"], n_steps - steps_done)
+        steps_done += seg_steps
+        seg_t2 = t2 - (n_steps - steps_done) * dt
+
+        state[active] = _integrate_robust(np.ascontiguousarray(state[active].T), seg_steps, seg_t2, dt)
+        active = active[np.isfinite(state[active, 0])]
+
+        if steps_done == n_steps or len(active) == 0:
+            break
+
+        # find orbits that are far away and unbound
+        pos, vel = state[active, :3], state[active, 3:] * KMS_TO_KPCMYR
+        r = np.linalg.norm(pos, axis=1)
+        far = (r > settings["radius"]) & ~validating[active]
+        if not far.any():
+            continue
+        phi = pot.energy(pos[far].T).to(u.kpc**2 / u.Myr**2).value
+        unbound = np.zeros_like(far)
+        unbound[far] = 0.5 * np.sum(vel[far]**2, axis=1) + phi > 0
+        if not unbound.any():
+            continue
+
+        # propagate them analytically in the monopole of the potential measured where they are now
+        escapers = active[unbound]
+        mu = -phi[unbound[far]] * r[unbound]
+        remaining = (n_steps - steps_done) * dt
+        esc_pos, esc_vel = propagate_kepler(pos[unbound], vel[unbound], mu, remaining)
+        prediction = np.concatenate((esc_pos, esc_vel / KMS_TO_KPCMYR), axis=1)
+
+        validate = rng.uniform(size=len(escapers)) < settings["validation_fraction"]
+        final[escapers[~validate]] = prediction[~validate]
+        validating[escapers[validate]] = True
+        validate_inds.append(escapers[validate])
+        validate_pred.append(prediction[validate])
+
+        n_fast += (~validate).sum()
+        steps_skipped += (~validate).sum() * (n_steps - steps_done)
+        active = np.setdiff1d(active, escapers[~validate], assume_unique=True)
+
+    final[active] = state[active]
+
+    # compare the analytic predictions to the numerical integration for the validation subset
+    pos_err, vel_err = np.array([]), np.array([])
+    if len(validate_inds) > 0:
+        validate_inds = np.concatenate(validate_inds)
+        validate_pred = np.concatenate(validate_pred)
+        numerical = final[validate_inds]
+        pos_err = (np.linalg.norm(validate_pred[:, :3] - numerical[:, :3], axis=1)
+                   / np.linalg.norm(numerical[:, :3], axis=1))
+        vel_err = (np.linalg.norm(validate_pred[:, 3:] - numerical[:, 3:], axis=1)
+                   / np.linalg.norm(numerical[:, 3:], axis=1))
+
+    escape_info = {
+        "n_fast_path": n_fast,
+        "steps_skipped": steps_skipped,
+        "steps_total": len(state) * n_steps,
+        "pos_rel_err": pos_err[np.isfinite(pos_err)],
+        "vel_rel_err": vel_err[np.isfinite(vel_err)],
+    }
+    return final, escape_info
+
+
+def _stumpff(z):
+    """Stumpff functions C(z) and S(z) for the universal variable formulation of Kepler's equation."""
+    C, S = np.empty_like(z), np.empty_like(z)
+    small, pos, neg = np.abs(z) < 1e-6, z >= 1e-6, z <= -1e-6
+
+    C[small] = 1 / 2 - z[small] / 24
+    S[small] = 1 / 6 - z[small] / 120
+
+    sz = np.sqrt(z[pos])
+    C[pos] = (1 - np.cos(sz)) / z[pos]
+    S[pos] = (sz - np.sin(sz)) / sz**3
+
+    sz = np.sqrt(-z[neg])
+    C[neg] = (np.cosh(sz) - 1) / -z[neg]
+    S[neg] = (np.sinh(sz) - sz) / sz**3
+    return C, S
+
+
+def _universal_kepler(chi, r0, rv0, alpha, sqrt_mu, dt):
+    """Residual of the universal Kepler equation (and its derivative, which is the radius) at ``chi``."""
+    z = alpha * chi**2
+    C, S = _stumpff(z)
+    f = rv0 / sqrt_mu * chi**2 * C + (1 - alpha * r0) * chi**3 * S + r0 * chi - sqrt_mu * dt
+    df = rv0 / sqrt_mu * chi * (1 - z * S) + (1 - alpha * r0) * chi**2 * C + r0
+
+    # the Stumpff functions overflow far beyond the root (on the positive side), treat as such
+    f[~np.isfinite(f)] = np.inf
+    return f, df
+
+
+def propagate_kepler(pos, vel, mu, dt, max_iter=200, tol=1e-12):
+    """Propagate orbits forwards analytically in a point-mass potential using universal variables.
+
+    Kepler's equation is solved with a Newton iteration that falls back to bisection whenever a step
+    would leave the current bracket on the root or converges too slowly, so it converges for any conic.
+
+    Parameters
+    ----------
+    pos : array-like, shape (N, 3)
+        Positions in kpc
+    vel : array-like, shape (N, 3)
+        Velocities in kpc/Myr
+    mu : array-like, shape (N,)
+        Gravitational parameter :math:`GM` in kpc^3/Myr^2
+    dt : float or array-like
+        (Non-negative) time to propagate for in Myr
+    max_iter : int, optional
+        Maximum number of iterations. Default is 200.
+    tol : float, optional
+        Relative tolerance on the universal anomaly. Default is 1e-12.
+
+    Returns
+    -------
+    pos, vel : :class:`~numpy.ndarray`, shape (N, 3)
+        Propagated positions (kpc) and velocities (kpc/Myr)
+    """
+    pos, vel = np.atleast_2d(pos), np.atleast_2d(vel)
+    mu = np.asarray(mu, dtype=float)
+    dt = np.broadcast_to(np.asarray(dt, dtype=float), mu.shape)
+    sqrt_mu = np.sqrt(mu)
+
+    r0 = np.linalg.norm(pos, axis=1)
+    rv0 = np.sum(pos * vel, axis=1)
+    alpha = 2 / r0 - np.sum(vel**2, axis=1) / mu
+    args = (r0, rv0, alpha, sqrt_mu, dt)
+
+    with np.errstate(over="ignore", invalid="ignore"):
+        # the residual increases monotonically from -sqrt(mu) dt at chi=0, so bracket the root
+        lo, hi = np.zeros_like(r0), sqrt_mu * dt / r0
+        for _ in range(max_iter):
+            too_low = _universal_kepler(hi, *args)[0] < 0
+            if not too_low.any():
+                break
+            lo[too_low] = hi[too_low]
+            hi[too_low] *= 2
+
+        chi = 0.5 * (lo + hi)
+        dx_old = hi - lo
+        for _ in range(max_iter):
+            f, df = _universal_kepler(chi, *args)
+            lo = np.where(f < 0, chi, lo)
+            hi = np.where(f > 0, chi, hi)
+
+            # take the newton step unless it leaves the bracket or isn't shrinking fast enough, then bisect
+            new_chi = chi - f / df
+            bisect = ~((new_chi > lo) & (new_chi < hi)) | (np.abs(2 * f) > np.abs(dx_old * df))
+            new_chi[bisect] = 0.5 * (lo + hi)[bisect]
+
+            dx_old = np.abs(new_chi - chi)
+            chi = new_chi
+            if np.all(dx_old <= tol * np.maximum(np.abs(chi), 1)):
+                break
+
+    z = alpha * chi**2
+    C, S = _stumpff(z)
+    f = 1 - chi**2 / r0 * C
+    g = dt - chi**3 / sqrt_mu * S
+    new_pos = f[:, None] * pos + g[:, None] * vel
+
+    r = np.linalg.norm(new_pos, axis=1)
+    fdot = sqrt_mu / (r * r0) * (z * chi * S - chi)
+    gdot = 1 - chi**2 / r * C
+    new_vel = fdot[:, None] * pos + gdot[:, None] * vel
+    return new_pos, new_vel
+
+
+def integrate_orbits(pos, vel, t1, t2, potential, dt=1 * u.Myr, chunk_size=10_000, processes=1,
+                     Integrator=gi.DOPRI853Integrator, max_retries=2, timestep_divisor=8,
+                     escape_radius=None, escape_check_interval=500 * u.Myr, escape_validation_fraction=0.01,
+                     snapshot_times=None, snapshot_file=None, progress_bar=True, return_info=False):
+    """Integrate many orbits through a potential in batches that share start and end times.
+
+    Orbits are grouped with :func:`plan_chunks` and each chunk is integrated as a single multi-orbit
+    :class:`~gala.dynamics.PhaseSpacePosition`. Only plain NumPy arrays are sent to the worker processes,
+    the potential is sent once per worker.
+
+    Parameters
+    ----------
+    pos : :class:`~astropy.units.Quantity` [length], shape (N, 3)
+        Initial galactocentric positions
+    vel : :class:`~astropy.units.Quantity` [velocity], shape (N, 3)
+        Initial galactocentric velocities
+    t1 : :class:`~astropy.units.Quantity` [time], shape (N,)
+        Start time of each orbit
+    t2 : :class:`~astropy.units.Quantity` [time]
+        End time of the orbits, either a scalar or one per orbit
+    potential : :class:`~gala.potential.potential.PotentialBase`
+        Potential in which to integrate the orbits
+    dt : :class:`~astropy.units.Quantity` [time], optional
+        Timestep. Default is 1 Myr.
+    chunk_size : int, optional
+        Maximum number of orbits integrated together. Default is 10,000.
+    processes : int, optional
+        Number of worker processes. Default is 1 (no pool).
+    Integrator : :class:`~gala.integrate.Integrator`, optional
+        Integrator to use. Default is :class:`~gala.integrate.DOPRI853Integrator`.
+    max_retries : int, optional
+        Number of attempts for each chunk, each with a timestep ``timestep_divisor`` times smaller than
+        the previous. Default is 2.
+    timestep_divisor : int, optional
+        Factor by which the timestep shrinks on each retry. Default is 8.
+    escape_radius : :class:`~astropy.units.Quantity` [length], optional
+        If given, enable the escaper fast-path: orbits beyond this radius with positive energy stop being
+        integrated numerically and are instead propagated analytically to ``t2`` in the monopole of the
+        potential (see :func:`propagate_kepler`). Default is None (disabled).
+    escape_check_interval : :class:`~astropy.units.Quantity` [time], optional
+        How often to check for escapers. Default is 500 Myr.
+    escape_validation_fraction : float, optional
+        Fraction of escapers that are still integrated numerically to measure the error of the analytic
+        propagation. Default is 0.01.
+    snapshot_times : :class:`~astropy.units.Quantity` [time], optional
+        If given, also record every orbit at each of these times (e.g. every 500 Myr), without storing the
+        entire orbits. Each chunk is integrated in segments that end at the snapshot times, which are
+        snapped onto its timestep grid. Can't be combined with ``escape_radius``. Default is None.
+    snapshot_file : str, optional
+        Path of a ``.npy`` file into which snapshots are streamed as each chunk finishes, so only one
+        chunk's snapshots are ever in memory. It can be loaded later with ``np.load(snapshot_file,
+        mmap_mode="r")``. Default is None (keep the snapshots in memory).
+    progress_bar : bool, optional
+        Whether to show a progress bar over the orbits. Default is True.
+    return_info : bool, optional
+        Whether to also return a dictionary of integration statistics. Default is False.
+
+    Returns
+    -------
+    final_pos : :class:`~astropy.units.Quantity` [kpc], shape (N, 3)
+        Final positions, NaN for orbits that failed to integrate
+    final_vel : :class:`~astropy.units.Quantity` [km/s], shape (N, 3)
+        Final velocities, NaN for orbits that failed to integrate
+    snapshots : :class:`~numpy.ndarray`, shape (N, n_snapshots, 6)
+        Positions (kpc) and velocities (km/s) of each orbit at each snapshot time, NaN before the orbit
+        starts or after it fails. A memory-mapped array if ``snapshot_file`` is given. Only returned if
+        ``snapshot_times`` is given.
+    info : dict
+        Number of failed orbits, number of failed attempts that were retried with a smaller timestep
+        (``"n_retries"``), the time each worker spent integrating (``"workers"``) and (if the escaper
+        fast-path is enabled) how often it was used and the relative position/velocity errors of the
+        validation subset. Only returned if ``return_info``.
+    """
+    w0 = np.concatenate((pos.to(u.kpc).value, vel.to(u.km / u.s).value), axis=1).T
+    t1 = np.atleast_1d(t1.to(u.Myr).value)
+    t2 = t2.to(u.Myr).value
+    dt = dt.to(u.Myr).value
+
+    chunks = plan_chunks(t1, t2, dt, chunk_size=chunk_size)
+    args = ((i, np.ascontiguousarray(w0[:, inds]), n_steps, chunk_t2, dt)
+            for i, (inds, n_steps, chunk_t2) in enumerate(chunks))
+
+    if snapshot_times is not None:
+        if escape_radius is not None:
+            raise ValueError("Snapshots can't be recorded with the escaper fast-path, "
+                             "set `escape_radius=None`")
+        snapshot_times = np.atleast_1d(snapshot_times.to(u.Myr).value)
+        if np.any(np.diff(snapshot_times) <= 0) or np.any(snapshot_times > np.max(t2)):
+            raise ValueError("Snapshot times must be increasing and not after the end time of the orbits")
+
+        shape = (w0.shape[1], len(snapshot_times), 6)
+        if snapshot_file is None:
+            snapshots = np.full(shape, np.nan)
+        else:
+            snapshots = np.lib.format.open_memmap(snapshot_file, mode="w+", dtype=np.float64, shape=shape)
+            snapshots[:] = np.nan
+
+    escape_settings = None
+    if escape_radius is not None:
+        escape_settings = {
+            "radius": escape_radius.to(u.kpc).value,
+            "check_steps": max(int(round(escape_check_interval.to(u.Myr).value / dt)), 1),
+            "validation_fraction": escape_validation_fraction,
+        }
+
+    final = np.full((w0.shape[1], 6), np.nan)
+    initargs = (potential, Integrator, max_retries, timestep_divisor, escape_settings, snapshot_times)
+    bar = tqdm(total=w0.shape[1], disable=not progress_bar)
+
+    info = {"n_failed": 0, "n_retries": 0}
+    escape_infos = []
+    workers = {}
+
+    def collect(result):
+        (chunk_id, chunk_final, chunk_failed, escape_info, chunk_snapshots), timing = result
+        final[chunks[chunk_id][0]] = chunk_final
+        if chunk_snapshots is not None:
+            snapshots[chunks[chunk_id][0]] = chunk_snapshots
+        info["n_failed"] += chunk_failed
+        info["n_retries"] += timing["n_retries"]
+        if escape_info is not None:
+            escape_infos.append(escape_info)
+
+        worker = workers.setdefault(timing["pid"], {"pid": timing["pid"], "n_chunks": 0, "n_orbits": 0,
+                                                    "wall_time": 0.0, "cpu_time": 0.0})
+        worker["n_chunks"] += 1
+        worker["n_orbits"] += len(chunk_final)
+        worker["wall_time"] += timing["wall_time"]
+        worker["cpu_time"] += timing["cpu_time"]
+        bar.update(len(chunk_final))
+
+    if processes > 1:
+        with Pool(processes=processes, initializer=_init_worker, initargs=initargs) as pool:
+            for result in pool.imap_unordered(_unpack_chunk, args):
+                collect(result)
+    else:
+        _init_worker(*initargs)
+        for arg in args:
+            collect(_unpack_chunk(arg))
+    bar.close()
+    info["workers"] = list(workers.values())
+
+    if info["n_retries"] > 0:
+        print(f"Integration failed {info['n_retries']} time(s) and was retried with a smaller timestep")
+    if info["n_failed"] > 0:
+        print(f"Warning: {info['n_failed']} orbit(s) failed to integrate, their final coordinates are NaN")
+
+    if escape_settings is not None:
+        info.update(_summarise_escapers(escape_infos, n_orbits=w0.shape[1]))
+
+    out = (final[:, :3] * u.kpc, final[:, 3:] * u.km / u.s)
+    if snapshot_times is not None:
+        if snapshot_file is not None:
+            snapshots.flush()
+        out += (snapshots,)
+    if return_info:
+        out += (info,)
+    return out
+
+
+def _summarise_escapers(escape_infos, n_orbits):
+    """Combine the escaper statistics from each chunk and print a short report."""
+    n_fast = sum(ei["n_fast_path"] for ei in escape_infos)
+    steps_skipped = sum(ei["steps_skipped"] for ei in escape_infos)
+    steps_total = sum(ei["steps_total"] for ei in escape_infos)
+    pos_err = np.concatenate([ei["pos_rel_err"] for ei in escape_infos]) if escape_infos else np.array([])
+    vel_err = np.concatenate([ei["vel_rel_err"] for ei in escape_infos]) if escape_infos else np.array([])
+
+    summary = {
+        "n_fast_path": n_fast,
+        "fast_path_fraction": n_fast / max(n_orbits, 1),
+        "steps_skipped_fraction": steps_skipped / max(steps_total, 1),
+        "n_validated": len(pos_err),
+        "pos_rel_err": pos_err,
+        "vel_rel_err": vel_err,
+    }
+
+    print(f"Escaper fast-path used for {n_fast} orbits ({summary['fast_path_fraction']:.1%}), "
+          f"skipping {summary['steps_skipped_fraction']:.1%} of integration steps")
+    if len(pos_err) > 0:
+        print(f"  Validated against {len(pos_err)} numerical orbits: relative position error "
+              f"median {np.median(pos_err):.1e} (max {pos_err.max():.1e}), relative velocity error "
+              f"median {np.median(vel_err):.1e} (max {vel_err.max():.1e})")
+    return summary
+
+
+def _unpack_chunk(args):
+    start_wall, start_cpu = time.perf_counter(), time.process_time()
+    _GLOBAL["n_retries"] = 0
+    result = _integrate_chunk(*args)
+    return result, {"pid": os.getpid(), "wall_time": time.perf_counter() - start_wall,
+                    "cpu_time": time.process_time() - start_cpu, "n_retries": _GLOBAL["n_retries"]}
@@ -2,9 +2,11 @@ import numpy as np
 import matplotlib as mpl
 import matplotlib.pyplot as plt
 import astropy.units as u
-from scipy.ndimage import gaussian_filter
+from scipy.ndimage import gaussian_filter, gaussian_filter1d
 from scipy.optimize import curve_fit
 
+from density import DensityMap, side_on_density_map
+
 
 plt.rc('font', family='serif')
 plt.rcParams['text.usetex'] = False
@@ -32,10 +34,12 @@ def plot_side_on_density(xs, zs, labels, xlim=20, zlim=12, n_bins=200, sigma=1.0
 
     Parameters
     ----------
-    xs : list of array-like
-        List of x-coordinate arrays for different populations to plot.
+    xs : list of array-like or list of :class:`~density.DensityMap`
+        List of x-coordinate arrays for different populations to plot (which may be memory-mapped), or
+        density maps from :func:`~density.side_on_density_map` to re-plot without binning again.
     zs : list of array-like
-        List of z-coordinate arrays for different populations to plot.
+        List of z-coordinate arrays for different populations to plot. Ignored for any population given as
+        a density map.
     labels : list of str
         List of labels corresponding to each population.
     xlim : float, optional
@@ -64,25 +68,28 @@ def plot_side_on_density(xs, zs, labels, xlim=20, zlim=12, n_bins=200, sigma=1.0
         The figure object containing the plot.
     ax : matplotlib.axes.Axes
         The axes object containing the plot.
+
+    Raises
+    ------
+    ValueError
+        If a density map was made with different limits or number of bins.
     """
     upper_lim = 0
     to_plot = []
 
-    for x, z, extent in zip([np.abs(xs[0].to(u.kpc).value), -np.abs(xs[1].to(u.kpc).value)],
-                            [zs[0].to(u.kpc).value, zs[1].to(u.kpc).value],
-                            [[0, xlim, -zlim, zlim], [-xlim, 0, -zlim, zlim]]):
-        mask = (np.abs(z) < zlim) & (np.abs(x) < xlim)
-        x = x[mask]
-        z = z[mask]
-
-        range_ex = [[extent[0], extent[1]], [extent[2], extent[3]]]
-
-        hist, x_edges, y_edges = np.histogram2d(x, z, range=range_ex, bins=n_bins)
-
-        if apply_smoothing:
-            smoothed_hist = gaussian_filter(hist, sigma=sigma)
+    # the first population is shown on the right (x > 0) and the second mirrored on the left
+    for i, extent in enumerate([[0, xlim, -zlim, zlim], [-xlim, 0, -zlim, zlim]]):
+        if isinstance(xs[i], DensityMap):
+            density_map = xs[i]
+            if density_map.binning != ((0, xlim), (-zlim, zlim), n_bins):
+                raise ValueError(f"Density map {i} has binning {density_map.binning}, which doesn't match "
+                                 f"xlim={xlim}, zlim={zlim}, n_bins={n_bins}")
         else:
-            smoothed_hist = hist
+            density_map = side_on_density_map(xs[i], zs[i], xlim=xlim, zlim=zlim, n_bins=n_bins)
+
+        smoothed_hist = density_map.smoothed(sigma) if apply_smoothing else density_map.counts
+        if extent[0] < 0:
+            smoothed_hist = smoothed_hist[::-1]
 
         max_count = smoothed_hist.max()
         max_count_logged = 10**np.floor(np.log10(max_count))
@@ -183,6 +190,40 @@ def compare_table_quantity(pops, quantity, kstar, bins, xlabel, ylabel, density=
     return fig, ax
 
 
+def compare_cube_marginal(cubes, axis, colours, xlabel, ylabel=r"$N_{\rm CO}$", density=False, scale=False,
+                          fig=None, ax=None, show=True, **selections):
+    """Compare the distribution of one quantity between populations using their :class:`~cube.PopulationCube`.
+
+    Each histogram is a marginalisation of a cube so no population tables are read. Any extra keyword
+    arguments select compact objects (e.g. ``co_type="BH"``, ``escaped=False``, see
+    :meth:`~cube.PopulationCube.histogram`). The open-ended outer bins of the axis are not shown, so cubes
+    without any other bins on the axis are skipped.
+    """
+    if fig is None or ax is None:
+        fig, ax = plt.subplots()
+
+    for cube, colour in zip(cubes, colours):
+        # (e.g. the single mass bin of populations without remnant masses)
+        if len(cube.edges[axis]) < 4:
+            continue
+        hist = cube.histogram(axis, scale=scale, **selections)[1:-1]
+        edges = cube.edges[axis][1:-1]
+        label = f"{cube.label}\nN={hist.sum():.0f}"
+        if density:
+            hist = hist / (hist.sum() * np.diff(edges))
+
+        ax.stairs(hist, edges, color=colour, lw=2)
+        ax.stairs(hist, edges, color=colour, alpha=0.4, fill=True, label=label)
+
+    ax.set(xscale="log", xlabel=xlabel, ylabel=ylabel)
+    ax.legend()
+
+    if show:
+        plt.show()
+
+    return fig, ax
+
+
 def exponential(x, a, b):
     return a * np.exp(-b * x)
 
@@ -239,6 +280,136 @@ def estimate_scale_height(z, bins=np.linspace(0, 2, 101),
         return scale_height, None, None
 
 
+def fit_exponentials(x, y, n_iter=10):
+    """Least squares fits of :func:`exponential` to many curves at once.
+
+    Starts from the closed form solution of the log-linear fit weighted by :math:`y^2` (which approximates
+    the least squares fit in linear space) and then refines it with vectorised Gauss-Newton steps, giving
+    the same result as fitting each curve with :func:`~scipy.optimize.curve_fit`.
+
+    Parameters
+    ----------
+    x : :class:`~numpy.ndarray`, shape (n_bins,)
+        Points at which the curves are evaluated
+    y : :class:`~numpy.ndarray`, shape (..., n_bins)
+        Curves to fit
+    n_iter : int, optional
+        Number of Gauss-Newton iterations. Default is 10.
+
+    Returns
+    -------
+    a, b : :class:`~numpy.ndarray`, shape (...)
+        Best fitting parameters of each curve
+    """
+    # weighted linear regression of ln(y) = ln(a) - b x (empty bins have no weight)
+    w = y**2
+    log_y = np.log(np.where(y > 0, y, 1.0))
+    sw, swx, swxx = w.sum(axis=-1), (w * x).sum(axis=-1), (w * x**2).sum(axis=-1)
+    swy, swxy = (w * log_y).sum(axis=-1), (w * x * log_y).sum(axis=-1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        slope = (sw * swxy - swx * swy) / (sw * swxx - swx**2)
+        a = np.exp((swy - slope * swx) / sw)
+    b = -slope
+
+    # solve the 2x2 normal equations of the linearised problem for every curve together
+    for _ in range(n_iter):
+        e = np.exp(-b[..., None] * x)
+        residual = y - a[..., None] * e
+        j_a, j_b = e, -a[..., None] * x * e
+        h_aa, h_ab, h_bb = (j_a**2).sum(axis=-1), (j_a * j_b).sum(axis=-1), (j_b**2).sum(axis=-1)
+        g_a, g_b = (j_a * residual).sum(axis=-1), (j_b * residual).sum(axis=-1)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            det = h_aa * h_bb - h_ab**2
+            a = a + (h_bb * g_a - h_ab * g_b) / det
+            b = b + (h_aa * g_b - h_ab * g_a) / det
+
+    return a, b
+
+
+def estimate_scale_heights(zs, bins=np.linspace(0, 2, 101), n_bootstrap=1000, interval=0.68, sigma=2,
+                           seed=None, return_samples=False):
+    """Estimate the scale heights of many populations at once, with bootstrap confidence intervals.
+
+    Each population is histogrammed once. Bootstrap resamples of the z-positions are then drawn directly as
+    histograms, from a multinomial distribution over the bins (with an extra bin for everything outside
+    them), for every population and resample together. All of the (smoothed) histograms are then fit with
+    :func:`fit_exponentials`, so this is equivalent to calling :func:`estimate_scale_height` on every
+    resample of every population, only much faster.
+
+    Parameters
+    ----------
+    zs : list of array-like
+        z-positions of each population (in kpc if not a Quantity)
+    bins : array-like, optional
+        Bin edges in |z| (kpc). Default is 100 bins between 0 and 2 kpc.
+    n_bootstrap : int, optional
+        Number of bootstrap resamples of each population. Default is 1000.
+    interval : float, optional
+        Width of the (central) confidence interval. Default is 0.68.
+    sigma : float, optional
+        Standard deviation (in bins) of the Gaussian smoothing applied before fitting. Default is 2.
+    seed : int, optional
+        Random seed for the resampling. Default is None.
+    return_samples : bool, optional
+        Whether to also return the scale height of every resample. Default is False.
+
+    Returns
+    -------
+    scale_heights : :class:`~numpy.ndarray`, shape (n_pops,)
+        Scale height of each population (kpc)
+    intervals : :class:`~numpy.ndarray`, shape (n_pops, 2)
+        Lower and upper limits of the confidence interval of each scale height (kpc)
+    samples : :class:`~numpy.ndarray`, shape (n_pops, n_bootstrap)
+        Scale heights of the bootstrap resamples (kpc), only returned if ``return_samples=True``
+    """
+    bins = np.asarray(bins)
+    bin_centres = 0.5 * (bins[:-1] + bins[1:])
+
+    # histogram each population, with a final bin counting everything outside the range
+    counts = np.zeros((len(zs), len(bins)))
+    for i, z in enumerate(zs):
+        z = np.abs(z.to(u.kpc).value if hasattr(z, "unit") else np.asarray(z))
+        counts[i, :-1] = np.histogram(z, bins=bins)[0]
+        counts[i, -1] = len(z) - counts[i, :-1].sum()
+
+    rng = np.random.default_rng(seed)
+    n = counts.sum(axis=1).astype(np.int64)
+    resampled = rng.multinomial(n, counts / n[:, None], size=(n_bootstrap, len(zs))).transpose(1, 0, 2)
+
+    # fit the original histogram and every resample together
+    hists = np.concatenate((counts[:, None, :-1], resampled[..., :-1]), axis=1).astype(float)
+    hists /= hists.max(axis=-1, keepdims=True)
+    smooth_hists = gaussian_filter1d(hists, sigma=sigma, axis=-1)
+    _, b = fit_exponentials(bin_centres, smooth_hists)
+    heights = 1 / b
+
+    tail = (1 - interval) / 2
+    intervals = np.nanquantile(heights[:, 1:], [tail, 1 - tail], axis=1).T
+    if return_samples:
+        return heights[:, 0], intervals, heights[:, 1:]
+    return heights[:, 0], intervals
+
+
+def plot_scale_heights(labels, scale_heights, intervals, colours, fig=None, ax=None, show=True):
+    """Compare scale heights (with confidence intervals from :func:`estimate_scale_heights`) as error bars."""
+    if fig is None or ax is None:
+        fig, ax = plt.subplots()
+
+    scale_heights = np.asarray(scale_heights) * 1000
+    intervals = np.asarray(intervals) * 1000
+    errors = np.abs(intervals.T - scale_heights)
+    for i, (label, colour) in enumerate(zip(labels, colours)):
+        ax.errorbar(i, scale_heights[i], yerr=errors[:, i:i + 1], fmt="o", color=colour, capsize=5, ms=10)
+
+    ax.set(xticks=range(len(labels)), ylabel="Scale height [pc]")
+    ax.set_xticklabels(labels, rotation=45, ha="right")
+
+    if show:
+        plt.show()
+
+    return fig, ax
+
+
 def absolute_galactocentric_height(pops, kinematics, co_type="CO", fig=None, axes=None, show=True):
     if fig is None or axes is None:
         fig, axes = plt.subplots(1, 2, figsize=(20, 6))
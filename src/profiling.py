@@ -0,0 +1,166 @@
+import json
+import os
+import platform
+import resource
+import time
+from contextlib import contextmanager
+
+
+def _usage():
+    """Wall time, CPU time of this process and its finished children (s) and peak RSS of each (MB)."""
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return {
+        "wall_time": time.perf_counter(),
+        "cpu_time": own.ru_utime + own.ru_stime,
+        "children_cpu_time": children.ru_utime + children.ru_stime,
+        # ru_maxrss is in kilobytes on Linux
+        "peak_rss_mb": own.ru_maxrss / 1024,
+        "children_peak_rss_mb": children.ru_maxrss / 1024,
+    }
+
+
+class RunProfiler():
+    """Record the cost of each named stage of a script and write a JSON report of the run.
+
+    For each stage this records the wall time, the CPU time of this process and of any child processes
+    that finished during the stage (e.g. pool workers, which are only counted once they exit), the peak
+    resident memory so far of this process and of its largest child, and optionally the number of objects
+    processed (and so the throughput) and the timings of individual workers.
+
+    Parameters
+    ----------
+    name : str
+        Name of the run, used for the report file name
+    output_dir : str, optional
+        Directory in which to save the report (as ``{name}-{start time}.profile.json``). Default is None,
+        in which case the report is only saved by passing a file name to :meth:`save`.
+    verbose : bool, optional
+        Whether to print a summary line at the end of each stage. Default is True.
+
+    Attributes
+    ----------
+    info : dict
+        Anything else to include in the report (e.g. the :attr:`~writer.BackgroundWriter.writes` of a writer)
+
+    Examples
+    --------
+    ::
+
+        profiler = RunProfiler("underworld", output_dir="/path/to/output")
+        with profiler.stage("stellar evolution", count=len(pop)):
+            pop.perform_stellar_evolution()
+        with profiler.stage("orbits") as stage:
+            final_pos, final_vel, info = orbits.integrate_orbits(..., return_info=True)
+            stage["count"] = len(final_pos)
+            stage["workers"] = info["workers"]
+        profiler.save()
+    """
+    def __init__(self, name, output_dir=None, verbose=True):
+        self.name = name
+        self.output_dir = output_dir
+        self.verbose = verbose
+        self.stages = []
+        self.info = {}
+        self.started = time.time()
+        self._start_usage = _usage()
+
+    def __repr__(self):
+        return f"<RunProfiler: {self.name}, {len(self.stages)} stage(s)>"
+
+    @property
+    def file_name(self):
+        """Default path of the report, or None if there is no ``output_dir``."""
+        if self.output_dir is None:
+            return None
+        started = time.strftime("%Y%m%d-%H%M%S", time.localtime(self.started))
+        return os.path.join(self.output_dir, f"{self.name}-{started}.profile.json")
+
+    @contextmanager
+    def stage(self, name, count=None):
+        """Profile a stage of the run.
+
+        Parameters
+        ----------
+        name : str
+            Name of the stage
+        count : int, optional
+            Number of objects processed in the stage. This can also be set (along with a list of
+            ``"workers"`` timings) on the dictionary that the context manager yields.
+
+        Yields
+        ------
+        record : dict
+            Record of the stage, which is filled in when the stage ends
+        """
+        record = {"name": name, "count": count}
+        start = _usage()
+        try:
+            yield record
+        finally:
+            end = _usage()
+            record["wall_time"] = end["wall_time"] - start["wall_time"]
+            record["cpu_time"] = end["cpu_time"] - start["cpu_time"]
+            record["children_cpu_time"] = end["children_cpu_time"] - start["children_cpu_time"]
+            record["peak_rss_mb"] = end["peak_rss_mb"]
+            record["children_peak_rss_mb"] = end["children_peak_rss_mb"]
+            if record["count"] is not None:
+                record["count"] = int(record["count"])
+                record["throughput"] = record["count"] / max(record["wall_time"], 1e-9)
+            self.stages.append(record)
+
+            if self.verbose:
+                self._print(record)
+
+    def _print(self, record):
+        message = (f"   {record['name']}: {record['wall_time']:1.2f}s wall, "
+                   f"{record['cpu_time'] + record['children_cpu_time']:1.2f}s CPU, "
+                   f"peak RSS {record['peak_rss_mb']:1.0f} MB")
+        if record["count"] is not None:
+            message += f", {record['count']} objects ({record['throughput']:1.1f}/s)"
+        print(message)
+
+    def report(self):
+        """The run report as a dictionary."""
+        end = _usage()
+        return {
+            "name": self.name,
+            "host": platform.node(),
+            "pid": os.getpid(),
+            "started": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(self.started)),
+            "wall_time": end["wall_time"] - self._start_usage["wall_time"],
+            "cpu_time": end["cpu_time"] - self._start_usage["cpu_time"],
+            "children_cpu_time": end["children_cpu_time"] - self._start_usage["children_cpu_time"],
+            "peak_rss_mb": end["peak_rss_mb"],
+            "children_peak_rss_mb": end["children_peak_rss_mb"],
+            "stages": self.stages,
+            **self.info,
+        }
+
+    def save(self, file_name=None):
+        """Write the report to a JSON file (atomically, so it can be saved after every stage).
+
+        Parameters
+        ----------
+        file_name : str, optional
+            Path of the report. Default is :attr:`file_name`.
+
+        Returns
+        -------
+        file_name : str
+            Path of the report
+
+        Raises
+        ------
+        ValueError
+            If no file name is given and the profiler has no ``output_dir``.
+        """
+        file_name = self.file_name if file_name is None else file_name
+        if file_name is None:
+            raise ValueError("No file name given and the profiler has no `output_dir`")
+
+        os.makedirs(os.path.dirname(os.path.abspath(file_name)), exist_ok=True)
+        with open(file_name + ".tmp", "w") as f:
+            json.dump(self.report(), f, indent=2, default=float)
+        os.replace(file_name + ".tmp", file_name)
+        return file_name
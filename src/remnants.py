@@ -0,0 +1,146 @@
+import numpy as np
+import astropy.units as u
+
+
+CO_TYPES = ["NS", "BH", "CO"]
+
+
+def remnant_rows(final_bpp):
+    """Every NS and BH in a final bpp table, in the order used by :class:`RemnantTable`.
+
+    Parameters
+    ----------
+    final_bpp : :class:`~pandas.DataFrame`
+        Final state of each system
+
+    Returns
+    -------
+    inds : :class:`~numpy.ndarray`
+        Index of each compact object into the primaries followed by the secondaries (so ``inds % n`` is the
+        row and ``inds >= n`` flags secondaries), with neutron stars first
+    n_ns : int
+        Number of neutron stars
+    """
+    kstar = np.concatenate((final_bpp["kstar_1"].values, final_bpp["kstar_2"].values))
+
+    # pick out every NS and BH (primaries then secondaries), stable sort to put NSs first
+    inds = np.flatnonzero((kstar == 13) | (kstar == 14))
+    inds = inds[np.argsort(kstar[inds], kind="stable")]
+    return inds, np.count_nonzero(kstar[inds] == 13)
+
+
+class RemnantTable():
+    """A columnar table of every neutron star and black hole in a population.
+
+    All columns live in a single contiguous float64 array of shape (n_columns, N) with neutron stars sorted
+    before black holes, so the "NS", "BH" and "CO" subsets (see :meth:`__getitem__`) are all views of the
+    same memory rather than copies.
+
+    Parameters
+    ----------
+    data : :class:`~numpy.ndarray`, shape (len(COLUMNS), N)
+        The table data, with rows in the order given by :attr:`COLUMNS`
+    n_ns : int
+        Number of neutron stars (which come first in ``data``)
+    label : str, optional
+        Label of the population the table was built from
+    """
+    COLUMNS = ["x", "y", "z", "v_x", "v_y", "v_z", "mass", "kstar", "bin_num", "escaped"]
+    _col = {col: i for i, col in enumerate(COLUMNS)}
+
+    def __init__(self, data, n_ns, label=None):
+        self.data = data
+        self.n_ns = n_ns
+        self.label = label
+
+    def __len__(self):
+        return self.data.shape[1]
+
+    def __repr__(self):
+        return f"<RemnantTable{'' if self.label is None else f' ({self.label})'}: {len(self)} COs>"
+
+    def __getitem__(self, co_type):
+        """Get a view of the table containing just one type of compact object ("NS", "BH" or "CO")."""
+        if co_type == "CO":
+            return self
+        elif co_type == "NS":
+            return RemnantTable(self.data[:, :self.n_ns], self.n_ns, self.label)
+        elif co_type == "BH":
+            return RemnantTable(self.data[:, self.n_ns:], 0, self.label)
+        raise ValueError(f"Unknown compact object type '{co_type}', choose from {CO_TYPES}")
+
+    def column(self, name):
+        """A view of a single column (without units)."""
+        return self.data[self._col[name]]
+
+    @property
+    def pos(self):
+        """Galactocentric positions, shape (N, 3), as a view of the table."""
+        return self.data[0:3].T << u.kpc
+
+    @property
+    def vel(self):
+        """Galactocentric velocities, shape (N, 3), as a view of the table."""
+        return self.data[3:6].T << u.km / u.s
+
+    @property
+    def mass(self):
+        return self.column("mass") << u.Msun
+
+    @property
+    def kstar(self):
+        return self.column("kstar")
+
+    @property
+    def bin_num(self):
+        return self.column("bin_num")
+
+    @property
+    def escaped(self):
+        """Mask of compact objects that are moving faster than the escape velocity at their position."""
+        return self.column("escaped") > 0
+
+    @classmethod
+    def from_population(cls, pop, escape_velocity=None):
+        """Build a table from the final state of a population in one pass.
+
+        Parameters
+        ----------
+        pop : :class:`~cogsworth.pop.Population`
+            Population that has been through galactic evolution
+        escape_velocity : callable, optional
+            Function that takes positions in kpc with shape (3, N) and returns the escape velocity in km/s.
+            Default is to evaluate ``pop.galactic_potential`` directly (once for every compact object).
+
+        Returns
+        -------
+        table : :class:`RemnantTable`
+        """
+        n = len(pop)
+        final_bpp = pop.final_bpp
+        inds, n_ns = remnant_rows(final_bpp)
+
+        # secondaries of disrupted binaries have their own orbits at the end of final_pos
+        rows = inds % n
+        is_secondary = inds >= n
+        orbit_rows = rows.copy()
+        disrupted_rank = np.cumsum(pop.disrupted) - 1 + n
+        from_secondary_orbit = is_secondary & pop.disrupted[rows]
+        orbit_rows[from_secondary_orbit] = disrupted_rank[rows[from_secondary_orbit]]
+
+        data = np.empty((len(cls.COLUMNS), len(inds)))
+        final_pos = pop.final_pos.to(u.kpc).value
+        final_vel = pop.final_vel.to(u.km / u.s).value
+        data[0:3] = final_pos[orbit_rows].T
+        data[3:6] = final_vel[orbit_rows].T
+        data[6] = np.where(is_secondary, final_bpp["mass_2"].values[rows], final_bpp["mass_1"].values[rows])
+        data[7] = np.where(is_secondary, final_bpp["kstar_2"].values[rows], final_bpp["kstar_1"].values[rows])
+        data[8] = final_bpp["bin_num"].values[rows]
+
+        if escape_velocity is None:
+            v_esc = np.sqrt(-2 * pop.galactic_potential.energy(data[0:3] * u.kpc)).to(u.km / u.s).value
+        else:
+            v_esc = escape_velocity(data[0:3])
+        data[9] = np.sqrt(np.sum(data[3:6]**2, axis=0)) >= v_esc
+
+        return cls(data, n_ns, label=getattr(pop, "label", None))
@@ -0,0 +1,304 @@
+import json
+import os
+import socket
+import threading
+import time
+import uuid
+
+
+class ShardPlan():
+    """A run split into shards that independent workers (on any number of nodes) claim from a shared
+    directory.
+
+    :meth:`create` writes one small JSON manifest per shard (its row range and random seed). Workers call
+    :meth:`claim` to take the next shard that is neither finished nor claimed. Claims are lock files created
+    with ``O_CREAT | O_EXCL``, which is atomic even on shared filesystems, so no two workers ever take the
+    same shard and no scheduler or server is needed. Workers refresh their locks with :meth:`heartbeat` while
+    they work, so a lock that stops being refreshed belongs to a worker that died. A finished shard gets a
+    ``.done`` file (written atomically) that records its outputs, so a killed worker only loses the shard it
+    was working on, which can be claimed again once its lock is released or goes stale.
+
+    Parameters
+    ----------
+    run_dir : str
+        Shared directory of the run, containing ``plan.json``
+    """
+    def __init__(self, run_dir):
+        self.run_dir = run_dir
+        with open(os.path.join(run_dir, "plan.json")) as f:
+            plan = json.load(f)
+        self.config = plan["config"]
+        self.n_rows = plan["n_rows"]
+        self.n_shards = plan["n_shards"]
+
+    def __repr__(self):
+        status = self.status()
+        return (f"<ShardPlan: {self.run_dir}, {self.n_shards} shards, {len(status['done'])} done, "
+                f"{len(status['claimed'])} claimed>")
+
+    @classmethod
+    def create(cls, run_dir, n_rows, shard_size, seed, config=None):
+        """Plan a run, or load the existing plan if it was made with the same settings.
+
+        Parameters
+        ----------
+        run_dir : str
+            Shared directory of the run
+        n_rows : int
+            Total number of rows (e.g. orbits) to process
+        shard_size : int
+            Maximum number of rows in each shard
+        seed : int
+            Seed of the run, shard ``i`` gets the seed ``[seed, i]`` (for
+            :func:`~numpy.random.default_rng`) so its random numbers don't depend on which worker runs it
+        config : dict, optional
+            Any other settings of the run, which every worker can read from :attr:`config`
+
+        Returns
+        -------
+        plan : :class:`ShardPlan`
+
+        Raises
+        ------
+        ValueError
+            If a plan with different settings already exists in ``run_dir``
+        """
+        config = json.loads(json.dumps({**(config or {}), "seed": seed, "shard_size": shard_size}))
+        plan_path = os.path.join(run_dir, "plan.json")
+        if os.path.exists(plan_path):
+            plan = cls(run_dir)
+            if plan.config != config or plan.n_rows != n_rows:
+                raise ValueError(f"A plan with different settings already exists in {run_dir}, either use "
+                                 f"the same settings or start a new run.\n  Saved: {plan.config}"
+                                 f"\n  Now:   {config}")
+            return plan
+
+        os.makedirs(run_dir, exist_ok=True)
+        n_shards = -(-n_rows // shard_size)
+        for shard in range(n_shards):
+            _write_json(os.path.join(run_dir, f"shard-{shard:05d}.json"), {
+                "shard": shard, "start": shard * shard_size, "stop": min((shard + 1) * shard_size, n_rows),
+                "seed": [seed, shard],
+            })
+
+        # the plan is written last so that a plan that exists always has all of its shard manifests
+        _write_json(plan_path, {"config": config, "n_rows": n_rows, "n_shards": n_shards,
+                                "created": time.time()})
+        return cls(run_dir)
+
+    def _path(self, shard, suffix):
+        return os.path.join(self.run_dir, f"shard-{shard:05d}{suffix}")
+
+    def shard(self, shard):
+        """The manifest of a shard (its ``shard`` number, row range ``start``-``stop`` and ``seed``)."""
+        with open(self._path(shard, ".json")) as f:
+            return json.load(f)
+
+    def is_done(self, shard):
+        return os.path.exists(self._path(shard, ".done"))
+
+    def claim(self, worker=None, stale_after=None):
+        """Claim the next shard that isn't finished or claimed by another worker.
+
+        Parameters
+        ----------
+        worker : str, optional
+            Name of the worker, recorded in the lock. Default is the host name and process ID.
+        stale_after : float, optional
+            Age in seconds after which another worker's claim is assumed to be from a worker that died and
+            is taken over. Default is None (claims never go stale, remove the locks by hand instead).
+
+        Returns
+        -------
+        manifest : dict or None
+            Manifest of the claimed shard (see :meth:`shard`), or None if there are no shards left
+        """
+        worker = f"{socket.gethostname()}:{os.getpid()}" if worker is None else worker
+        for shard in range(self.n_shards):
+            if self.is_done(shard):
+                continue
+
+            lock_path = self._path(shard, ".lock")
+            if stale_after is not None and os.path.exists(lock_path):
+                self._take_stale(lock_path, stale_after)
+
+            try:
+                fd = os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            except FileExistsError:
+                continue
+            with os.fdopen(fd, "w") as f:
+                json.dump({"worker": worker, "claimed": time.time()}, f)
+
+            # the shard may have finished between checking and claiming it
+            if self.is_done(shard):
+                os.remove(lock_path)
+                continue
+            return self.shard(shard)
+        return None
+
+    @staticmethod
+    def _take_stale(lock_path, stale_after):
+        """Remove a lock if it is stale, safely when several workers try at once.
+
+        Checking the age and then removing the lock would race (another worker could take over the stale
+        lock in between, and its fresh lock would be removed instead), so the lock is moved aside with an
+        atomic rename to a name unique to this attempt. Only one worker's rename can succeed, and the moved
+        lock is checked again to make sure it was the stale one.
+        """
+        try:
+            if time.time() - os.path.getmtime(lock_path) <= stale_after:
+                return
+            stale_path = f"{lock_path}.{uuid.uuid4().hex}.stale"
+            os.rename(lock_path, stale_path)
+        except FileNotFoundError:
+            # released, or another worker moved it first
+            return
+
+        if time.time() - os.path.getmtime(stale_path) <= stale_after:
+            # a fresh lock was taken between the check and the rename, so put it back (unless yet another
+            # worker has claimed the shard since, in which case the shard is claimed either way)
+            try:
+                os.link(stale_path, lock_path)
+            except FileExistsError:
+                pass
+        os.remove(stale_path)
+
+    def heartbeat(self, shard):
+        """Refresh a claim so that it doesn't go stale during a long shard."""
+        os.utime(self._path(shard, ".lock"))
+
+    def release(self, shard):
+        """Give up the claim on a shard (e.g. after it failed) so another worker can take it."""
+        try:
+            os.remove(self._path(shard, ".lock"))
+        except FileNotFoundError:
+            pass
+
+    def mark_done(self, shard, outputs, **info):
+        """Record that a shard has finished, along with its output files and any other information."""
+        manifest = self.shard(shard)
+        _write_json(self._path(shard, ".done"), {**manifest, "outputs": outputs, "finished": time.time(),
+                                                 **info})
+        self.release(shard)
+
+    def done_info(self, shard):
+        with open(self._path(shard, ".done")) as f:
+            return json.load(f)
+
+    def status(self):
+        """Lists of the shards that are done, claimed (in progress) and pending."""
+        status = {"done": [], "claimed": [], "pending": []}
+        for shard in range(self.n_shards):
+            if self.is_done(shard):
+                status["done"].append(shard)
+            elif os.path.exists(self._path(shard, ".lock")):
+                status["claimed"].append(shard)
+            else:
+                status["pending"].append(shard)
+        return status
+
+    def check_coverage(self):
+        """Check that the finished shards cover every row exactly once.
+
+        Returns
+        -------
+        done : list of dict
+            Done records (see :meth:`mark_done`) of every shard, in row order
+
+        Raises
+        ------
+        ValueError
+            If any shards are unfinished or the finished shards leave gaps or overlap
+        """
+        status = self.status()
+        if status["claimed"] or status["pending"]:
+            n_unfinished = len(status["claimed"]) + len(status["pending"])
+            raise ValueError(f"{n_unfinished} of {self.n_shards} shards are unfinished "
+                             f"(claimed: {status['claimed']}, pending: {status['pending']})")
+
+        done = sorted((self.done_info(shard) for shard in range(self.n_shards)), key=lambda d: d["start"])
+        expected_start = 0
+        for record in done:
+            if record["start"] != expected_start:
+                raise ValueError(f"Shard {record['shard']} starts at row {record['start']} but the previous "
+                                 f"shard ended at row {expected_start}")
+            expected_start = record["stop"]
+        if expected_start != self.n_rows:
+            raise ValueError(f"Shards end at row {expected_start} but there are {self.n_rows} rows")
+        return done
+
+    def outputs(self, kind):
+        """Output files of a given kind of every shard, in row order (after checking coverage)."""
+        return [record["outputs"][kind] for record in self.check_coverage()]
+
+
+def _write_json(path, data):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(data, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def run_worker(plan, work, worker=None, stale_after=None, max_shards=None, heartbeat_every=None):
+    """Claim and process shards until there are none left.
+
+    Parameters
+    ----------
+    plan : :class:`ShardPlan`
+        Plan of the run
+    work : callable
+        Called with the manifest of each claimed shard (see :meth:`ShardPlan.shard`), must save its outputs
+        and return a tuple of a dict of output files and a dict of any other information to record
+    worker : str, optional
+        Name of the worker. Default is the host name and process ID.
+    stale_after : float, optional
+        See :meth:`ShardPlan.claim`
+    max_shards : int, optional
+        Stop after this many shards (e.g. to fit in a job's time limit). Default is no limit.
+    heartbeat_every : float, optional
+        Seconds between refreshes of the claim (see :meth:`ShardPlan.heartbeat`) while a shard is worked on,
+        which must be well below the ``stale_after`` of every worker. Default is a quarter of
+        ``stale_after``, or 60 seconds if it is None.
+
+    Returns
+    -------
+    n_done : int
+        Number of shards this worker finished
+    """
+    if heartbeat_every is None:
+        heartbeat_every = 60.0 if stale_after is None else stale_after / 4
+
+    n_done = 0
+    while max_shards is None or n_done < max_shards:
+        manifest = plan.claim(worker=worker, stale_after=stale_after)
+        if manifest is None:
+            break
+
+        start = time.time()
+        print(f"Working on shard {manifest['shard']} (rows {manifest['start']}-{manifest['stop']})")
+        stop = threading.Event()
+        heartbeat = threading.Thread(target=_heartbeat, args=(plan, manifest["shard"], heartbeat_every, stop),
+                                     daemon=True)
+        heartbeat.start()
+        try:
+            outputs, info = work(manifest)
+        except BaseException:
+            # let another worker try it
+            plan.release(manifest["shard"])
+            raise
+        finally:
+            stop.set()
+            heartbeat.join()
+        plan.mark_done(manifest["shard"], outputs, wall_time=time.time() - start, **info)
+        n_done += 1
+    return n_done
+
+
+def _heartbeat(plan, shard, interval, stop):
+    """Refresh the claim on a shard every ``interval`` seconds until ``stop`` is set."""
+    while not stop.wait(interval):
+        try:
+            plan.heartbeat(shard)
+        except FileNotFoundError:
+            print(f"Warning: the claim on shard {shard} was taken over by another worker")
+            return
@@ -0,0 +1,266 @@
+import numpy as np
+import pandas as pd
+from cosmic.evolve import Evolve
+
+import hashlib
+import json
+import os
+
+from cache import DEFAULT_CACHE_DIR
+
+
+KICK_COLUMNS = ["natal_kick_1", "phi_1", "theta_1", "natal_kick_2", "phi_2", "theta_2"]
+
+# columns that are set for each grid point, so don't depend on the population
+GRID_COLUMNS = ["bin_num", "mass_1", "mass_2", "mass0_1", "mass0_2", "kstar_1", "kstar_2", "porb", "ecc",
+                "metallicity", "tphysf"] + KICK_COLUMNS
+
+
+def _to_json(obj):
+    return obj.tolist() if hasattr(obj, "tolist") else str(obj)
+
+
+class SingleStarTable():
+    """Outcome of isolated single-star evolution on a grid of initial mass and metallicity.
+
+    An isolated star's fate only depends on its mass, metallicity and the stellar evolution settings, so
+    evolving a small grid of single stars once is enough to tell which stars of a population could possibly
+    end up as a neutron star or black hole. Only those candidates need to go through COSMIC (see
+    :meth:`candidates`).
+
+    Parameters
+    ----------
+    masses : :class:`~numpy.ndarray`, shape (n_mass,)
+        Initial masses of the grid in Msun (increasing)
+    metallicities : :class:`~numpy.ndarray`, shape (n_Z,)
+        Metallicities of the grid (increasing)
+    kstar : :class:`~numpy.ndarray`, shape (n_mass, n_Z)
+        Final stellar type
+    remnant_mass : :class:`~numpy.ndarray`, shape (n_mass, n_Z)
+        Final mass in Msun
+    t_sn : :class:`~numpy.ndarray`, shape (n_mass, n_Z)
+        Time (Myr after birth) at which the star became a NS/BH, infinite if it never does
+    settings : dict, optional
+        Settings that the table was built with
+    """
+    def __init__(self, masses, metallicities, kstar, remnant_mass, t_sn, settings=None):
+        self.masses = np.asarray(masses, dtype=float)
+        self.metallicities = np.asarray(metallicities, dtype=float)
+        self.kstar = np.asarray(kstar)
+        self.remnant_mass = np.asarray(remnant_mass, dtype=float)
+        self.t_sn = np.asarray(t_sn, dtype=float)
+        self.settings = settings
+
+    def __repr__(self):
+        return (f"<SingleStarTable: {len(self.masses)}x{len(self.metallicities)}, "
+                f"{self.masses[0]:g}-{self.masses[-1]:g} Msun, "
+                f"Z={self.metallicities[0]:g}-{self.metallicities[-1]:g}>")
+
+    @property
+    def forms_co(self):
+        """Mask of grid points that end as a neutron star or black hole."""
+        return np.isin(self.kstar, [13, 14])
+
+    @classmethod
+    def build(cls, template, masses=np.geomspace(1, 150, 400), metallicities=np.geomspace(1e-4, 0.03, 16),
+              BSE_settings={}, SSE_settings={}, bpp_columns=None, pool=None, tphysf=13700.0):
+        """Evolve a grid of single stars with COSMIC.
+
+        Parameters
+        ----------
+        template : :class:`~pandas.Series`
+            A row of an initial binary table, which sets every column that isn't changed for the grid (so
+            any settings saved in the columns are respected)
+        masses : :class:`~numpy.ndarray`, optional
+            Initial masses in Msun. Default is 400 log-spaced masses from 1 to 150 Msun.
+        metallicities : :class:`~numpy.ndarray`, optional
+            Metallicities. Default is 16 log-spaced values from 1e-4 to 0.03 (the range cogsworth allows).
+        BSE_settings, SSE_settings : dict, optional
+            Settings for COSMIC, ignored when ``template`` already has settings in its columns
+        bpp_columns : list, optional
+            Columns for the bpp table, must include tphys, kstar_1 and mass_1. Default is COSMIC's.
+        pool : :class:`~multiprocessing.Pool`, optional
+            Pool to use for the evolution. Default is None (serial).
+        tphysf : float, optional
+            Time to evolve for in Myr, long enough for every star on the grid to finish. Default is 13700.
+
+        Returns
+        -------
+        table : :class:`SingleStarTable`
+        """
+        M, Z = np.meshgrid(masses, metallicities, indexing="ij")
+        n = M.size
+
+        grid = pd.DataFrame({col: np.repeat(template[col], n) for col in template.index}, index=np.arange(n))
+        grid["bin_num"] = np.arange(n)
+        grid["mass_1"] = M.ravel()
+        grid["kstar_1"] = np.where(M.ravel() < 0.7, 0, 1)
+        grid["mass_2"] = 0.0
+        grid["kstar_2"] = 15
+        for col in ["mass0_1", "mass0_2"]:
+            if col in grid:
+                grid[col] = grid["mass_" + col[-1]]
+        for col in KICK_COLUMNS:
+            if col in grid:
+                grid[col] = -100.0
+        grid["porb"] = 1e20
+        grid["ecc"] = 0.0
+        grid["metallicity"] = Z.ravel()
+        grid["tphysf"] = tphysf
+
+        # settings saved in the columns take precedence (cogsworth does the same)
+        if any(col in grid.columns for col in BSE_settings.keys()):
+            BSE_settings = {}
+        if any(col in grid.columns for col in SSE_settings.keys()):
+            SSE_settings = {}
+
+        evolve_kwargs = {"initialbinarytable": grid, "BSEDict": BSE_settings, "SSEDict": SSE_settings,
+                         "pool": pool}
+        if bpp_columns is not None:
+            evolve_kwargs["bpp_columns"] = bpp_columns
+        bpp = Evolve.evolve(**evolve_kwargs)[0]
+
+        final = bpp.drop_duplicates(subset="bin_num", keep="last").set_index("bin_num").reindex(np.arange(n))
+        co_rows = bpp[bpp["kstar_1"].isin([13, 14])]
+        t_sn = co_rows.groupby("bin_num")["tphys"].min().reindex(np.arange(n), fill_value=np.inf)
+
+        return cls(masses, metallicities,
+                   kstar=final["kstar_1"].values.reshape(M.shape).astype(int),
+                   remnant_mass=final["mass_1"].values.reshape(M.shape),
+                   t_sn=t_sn.values.reshape(M.shape),
+                   settings={"BSE_settings": BSE_settings, "SSE_settings": SSE_settings, "tphysf": tphysf})
+
+    @classmethod
+    def from_population(cls, pop, cache_dir=None, **kwargs):
+        """Get the table for a population's settings, building it (and caching it on disk) only if needed.
+
+        Parameters
+        ----------
+        pop : :class:`~cogsworth.pop.Population`
+            Population with sampled initial binaries
+        cache_dir : str, optional
+            Directory in which to cache tables. Default is ``$UNDERWORLD_CACHE`` or ``~/.cache/underworld``.
+        **kwargs
+            Passed to :meth:`build`
+
+        Returns
+        -------
+        table : :class:`SingleStarTable`
+        """
+        cache_dir = DEFAULT_CACHE_DIR if cache_dir is None else cache_dir
+        initC = pop.initial_binaries
+
+        # any column that is the same for every system could be a setting, so it's part of the key
+        template = initC.iloc[0]
+        constant = [col for col in initC.columns
+                    if col not in GRID_COLUMNS and (initC[col].values == template[col]).all()]
+        SSE_settings = getattr(pop, "SSE_settings", {})
+        settings = {"columns": {col: template[col] for col in constant},
+                    "BSE_settings": pop.BSE_settings, "SSE_settings": SSE_settings, "kwargs": kwargs}
+        key = hashlib.sha1(json.dumps(settings, sort_keys=True, default=_to_json).encode()).hexdigest()
+        path = os.path.join(cache_dir, f"singles-{key}.npz")
+
+        if os.path.exists(path):
+            return cls.load(path)
+
+        table = cls.build(template, BSE_settings=pop.BSE_settings, SSE_settings=SSE_settings,
+                          bpp_columns=pop.bpp_columns, pool=pop.pool, **kwargs)
+        os.makedirs(cache_dir, exist_ok=True)
+        table.save(path)
+        return table
+
+    def save(self, path):
+        # write to a temporary file first so that an interrupted write never leaves a corrupt table
+        tmp_path = path + ".tmp.npz"
+        np.savez(tmp_path, masses=self.masses, metallicities=self.metallicities, kstar=self.kstar,
+                 remnant_mass=self.remnant_mass, t_sn=self.t_sn,
+                 settings=json.dumps(self.settings, sort_keys=True, default=_to_json))
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as f:
+            return cls(f["masses"], f["metallicities"], f["kstar"], f["remnant_mass"], f["t_sn"],
+                       settings=json.loads(str(f["settings"])))
+
+    def _cells(self, mass, metallicity):
+        """Index of the grid cell (lower corner) containing each (mass, metallicity), clamped to the grid."""
+        i = np.searchsorted(self.masses, mass, side="right") - 1
+        j = np.searchsorted(self.metallicities, metallicity, side="right") - 1
+        return np.clip(i, 0, len(self.masses) - 2), np.clip(j, 0, len(self.metallicities) - 2)
+
+    def lookup(self, mass, metallicity):
+        """Interpolate the outcome of single-star evolution.
+
+        The remnant mass and supernova time are bilinearly interpolated in (log mass, log metallicity) and
+        the final type is taken from the nearest grid point.
+
+        Parameters
+        ----------
+        mass : :class:`~numpy.ndarray`
+            Initial masses in Msun
+        metallicity : :class:`~numpy.ndarray`
+            Metallicities
+
+        Returns
+        -------
+        kstar, remnant_mass, t_sn : :class:`~numpy.ndarray`
+            Final stellar type, final mass (Msun) and time of becoming a NS/BH (Myr, infinite if never)
+        """
+        mass, metallicity = np.asarray(mass, dtype=float), np.asarray(metallicity, dtype=float)
+        i, j = self._cells(mass, metallicity)
+        log_m, log_Z = np.log(self.masses), np.log(self.metallicities)
+        w_m = np.clip((np.log(mass) - log_m[i]) / (log_m[i + 1] - log_m[i]), 0, 1)
+        w_Z = np.clip((np.log(metallicity) - log_Z[j]) / (log_Z[j + 1] - log_Z[j]), 0, 1)
+
+        def interp(grid):
+            lo = grid[i, j] + w_Z * (grid[i, j + 1] - grid[i, j])
+            hi = grid[i + 1, j] + w_Z * (grid[i + 1, j + 1] - grid[i + 1, j])
+            return lo + w_m * (hi - lo)
+
+        kstar = self.kstar[i + np.round(w_m).astype(int), j + np.round(w_Z).astype(int)]
+        remnant_mass = interp(self.remnant_mass)
+        with np.errstate(invalid="ignore"):
+            t_sn = interp(self.t_sn)
+        t_sn[np.isnan(t_sn) | ~np.isin(kstar, [13, 14])] = np.inf
+        return kstar, remnant_mass, t_sn
+
+    def candidates(self, mass, metallicity, age, pad=1, time_margin=0.05):
+        """Conservative mask of stars that could be a neutron star or black hole by a given age.
+
+        A star is a candidate if any corner of its grid cell (or of the ``pad`` cells around it) forms a
+        NS/BH, and it is older than the earliest such supernova time (less ``time_margin``). Masses below the
+        grid are never candidates and those above it are treated like the most massive grid point.
+
+        Parameters
+        ----------
+        mass : :class:`~numpy.ndarray`
+            Initial masses in Msun
+        metallicity : :class:`~numpy.ndarray`
+            Metallicities
+        age : :class:`~numpy.ndarray`
+            Ages in Myr (i.e. ``tphysf``)
+        pad : int, optional
+            Number of extra grid cells to include in each direction, to catch narrow features (like the
+            electron-capture supernova window) that could fall between grid points. Default is 1.
+        time_margin : float, optional
+            Fractional margin on the supernova time. Default is 0.05.
+
+        Returns
+        -------
+        candidates : :class:`~numpy.ndarray`
+        """
+        mass, metallicity = np.asarray(mass, dtype=float), np.asarray(metallicity, dtype=float)
+
+        # earliest supernova time in the neighbourhood of every grid point (minimum filter)
+        t_co = np.where(self.forms_co, self.t_sn, np.inf)
+        t_co = np.pad(t_co, pad + 1, constant_values=np.inf)
+        t_min = np.full(self.t_sn.shape, np.inf)
+        n_m, n_Z = self.t_sn.shape
+        for di in range(-pad, pad + 2):
+            for dj in range(-pad, pad + 2):
+                np.minimum(t_min, t_co[pad + 1 + di:pad + 1 + di + n_m, pad + 1 + dj:pad + 1 + dj + n_Z],
+                           out=t_min)
+
+        i, j = self._cells(mass, metallicity)
+        return (mass >= self.masses[0]) & (np.asarray(age) >= t_min[i, j] * (1 - time_margin))
@@ -0,0 +1,170 @@
+import numpy as np
+import astropy.units as u
+from scipy.spatial import cKDTree
+
+from remnants import RemnantTable
+
+
+def probable_nearest_distance(density):
+    """Radius of the sphere that is expected to contain one object at a number density (Quantity)."""
+    return ((3 / (4 * np.pi * density))**(1 / 3)).to(u.pc)
+
+
+class SpatialIndex():
+    """Counts of compact objects in (many) regions of a galaxy without scanning every position each time.
+
+    The positions are indexed once in three trees and a sorted array:
+
+    - a KD-tree in :math:`(x, y, z)` for balls,
+    - a KD-tree in :math:`(R, z)`, in which a torus around the Galactic centre is just a circle,
+    - a KD-tree in :math:`(x, y)` for vertical cylinders,
+    - the sorted :math:`z` positions for slabs parallel to the disc.
+
+    Every query accepts arrays of centres (or radii) so thousands of trial volumes or observer positions
+    can be counted in one call. Counts are scaled up to the Milky Way with :attr:`scale_up` unless
+    ``scale=False``, and ``density=True`` divides by the volume to give a number density in
+    :math:`{\\rm pc^{-3}}`.
+
+    Parameters
+    ----------
+    pos : :class:`~astropy.units.Quantity` [length] or :class:`~numpy.ndarray`, shape (N, 3)
+        Galactocentric positions (in kpc if not a Quantity)
+    scale_up : float, optional
+        Factor by which to scale counts (e.g. ``6e10 / pop.mass_binaries``). Default is 1.
+    label : str, optional
+        Label of the population
+    """
+    def __init__(self, pos, scale_up=1.0, label=None):
+        pos = pos.to(u.kpc).value if hasattr(pos, "unit") else np.asarray(pos, dtype=float)
+        self.scale_up = scale_up
+        self.label = label
+        self.n = len(pos)
+
+        R = np.sqrt(pos[:, 0]**2 + pos[:, 1]**2)
+        self._xyz = cKDTree(pos)
+        self._Rz = cKDTree(np.transpose([R, pos[:, 2]]))
+        self._xy = cKDTree(pos[:, :2])
+        self._z = pos[:, 2].copy()
+        self._z_sorted = np.sort(self._z)
+
+    def __len__(self):
+        return self.n
+
+    def __repr__(self):
+        return (f"<SpatialIndex{'' if self.label is None else f' ({self.label})'}: {self.n} objects, "
+                f"scale up {self.scale_up:.1f}x>")
+
+    @classmethod
+    def from_population(cls, pop, co_type="CO", table=None, **kwargs):
+        """Index the compact objects of a population, scaling counts up to the Milky Way.
+
+        Parameters
+        ----------
+        pop : :class:`~cogsworth.pop.Population`
+            Population that has been through galactic evolution
+        co_type : str, optional
+            Type of compact object to index ("NS", "BH" or "CO"). Default is "CO".
+        table : :class:`~remnants.RemnantTable`, optional
+            Remnant table of the population (e.g. from :func:`~helpers.get_kinematics`). Default is to build
+            one, passing any other keyword arguments to :meth:`~remnants.RemnantTable.from_population`.
+
+        Returns
+        -------
+        index : :class:`SpatialIndex`
+        """
+        if table is None:
+            table = RemnantTable.from_population(pop, **kwargs)
+        return cls(table[co_type].pos, scale_up=6e10 / pop.mass_binaries, label=getattr(pop, "label", None))
+
+    def _result(self, counts, volume, scale, density):
+        counts = np.asarray(counts) * (self.scale_up if scale else 1)
+        if density:
+            return counts / volume.to(u.pc**3)
+        return counts
+
+    def ball(self, centres, radius, scale=True, density=False):
+        """Number of objects within ``radius`` of each centre.
+
+        Parameters
+        ----------
+        centres : :class:`~astropy.units.Quantity` [length], shape (3,) or (M, 3)
+            Galactocentric centres of the balls
+        radius : :class:`~astropy.units.Quantity` [length], shape () or (M,)
+            Radius of the balls
+        scale : bool, optional
+            Whether to scale the counts up to the Milky Way. Default is True.
+        density : bool, optional
+            Whether to return the number density in each ball rather than the count. Default is False.
+
+        Returns
+        -------
+        counts : :class:`~numpy.ndarray` or :class:`~astropy.units.Quantity`, shape () or (M,)
+        """
+        r = radius.to(u.kpc).value
+        counts = self._xyz.query_ball_point(centres.to(u.kpc).value, r, return_length=True)
+        return self._result(counts, 4 / 3 * np.pi * (r * u.kpc)**3, scale, density)
+
+    def torus(self, R, radius, z=0 * u.kpc, scale=True, density=False):
+        """Number of objects in tori around the Galactic centre (e.g. the solar circle).
+
+        Parameters
+        ----------
+        R : :class:`~astropy.units.Quantity` [length], shape () or (M,)
+            Major radius of the tori
+        radius : :class:`~astropy.units.Quantity` [length], shape () or (M,)
+            Minor radius of the tori
+        z : :class:`~astropy.units.Quantity` [length], shape () or (M,), optional
+            Height of the tori above the plane. Default is 0.
+        scale : bool, optional
+            Whether to scale the counts up to the Milky Way. Default is True.
+        density : bool, optional
+            Whether to return the number density in each torus rather than the count. Default is False.
+
+        Returns
+        -------
+        counts : :class:`~numpy.ndarray` or :class:`~astropy.units.Quantity`, shape () or (M,)
+        """
+        R, z, r = R.to(u.kpc).value, z.to(u.kpc).value, radius.to(u.kpc).value
+        centres = np.stack(np.broadcast_arrays(R, z), axis=-1)
+        counts = self._Rz.query_ball_point(centres, r, return_length=True)
+        return self._result(counts, 2 * np.pi**2 * R * r**2 * u.kpc**3, scale, density)
+
+    def cylinder(self, centres, radius, half_height, scale=True, density=False):
+        """Number of objects in vertical cylinders (e.g. a column around an observer).
+
+        The objects within ``radius`` in :math:`(x, y)` are found with the index and then cut in :math:`z`,
+        so this is slower than the other queries for very wide cylinders.
+
+        Parameters
+        ----------
+        centres : :class:`~astropy.units.Quantity` [length], shape (3,) or (M, 3)
+            Galactocentric centres of the cylinders
+        radius : :class:`~astropy.units.Quantity` [length]
+            Radius of the cylinders
+        half_height : :class:`~astropy.units.Quantity` [length]
+            Half of the height of the cylinders
+        scale : bool, optional
+            Whether to scale the counts up to the Milky Way. Default is True.
+        density : bool, optional
+            Whether to return the number density in each cylinder rather than the count. Default is False.
+
+        Returns
+        -------
+        counts : :class:`~numpy.ndarray` or :class:`~astropy.units.Quantity`, shape () or (M,)
+        """
+        centres = centres.to(u.kpc).value
+        r, h = radius.to(u.kpc).value, half_height.to(u.kpc).value
+        single = centres.ndim == 1
+        centres = np.atleast_2d(centres)
+
+        counts = np.zeros(len(centres), dtype=np.int64)
+        for i, inds in enumerate(self._xy.query_ball_point(centres[:, :2], r)):
+            counts[i] = np.count_nonzero(np.abs(self._z[inds] - centres[i, 2]) <= h)
+
+        return self._result(counts[0] if single else counts, 2 * np.pi * r**2 * h * u.kpc**3, scale, density)
+
+    def slab(self, z_min, z_max, scale=True):
+        """Number of objects with :math:`z_{\\rm min} \\leq z \\leq z_{\\rm max}`, for arrays of limits."""
+        lower = np.searchsorted(self._z_sorted, z_min.to(u.kpc).value, side="left")
+        upper = np.searchsorted(self._z_sorted, z_max.to(u.kpc).value, side="right")
+        return self._result(upper - lower, None, scale, False)
@@ -0,0 +1,222 @@
+import cogsworth
+
+import copy
+import itertools
+import multiprocessing
+import os
+import queue
+import time
+import traceback
+
+from writer import BackgroundWriter
+
+
+# the template shared with forked workers (inherited copy-on-write rather than pickled)
+_GLOBAL = {}
+
+
+def load_template(file_name):
+    """Load a template population once, ready to be shared by every variation of a sweep.
+
+    Parameters
+    ----------
+    file_name : str
+        Path to the template population
+
+    Returns
+    -------
+    template : :class:`~cogsworth.pop.Population`
+    """
+    template = cogsworth.pop.load(file_name)
+
+    # convert columns back to strings
+    template.bpp_columns = [col.decode("utf-8") if isinstance(col, bytes) else col
+                            for col in template.bpp_columns]
+
+    # load everything a variation needs now, so that forked workers share it rather than each reading it
+    template.initial_binaries
+    template.initial_galaxy
+    return template
+
+
+def parameter_grid(mode="product", **values):
+    """Build a list of variations from lists of values for each setting.
+
+    Parameters
+    ----------
+    mode : str, optional
+        Either "product" (every combination of the values) or "zip" (the i-th value of every setting
+        together, so all lists must be the same length). Default is "product".
+    **values
+        List of values for each setting
+
+    Returns
+    -------
+    variations : list of dict
+        Settings of each variation
+
+    Raises
+    ------
+    ValueError
+        If ``mode`` is unknown, or lists have different lengths with ``mode="zip"``.
+    """
+    names = list(values)
+    if mode == "product":
+        combos = itertools.product(*values.values())
+    elif mode == "zip":
+        if len(set(len(v) for v in values.values())) > 1:
+            raise ValueError("Every setting must have the same number of values when `mode='zip'`")
+        combos = zip(*values.values())
+    else:
+        raise ValueError(f"Unknown mode '{mode}', choose from ['product', 'zip']")
+    return [dict(zip(names, combo)) for combo in combos]
+
+
+def variation_name(prefix, overrides):
+    """Deterministic name of a variation, e.g. ``binaries-kickflag-5-ecsn-0``."""
+    return "-".join([prefix] + [f"{key}-{value}" for key, value in overrides.items()])
+
+
+def apply_overrides(template, overrides):
+    """Create a population from the template with some settings changed.
+
+    The new population is a shallow copy of the template with its own initial binary table, so everything
+    else (e.g. the initial galaxy) is shared rather than copied. Settings that are columns of the initial
+    binary table are changed there, anything else is added to ``BSE_settings``.
+
+    Parameters
+    ----------
+    template : :class:`~cogsworth.pop.Population`
+        Template population
+    overrides : dict
+        Settings to change
+
+    Returns
+    -------
+    pop : :class:`~cogsworth.pop.Population`
+    """
+    pop = copy.copy(template)
+    pop._initial_binaries = template.initial_binaries.copy()
+    pop.BSE_settings = dict(template.BSE_settings)
+    for key, value in overrides.items():
+        if key in pop._initial_binaries.columns:
+            pop._initial_binaries[key] = value
+        else:
+            pop.BSE_settings[key] = value
+    return pop
+
+
+def _run_variation(run, name, overrides, file_name, processes, results):
+    start = time.time()
+    try:
+        pop = apply_overrides(_GLOBAL["template"], overrides)
+        pop.processes = processes
+        writer = BackgroundWriter(verbose=False)
+        run(pop, file_name, writer)
+        del pop
+
+        # free up the slot for the next variation while the outputs are still being written
+        results.put((name, "computed", None, time.time() - start))
+        writer.flush()
+        results.put((name, "finished", None, time.time() - start))
+    except Exception:
+        results.put((name, "finished", traceback.format_exc(), time.time() - start))
+
+
+def run_sweep(template, variations, run, output_dir, prefix, processes=32, processes_per_variation=8,
+              skip_existing=False):
+    """Run a set of variations of a template population concurrently.
+
+    Each variation runs in its own forked process, which inherits the template copy-on-write so it is
+    loaded only once. As many variations run at once as fit in the core budget. Outputs written through
+    the :class:`~writer.BackgroundWriter` passed to ``run`` don't count towards the budget, so the next
+    variation starts while the previous one is still being saved.
+
+    Parameters
+    ----------
+    template : :class:`~cogsworth.pop.Population`
+        Template population (see :func:`load_template`)
+    variations : list of dict
+        Settings to change for each variation (see :func:`parameter_grid`)
+    run : callable
+        Function that takes the population of a variation, the file name for its output and a
+        :class:`~writer.BackgroundWriter`, and does whatever the variation needs (e.g. stellar evolution,
+        galactic evolution and saving)
+    output_dir : str
+        Directory for the outputs
+    prefix : str
+        Prefix of the output names (see :func:`variation_name`)
+    processes : int, optional
+        Total number of cores to use. Default is 32.
+    processes_per_variation : int, optional
+        Number of processes each variation may use. Default is 8.
+    skip_existing : bool, optional
+        Whether to skip variations whose output already exists. Default is False.
+
+    Returns
+    -------
+    file_names : dict
+        Output file name of each variation, keyed by its name
+
+    Raises
+    ------
+    ValueError
+        If two variations have the same name.
+    RuntimeError
+        If any variation fails (after every variation has finished).
+    """
+    names = [variation_name(prefix, overrides) for overrides in variations]
+    if len(set(names)) < len(names):
+        raise ValueError("Every variation must have a unique name, check for duplicate variations")
+    file_names = {name: os.path.join(output_dir, name) for name in names}
+    os.makedirs(output_dir, exist_ok=True)
+
+    pending = [(name, overrides) for name, overrides in zip(names, variations)
+               if not (skip_existing and os.path.exists(file_names[name] + ".h5"))]
+    n_concurrent = max(1, processes // processes_per_variation)
+    print(f"Running {len(pending)} variation(s), {n_concurrent} at a time with "
+          f"{processes_per_variation} processes each")
+
+    _GLOBAL["template"] = template
+    ctx = multiprocessing.get_context("fork")
+    results = ctx.Queue()
+
+    # variations that are running use a slot, those that are only writing their outputs do not
+    running, writing, errors = {}, {}, {}
+    while pending or running or writing:
+        while pending and len(running) < n_concurrent:
+            name, overrides = pending.pop(0)
+            proc = ctx.Process(target=_run_variation, args=(run, name, overrides, file_names[name],
+                                                            processes_per_variation, results))
+            proc.start()
+            running[name] = proc
+
+        try:
+            name, stage, error, wall_time = results.get(timeout=10)
+        except queue.Empty:
+            # catch variations that died without reporting back (e.g. killed for using too much memory)
+            for procs in [running, writing]:
+                for name, proc in list(procs.items()):
+                    if not proc.is_alive() and proc.exitcode != 0:
+                        errors[name] = f"Process exited with code {proc.exitcode}"
+                        print(f"   {name} failed: {errors[name]}")
+                        procs.pop(name)
+            continue
+
+        if stage == "computed":
+            writing[name] = running.pop(name)
+            print(f"   Computed {name} in {wall_time:1.2f} seconds, now writing outputs")
+            continue
+
+        proc = running.pop(name) if name in running else writing.pop(name)
+        proc.join()
+        if error is None:
+            print(f"   Finished {name} in {wall_time:1.2f} seconds")
+        else:
+            errors[name] = error
+            print(f"   {name} failed after {wall_time:1.2f} seconds:\n{error}")
+
+    _GLOBAL.pop("template")
+    if errors:
+        raise RuntimeError(f"{len(errors)} variation(s) failed: {list(errors)}")
+    return file_names
@@ -0,0 +1,188 @@
+import numpy as np
+import pandas as pd
+import astropy.units as u
+import gala.integrate as gi
+
+import time
+
+import orbits
+
+
+# integrators and timesteps (Myr) to try, gala can't use RK5Integrator with compiled potentials (every orbit
+# fails) so it is left out, though it can still be passed as a candidate
+DEFAULT_CANDIDATES = [
+    (gi.LeapfrogIntegrator, 2.0), (gi.LeapfrogIntegrator, 1.0), (gi.LeapfrogIntegrator, 0.5),
+    (gi.LeapfrogIntegrator, 0.1),
+    (gi.DOPRI853Integrator, 5.0), (gi.DOPRI853Integrator, 2.0), (gi.DOPRI853Integrator, 1.0),
+]
+
+
+def _energy(potential, pos, vel):
+    """Specific orbital energy in (km/s)^2 of positions in kpc and velocities in km/s, both (N, 3)."""
+    phi = potential.energy(pos.T * u.kpc).to(u.km**2 / u.s**2).value
+    return phi + 0.5 * np.sum(vel**2, axis=1)
+
+
+def compare_integrators(pos, vel, t1, t2, potential, candidates=DEFAULT_CANDIDATES, n_sample=500,
+                        reference=(gi.DOPRI853Integrator, 0.05), seed=None, **integrate_kwargs):
+    """Measure the accuracy and cost of integrators and timesteps on a random sample of orbits.
+
+    Every candidate integrates the same sample with :func:`~orbits.integrate_orbits` (so failures are
+    retried exactly as they would be in production) and is compared to a high-accuracy reference
+    integration of the sample.
+
+    The cost is timed separately, on the sample as a single block of orbits that share the median start
+    time, integrated in this process. This is how production chunks are integrated, whereas the sampled
+    start times are almost all different (so nearly every chunk would hold one orbit) and a pool of workers
+    would add its own start-up time to every candidate.
+
+    Parameters
+    ----------
+    pos : :class:`~astropy.units.Quantity` [length], shape (N, 3)
+        Initial galactocentric positions of every orbit
+    vel : :class:`~astropy.units.Quantity` [velocity], shape (N, 3)
+        Initial galactocentric velocities of every orbit
+    t1 : :class:`~astropy.units.Quantity` [time], shape (N,)
+        Start time of each orbit
+    t2 : :class:`~astropy.units.Quantity` [time]
+        End time of the orbits
+    potential : :class:`~gala.potential.potential.PotentialBase`
+        Potential in which to integrate the orbits
+    candidates : list of tuple, optional
+        (Integrator, timestep in Myr) pairs to try. Default is :data:`DEFAULT_CANDIDATES`.
+    n_sample : int, optional
+        Number of orbits in the sample. Default is 500.
+    reference : tuple, optional
+        (Integrator, timestep in Myr) of the reference integration. Default is DOPRI853 with 0.05 Myr.
+    seed : int, optional
+        Random seed for picking the sample. Default is None.
+    **integrate_kwargs
+        Passed to :func:`~orbits.integrate_orbits` for the accuracy runs (e.g. ``processes``)
+
+    Returns
+    -------
+    results : :class:`~pandas.DataFrame`
+        One row per candidate with the wall time per orbit, the median, 99th percentile and maximum relative
+        error in final position and relative energy drift, the number of failed orbits and the number of
+        retries. The errors of every orbit in the sample are in the ``pos_err`` and ``energy_drift``
+        columns (NaN for failed orbits).
+    """
+    rng = np.random.default_rng(seed)
+    sample = rng.choice(len(pos), size=min(n_sample, len(pos)), replace=False)
+    pos, vel, t1 = pos[sample], vel[sample], np.atleast_1d(t1)[sample]
+    integrate_kwargs.setdefault("progress_bar", False)
+
+    def run(Integrator, dt):
+        final_pos, final_vel, info = orbits.integrate_orbits(pos=pos, vel=vel, t1=t1, t2=t2,
+                                                             potential=potential, dt=dt * u.Myr,
+                                                             Integrator=Integrator, return_info=True,
+                                                             **integrate_kwargs)
+        return final_pos.to(u.kpc).value, final_vel.to(u.km / u.s).value, info
+
+    # every orbit of the timing block starts together, so it is integrated as one chunk
+    block_t1 = np.full(len(sample), np.median(t1.to(u.Myr).value)) * u.Myr
+
+    def time_block(Integrator, dt):
+        start = time.perf_counter()
+        orbits.integrate_orbits(pos=pos, vel=vel, t1=block_t1, t2=t2, potential=potential, dt=dt * u.Myr,
+                                Integrator=Integrator, chunk_size=len(sample), processes=1,
+                                progress_bar=False)
+        return (time.perf_counter() - start) / len(sample)
+
+    ref_pos, ref_vel, _ = run(*reference)
+    e_start = _energy(potential, pos.to(u.kpc).value, vel.to(u.km / u.s).value)
+    ref_norm = np.linalg.norm(ref_pos, axis=1)
+
+    def summarise(name, values):
+        ok = np.isfinite(values)
+        if not ok.any():
+            return {f"{name}_median": np.nan, f"{name}_p99": np.nan, f"{name}_max": np.nan}
+        return {f"{name}_median": np.median(values[ok]), f"{name}_p99": np.quantile(values[ok], 0.99),
+                f"{name}_max": values[ok].max()}
+
+    rows = []
+    for Integrator, dt in candidates:
+        final_pos, final_vel, info = run(Integrator, dt)
+        pos_err = np.linalg.norm(final_pos - ref_pos, axis=1) / ref_norm
+        drift = np.abs(_energy(potential, final_pos, final_vel) / e_start - 1)
+        rows.append({
+            "integrator": Integrator.__name__,
+            "dt": dt,
+            "time_per_orbit": time_block(Integrator, dt),
+            **summarise("pos_err", pos_err),
+            **summarise("energy_drift", drift),
+            "n_failed": info["n_failed"],
+            "n_retries": info["n_retries"],
+            "pos_err": pos_err,
+            "energy_drift": drift,
+            "Integrator": Integrator,
+        })
+    return pd.DataFrame(rows)
+
+
+def fraction_over_tolerance(results, pos_tol=1e-2, energy_tol=1e-3):
+    """Fraction of the orbits of each candidate in :func:`compare_integrators` that miss either tolerance.
+
+    Failed orbits count as missing the tolerances.
+
+    Returns
+    -------
+    fraction : :class:`~pandas.Series`
+        Fraction of the sample of each candidate (indexed like ``results``)
+    """
+    # NaN comparisons are False, so failed orbits are never "within" tolerance
+    return pd.Series([np.mean(~((pos_err <= pos_tol) & (drift <= energy_tol)))
+                      for pos_err, drift in zip(results["pos_err"], results["energy_drift"])],
+                     index=results.index)
+
+
+def choose_integrator(results, pos_tol=1e-2, energy_tol=1e-3, quantity="p99", verbose=True):
+    """Pick the cheapest integrator and timestep from :func:`compare_integrators` that meets a tolerance.
+
+    Parameters
+    ----------
+    results : :class:`~pandas.DataFrame`
+        Output of :func:`compare_integrators`
+    pos_tol : float, optional
+        Largest acceptable relative error in final position. Default is 1e-2.
+    energy_tol : float, optional
+        Largest acceptable relative energy drift. Default is 1e-3.
+    quantity : str, optional
+        Whether the tolerances apply to the "median", the 99th percentile ("p99") or the "max" error over
+        the sample. Default is "p99", so that a tail of bad orbits can't pass behind a good median.
+    verbose : bool, optional
+        Whether to print the comparison and the choice. Default is True.
+
+    Returns
+    -------
+    Integrator : :class:`~gala.integrate.Integrator`
+        Chosen integrator
+    dt : :class:`~astropy.units.Quantity` [time]
+        Chosen timestep
+
+    Raises
+    ------
+    ValueError
+        If no candidate meets the tolerances (or any of its orbits failed)
+    """
+    frac_over = fraction_over_tolerance(results, pos_tol=pos_tol, energy_tol=energy_tol)
+    passed = results[(results[f"pos_err_{quantity}"] <= pos_tol)
+                     & (results[f"energy_drift_{quantity}"] <= energy_tol)
+                     & (results["n_failed"] == 0)]
+
+    if verbose:
+        table = (results.drop(columns=["Integrator", "pos_err", "energy_drift"])
+                 .assign(frac_over_tol=frac_over))
+        print(table.to_string(index=False, float_format="{:.2e}".format))
+
+    if len(passed) == 0:
+        raise ValueError(f"No integrator meets the tolerances (position {pos_tol:.0e}, "
+                         f"energy {energy_tol:.0e}) at the {quantity} error")
+
+    best_index = passed["time_per_orbit"].idxmin()
+    best = passed.loc[best_index]
+    if verbose:
+        print(f"Chose {best['integrator']} with dt={best['dt']} Myr ({best['time_per_orbit'] * 1e3:.2f} ms "
+              f"per orbit, {quantity} position error {best[f'pos_err_{quantity}']:.1e}, "
+              f"{frac_over[best_index]:.2%} of orbits over tolerance)")
+    return best["Integrator"], best["dt"] * u.Myr
@@ -0,0 +1,123 @@
+import multiprocessing
+import queue
+import time
+import traceback
+
+
+def _write(func, args, kwargs, label, errors):
+    try:
+        func(*args, **kwargs)
+    except Exception:
+        errors.put((label, traceback.format_exc()))
+        raise SystemExit(1)
+
+
+class BackgroundWriter():
+    """Save populations and tables in the background while the next stage of a script runs.
+
+    Each write runs in a forked process, which gets a copy-on-write snapshot of the object being saved (so
+    nothing is pickled and the object can be deleted or changed straight away). At most ``max_pending``
+    writes run at once, after which :meth:`submit` blocks until the oldest one finishes, which bounds the
+    extra memory that the snapshots can use.
+
+    Errors in the background writes are printed as soon as they are noticed and raised as a
+    :class:`RuntimeError` by :meth:`flush` (which also runs at the end of a ``with`` block).
+
+    Parameters
+    ----------
+    max_pending : int, optional
+        Maximum number of writes in progress at once. Default is 2.
+    verbose : bool, optional
+        Whether to print when each write finishes. Default is True.
+
+    Attributes
+    ----------
+    writes : list of dict
+        Label, time from submission to completion (s) and success of every finished write
+    """
+    def __init__(self, max_pending=2, verbose=True):
+        self.max_pending = max_pending
+        self.verbose = verbose
+        self.errors = {}
+        self.writes = []
+        self._ctx = multiprocessing.get_context("fork")
+        self._error_queue = self._ctx.Queue()
+        self._pending = []
+
+    def __repr__(self):
+        return f"<BackgroundWriter: {len(self._pending)} pending write(s), {len(self.errors)} error(s)>"
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        # don't hide an exception from the block itself with one from the writes
+        self.flush(raise_errors=exc_type is None)
+
+    def submit(self, func, *args, label=None, **kwargs):
+        """Call ``func(*args, **kwargs)`` in the background.
+
+        Parameters
+        ----------
+        func : callable
+            Function that does the writing
+        *args, **kwargs
+            Arguments for ``func``
+        label : str, optional
+            Label for the write in messages. Default is the name of ``func``.
+        """
+        while len(self._pending) >= self.max_pending:
+            self._wait_oldest()
+
+        label = getattr(func, "__qualname__", repr(func)) if label is None else label
+        proc = self._ctx.Process(target=_write, args=(func, args, kwargs, label, self._error_queue))
+        proc.start()
+        self._pending.append((label, proc, time.time()))
+
+    def save(self, obj, file_name, **kwargs):
+        """Call ``obj.save(file_name, **kwargs)`` (e.g. for a :class:`~cogsworth.pop.Population`) in the
+        background."""
+        self.submit(obj.save, file_name, label=file_name, **kwargs)
+
+    def to_hdf(self, df, file_name, **kwargs):
+        """Call ``df.to_hdf(file_name, **kwargs)`` for a :class:`~pandas.DataFrame` in the background."""
+        self.submit(df.to_hdf, file_name, label=file_name, **kwargs)
+
+    def _wait_oldest(self):
+        label, proc, start = self._pending.pop(0)
+        proc.join()
+        self.writes.append({"label": label, "wall_time": time.time() - start, "ok": proc.exitcode == 0})
+        if proc.exitcode == 0:
+            if self.verbose:
+                print(f"   Finished writing {label} in {time.time() - start:1.2f} seconds (in background)")
+            return
+
+        # the traceback may not have arrived yet if the process was killed (e.g. for memory)
+        try:
+            while True:
+                failed_label, error = self._error_queue.get(timeout=1)
+                self.errors[failed_label] = error
+        except queue.Empty:
+            pass
+        self.errors.setdefault(label, f"Writing process exited with code {proc.exitcode}")
+        print(f"   Failed to write {label}:\n{self.errors[label]}")
+
+    def flush(self, raise_errors=True):
+        """Wait for every write to finish.
+
+        Parameters
+        ----------
+        raise_errors : bool, optional
+            Whether to raise an error if any write failed. Default is True.
+
+        Raises
+        ------
+        RuntimeError
+            If any write (since the last flush) failed.
+        """
+        while self._pending:
+            self._wait_oldest()
+
+        if self.errors and raise_errors:
+            errors, self.errors = self.errors, {}
+            raise RuntimeError(f"{len(errors)} background write(s) failed: {list(errors)}")